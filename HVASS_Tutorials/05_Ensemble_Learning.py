@@ -965,6 +965,24 @@ print_labels_best_net(idx=best_net_better, num=1)
 print_labels_all_nets(idx=best_net_better)
 
 
+# ## Vectorized Ensemble
+#
+# The networks above are optimized one after another and the checkpoint of each network must be restored before it can be used for prediction. The `Ensemble`-class in `ensemble.py` instead stacks the variables of all the networks in a single graph, so one call to `session.run()` optimizes all the networks, and one call per batch calculates the predicted labels of all the networks.
+#
+# The networks that were saved above can be loaded into the vectorized ensemble all at once.
+
+# In[ ]:
+
+from ensemble import Ensemble
+
+vectorized = Ensemble(num_members=num_networks)
+vectorized.load_members([get_save_path(i) for i in range(num_networks)])
+vectorized_pred_labels, vectorized_ensemble_pred_labels = vectorized.predict_labels(data.test.images)
+np.mean(np.argmax(vectorized_ensemble_pred_labels, axis=1) == data.test.cls)
+
+
+# The networks can also be trained together with `vectorized.optimize()`, where each network still gets its own random training-set. No timings are reported here: whether this is faster than training the networks one after another depends on the hardware, and `python ensemble.py` runs the function `benchmark()` which measures the wall-clock time of the two approaches.
+
 # ## Close TensorFlow Session
 
 # We are now done using TensorFlow, so we close the session to release its resources.
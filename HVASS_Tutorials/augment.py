@@ -0,0 +1,296 @@
+########################################################################
+#
+# Batched random distortions of images for Tutorial #06.
+#
+# Tutorial #06 distorts the training-images with tf.map_fn, which runs
+# the crop, flip, hue, contrast, brightness and saturation ops once per
+# image inside every optimization step. The functions here distort the
+# whole batch at once, in the same order: the random crops and flips are
+# a single gather and the colour-jitter is elementwise math with one
+# random factor per image, so the number of ops does not grow with the
+# batch-size.
+#
+# The distortion can also run in a background thread which fills a
+# queue with distorted batches while the optimizer is running.
+#
+# Implemented in Python 3.5
+#
+########################################################################
+
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+########################################################################
+# Random distortions, the same as pre_process_image() in Tutorial #06.
+
+# Maximum change of the hue.
+hue_max_delta = 0.05
+
+# Range of the contrast-factor.
+contrast_lower, contrast_upper = 0.3, 1.0
+
+# Maximum change of the brightness.
+brightness_max_delta = 0.2
+
+# Range of the saturation-factor.
+saturation_lower, saturation_upper = 0.0, 2.0
+
+
+########################################################################
+
+
+def _random_factors(batch_size, minval, maxval):
+    """
+    Return one random factor per image with shape [batch_size, 1, 1, 1]
+    so it broadcasts over the pixels and channels of each image.
+    """
+
+    return tf.random_uniform([batch_size, 1, 1, 1], minval=minval, maxval=maxval)
+
+
+def crop_and_flip_images(images, crop_size):
+    """
+    Randomly crop and horizontally flip a batch of images with one gather.
+
+    :param images:
+        4-dim tensor with shape [batch, height, width, channels].
+
+    :param crop_size:
+        Height and width of the cropped images.
+
+    :return:
+        4-dim tensor with shape [batch, crop_size, crop_size, channels].
+    """
+
+    shape = tf.shape(images)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+
+    # Random top-left corner of the crop for each image.
+    offset_y = tf.random_uniform([batch_size], maxval=height - crop_size + 1, dtype=tf.int32)
+    offset_x = tf.random_uniform([batch_size], maxval=width - crop_size + 1, dtype=tf.int32)
+
+    # Pixel-rows and -columns of the crop for each image, with shape [batch, crop_size].
+    # The columns of the flipped images are simply taken in reverse order.
+    steps = tf.range(crop_size)
+    rows = tf.expand_dims(offset_y, 1) + steps
+    cols = tf.expand_dims(offset_x, 1) + steps
+    flip = tf.random_uniform([batch_size]) < 0.5
+    cols = tf.where(flip, tf.reverse(cols, axis=[1]), cols)
+
+    # Indices [image, row, column] of every pixel in the output.
+    image_idx = tf.tile(tf.reshape(tf.range(batch_size), [-1, 1, 1]), [1, crop_size, crop_size])
+    row_idx = tf.tile(tf.expand_dims(rows, 2), [1, 1, crop_size])
+    col_idx = tf.tile(tf.expand_dims(cols, 1), [1, crop_size, 1])
+    indices = tf.stack([image_idx, row_idx, col_idx], axis=3)
+
+    return tf.gather_nd(images, indices)
+
+
+def _adjust_hsv(images, adjust):
+    """
+    Convert a batch of RGB images to HSV, apply adjust(hue, saturation)
+    to the channels and convert the result back to RGB.
+    """
+
+    hue, saturation, value = tf.unstack(tf.image.rgb_to_hsv(images), axis=3)
+    hue, saturation = adjust(hue, saturation)
+    return tf.image.hsv_to_rgb(tf.stack([hue, saturation, value], axis=3))
+
+
+def jitter_colors(images):
+    """
+    Randomly adjust the hue, contrast, brightness and saturation
+    of a batch of RGB images with pixels between 0.0 and 1.0,
+    in that order as in pre_process_image().
+    """
+
+    batch_size = tf.shape(images)[0]
+
+    # Hue.
+    hue_delta = _random_factors(batch_size, -hue_max_delta, hue_max_delta)[:, :, :, 0]
+    images = _adjust_hsv(images, lambda hue, saturation: (tf.mod(hue + hue_delta + 1.0, 1.0), saturation))
+
+    # Contrast is scaled around the mean of each channel in each image.
+    mean = tf.reduce_mean(images, axis=[1, 2], keep_dims=True)
+    contrast_factor = _random_factors(batch_size, contrast_lower, contrast_upper)
+    images = (images - mean) * contrast_factor + mean
+
+    # Brightness.
+    images = images + _random_factors(batch_size, -brightness_max_delta, brightness_max_delta)
+
+    # Saturation.
+    saturation_factor = _random_factors(batch_size, saturation_lower, saturation_upper)[:, :, :, 0]
+    images = _adjust_hsv(images, lambda hue, saturation: (hue, tf.clip_by_value(saturation * saturation_factor,
+                                                                                0.0, 1.0)))
+
+    # Limit the image pixels between [0, 1] in case of overflow.
+    return tf.clip_by_value(images, 0.0, 1.0)
+
+
+def distort_images(images, crop_size):
+    """
+    Randomly crop, flip and colour-jitter a batch of training-images.
+    """
+
+    return jitter_colors(crop_and_flip_images(images, crop_size))
+
+
+def crop_images(images, crop_size):
+    """
+    Crop a batch of test-images around the centre.
+    """
+
+    offset_y = (int(images.get_shape()[1]) - crop_size) // 2
+    offset_x = (int(images.get_shape()[2]) - crop_size) // 2
+
+    return images[:, offset_y:offset_y + crop_size, offset_x:offset_x + crop_size, :]
+
+
+########################################################################
+
+
+class BackgroundDistortion:
+    """
+    Distort random training-batches in a background thread.
+
+    The thread feeds random batches through distort_images() into a
+    queue, so the optimizer can use the tensors x_batch and y_batch
+    instead of feeding and distorting the images in the same step.
+    """
+
+    def __init__(self, session, images, labels, batch_size, crop_size, capacity=8):
+        """
+        :param session:
+            TensorFlow session. The graph of the session must be the default graph.
+
+        :param images:
+            Training-images, e.g. the array returned by cifar10.load_training_data().
+
+        :param labels:
+            One-hot encoded labels for the training-images.
+        """
+
+        self.session = session
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+
+        image_shape = list(images.shape[1:])
+        num_classes = labels.shape[1]
+
+        # Placeholders for the random batches fed by the background thread.
+        self.x_source = tf.placeholder(tf.float32, shape=[None] + image_shape)
+        self.y_source = tf.placeholder(tf.float32, shape=[None, num_classes])
+
+        # Queue with the distorted batches.
+        self.queue = tf.FIFOQueue(capacity=capacity, dtypes=[tf.float32, tf.float32],
+                                  shapes=[[batch_size, crop_size, crop_size, image_shape[2]],
+                                          [batch_size, num_classes]])
+        self.enqueue_op = self.queue.enqueue([distort_images(self.x_source, crop_size), self.y_source])
+        self.close_op = self.queue.close(cancel_pending_enqueues=True)
+
+        # Tensors with the next distorted batch, use these as input to the network.
+        self.x_batch, self.y_batch = self.queue.dequeue()
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def _run(self):
+        num_images = len(self.images)
+        while not self.stop_event.is_set():
+            idx = np.random.choice(num_images, size=self.batch_size, replace=False)
+            feed_dict = {self.x_source: self.images[idx],
+                         self.y_source: self.labels[idx]}
+            try:
+                self.session.run(self.enqueue_op, feed_dict=feed_dict)
+            except (tf.errors.CancelledError, tf.errors.AbortedError):
+                # The queue was closed by stop().
+                return
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.session.run(self.close_op)
+        self.thread.join()
+
+
+########################################################################
+
+
+def benchmark(images, labels, crop_size=24, num_iterations=200, batch_size=64):
+    """
+    Compare the steps per second of distorting random training-batches
+    with tf.map_fn, as in Tutorial #06, against the batched distortion,
+    both in the optimization step and in a background thread.
+
+    The step only computes the mean of the distorted batch, so the
+    results measure the pre-processing and not the network.
+
+    :return:
+        Dict with the steps per second for each version.
+    """
+
+    # The per-image distortion of Tutorial #06, which cannot be imported
+    # without running the whole tutorial.
+    def pre_process_image(image):
+        image = tf.random_crop(image, size=[crop_size, crop_size, int(image.get_shape()[2])])
+        image = tf.image.random_flip_left_right(image)
+        image = tf.image.random_hue(image, max_delta=hue_max_delta)
+        image = tf.image.random_contrast(image, lower=contrast_lower, upper=contrast_upper)
+        image = tf.image.random_brightness(image, max_delta=brightness_max_delta)
+        image = tf.image.random_saturation(image, lower=saturation_lower, upper=saturation_upper)
+        return tf.clip_by_value(image, 0.0, 1.0)
+
+    def random_feed_dict(x):
+        idx = np.random.choice(len(images), size=batch_size, replace=False)
+        return {x: images[idx]}
+
+    def steps_per_second(step, feed_dict_fn):
+        # Warm-up, the first run may include one-off graph optimizations.
+        session.run(step, feed_dict=feed_dict_fn())
+        start_time = time.time()
+        for i in range(num_iterations):
+            session.run(step, feed_dict=feed_dict_fn())
+        return num_iterations / (time.time() - start_time)
+
+    results = {}
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, shape=[None] + list(images.shape[1:]))
+        map_fn_step = tf.reduce_mean(tf.map_fn(pre_process_image, x))
+        batched_step = tf.reduce_mean(distort_images(x, crop_size))
+
+        session = tf.Session()
+        results['map_fn'] = steps_per_second(map_fn_step, lambda: random_feed_dict(x))
+        results['batched'] = steps_per_second(batched_step, lambda: random_feed_dict(x))
+
+        producer = BackgroundDistortion(session, images, labels, batch_size=batch_size, crop_size=crop_size)
+        background_step = tf.reduce_mean(producer.x_batch)
+        producer.start()
+        results['background'] = steps_per_second(background_step, lambda: None)
+        producer.stop()
+        session.close()
+
+    msg = "Batch-size: {0}, Steps/sec map_fn: {1:.1f}, batched: {2:.1f}, background: {3:.1f}"
+    print(msg.format(batch_size, results['map_fn'], results['batched'], results['background']))
+
+    return results
+
+
+########################################################################
+
+if __name__ == '__main__':
+    import cifar10
+
+    cifar10.maybe_download_and_extract()
+    images_train, _, labels_train = cifar10.load_training_data()
+    benchmark(images=images_train, labels=labels_train)
+
+########################################################################
@@ -6,6 +6,12 @@
 # to harddisk. This is used to persist the data so it can be reloaded
 # very quickly and easily.
 #
+# The function memoize() is a more general version of cache(), which
+# derives the cache-file from a hash of the function and its arguments,
+# saves numpy arrays as memory-mapped .npy files, and keeps the
+# total size of the cache-dir bounded by deleting the least recently
+# used cache-entries.
+#
 # Implemented in Python 3.5
 #
 ########################################################################
@@ -20,8 +26,13 @@
 #
 ########################################################################
 
+import hashlib
+import inspect
+import io
 import os
 import pickle
+import shutil
+import tempfile
 import numpy as np
 
 ########################################################################
@@ -64,15 +75,250 @@ def cache(cache_path, fn, *args, **kwargs):
         # Call the function / class-init with the supplied arguments.
         obj = fn(*args, **kwargs)
 
-        # Save the data to a cache-file.
-        with open(cache_path, mode='wb') as file:
+        # Save the data to a temporary file which is renamed when
+        # it is complete, so an interrupted run leaves no broken cache-file.
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, mode='wb') as file:
             pickle.dump(obj, file)
+        os.replace(tmp_path, cache_path)
 
         print("- Data saved to cache-file: " + cache_path)
 
     return obj
 
 
+########################################################################
+# Memoization keyed on the function and its arguments.
+
+# Default directory for the cache-entries of memoize().
+memoize_dir = "cache/"
+
+# Default maximum size in bytes of all the cache-entries in the cache-dir.
+memoize_max_bytes = 4 * 2 ** 30
+
+# Name of the pickle-file in each cache-entry.
+_result_filename = "result.pkl"
+
+
+def _hash_update(h, obj):
+    """
+    Update the hash-object h with the contents of obj.
+
+    Numpy arrays are hashed by their dtype, shape and data, and lists,
+    tuples and dicts are hashed element by element, so two equal
+    arguments give the same hash even if they are different objects.
+    Everything else is hashed by its pickled bytes, and a TypeError is
+    raised for objects that cannot be pickled, e.g. a model holding a
+    tf.Session.
+    """
+
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        h.update(b'ndarray')
+        h.update(str(obj.dtype).encode())
+        h.update(str(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, (list, tuple)):
+        h.update(type(obj).__name__.encode() + str(len(obj)).encode())
+        for item in obj:
+            _hash_update(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'dict' + str(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _hash_update(h, key)
+            _hash_update(h, obj[key])
+    else:
+        try:
+            data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            msg = "Cannot memoize with an argument of type {0}, it cannot be pickled for the cache-key: {1}"
+            raise TypeError(msg.format(type(obj).__name__, e))
+        h.update(data)
+
+
+def memoize_key(fn, args, kwargs):
+    """
+    Return the hex-digest of a SHA-256 hash of the function or class
+    and the arguments it is called with.
+
+    The function is identified by its module, name and source-code
+    (if available), so the cache is not reused after it is edited.
+
+    The arguments are bound to the parameters of the function with the
+    defaults filled in, so f(5, 's'), f(a=5, b='s') and f(5) with b='s'
+    as its default all give the same key.
+    """
+
+    h = hashlib.sha256()
+    h.update(fn.__module__.encode())
+    h.update(getattr(fn, '__qualname__', fn.__name__).encode())
+    try:
+        h.update(inspect.getsource(fn).encode())
+    except (OSError, TypeError):
+        # Built-in functions or code without a source-file.
+        pass
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+    except ValueError:
+        # No signature is available, e.g. for some built-in functions.
+        _hash_update(h, args)
+        _hash_update(h, kwargs)
+    else:
+        bound.apply_defaults()
+        _hash_update(h, dict(bound.arguments))
+
+    return h.hexdigest()
+
+
+class _ArrayPickler(pickle.Pickler):
+    """
+    Pickler that saves numpy arrays as separate .npy files in a
+    directory, so they can be loaded as memory-mapped arrays.
+    """
+
+    def __init__(self, file, directory):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.num_arrays = 0
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype != object:
+            filename = "array_{}.npy".format(self.num_arrays)
+            np.save(os.path.join(self.directory, filename), obj)
+            self.num_arrays += 1
+            return filename
+
+        # Pickle everything else as usual.
+        return None
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the files written by _ArrayPickler, which loads the
+    numpy arrays as read-only memory-mapped arrays without copying.
+    """
+
+    def __init__(self, file, directory):
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, pid):
+        return np.load(os.path.join(self.directory, pid), mmap_mode='r')
+
+
+def _entry_size(entry_dir):
+    """
+    Return the size in bytes of all the files in a cache-entry.
+    """
+
+    return sum(os.path.getsize(os.path.join(entry_dir, filename)) for filename in os.listdir(entry_dir))
+
+
+def _evict(cache_dir, max_bytes, keep):
+    """
+    Delete the least recently used cache-entries in cache_dir until
+    their total size is at most max_bytes. The entry named keep is
+    never deleted, even if it is larger than max_bytes by itself.
+    """
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        result_path = os.path.join(cache_dir, name, _result_filename)
+        if os.path.exists(result_path):
+            # The modification-time of the result-file is updated whenever the entry is used.
+            entries.append((os.path.getmtime(result_path), name, _entry_size(os.path.join(cache_dir, name))))
+
+    total_bytes = sum(size for _, _, size in entries)
+
+    # Delete the oldest entries first.
+    for _, name, size in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if name != keep:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+            total_bytes -= size
+            print("- Evicted cache-entry: " + name)
+
+
+def memoize(fn, cache_dir=None, max_bytes=None):
+    """
+    Memoization-wrapper for a function or class, similar to cache()
+    but the cache-entry is found from a hash of the function and the
+    arguments, so a result is only reused for the same arguments.
+
+    Numpy arrays in the result, also inside lists, dicts or object-
+    instances, are saved as .npy files and reloaded as read-only
+    memory-mapped arrays. Everything else is pickled.
+
+    Each cache-entry is written to a temporary directory which is
+    renamed when it is complete. When the cache-dir grows beyond
+    max_bytes, the least recently used entries are deleted.
+
+    Example: memoize(DataSet)(in_dir=in_dir)
+
+    :param fn:
+        Function or class to be called.
+
+    :param cache_dir:
+        Directory for the cache-entries. Default is memoize_dir.
+
+    :param max_bytes:
+        Maximum size of the cache-dir in bytes. Default is memoize_max_bytes.
+
+    :return:
+        Wrapper-function taking the same arguments as fn.
+    """
+
+    if cache_dir is None:
+        cache_dir = memoize_dir
+    if max_bytes is None:
+        max_bytes = memoize_max_bytes
+
+    def wrapper(*args, **kwargs):
+        key = memoize_key(fn, args, kwargs)
+        entry_dir = os.path.join(cache_dir, key)
+        result_path = os.path.join(entry_dir, _result_filename)
+
+        # If the cache-entry exists.
+        if os.path.exists(result_path):
+            # Load the cached data, the arrays are memory-mapped.
+            with open(result_path, mode='rb') as file:
+                obj = _ArrayUnpickler(file, directory=entry_dir).load()
+
+            # Mark the entry as recently used.
+            os.utime(result_path)
+
+            print("- Data loaded from cache-entry: " + entry_dir)
+
+            return obj
+
+        # Call the function / class-init with the supplied arguments.
+        obj = fn(*args, **kwargs)
+
+        # Write the cache-entry to a temporary directory first.
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_dir = tempfile.mkdtemp(prefix=key + '.tmp', dir=cache_dir)
+        buffer = io.BytesIO()
+        _ArrayPickler(buffer, directory=tmp_dir).dump(obj)
+        with open(os.path.join(tmp_dir, _result_filename), mode='wb') as file:
+            file.write(buffer.getvalue())
+
+        try:
+            # Renaming is atomic, so other processes either see
+            # the complete cache-entry or no cache-entry at all.
+            os.rename(tmp_dir, entry_dir)
+            print("- Data saved to cache-entry: " + entry_dir)
+        except OSError:
+            # Another process has saved the same cache-entry meanwhile.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        _evict(cache_dir, max_bytes=max_bytes, keep=key)
+
+        return obj
+
+    return wrapper
+
+
 ########################################################################
 
 
@@ -153,4 +399,20 @@ if __name__ == '__main__':
 
     obj.print_result()
 
+    # Newline.
+    print()
+
+    # The same computations using memoize(), where the cache-entry
+    # depends on the arguments, so calling it with other arguments
+    # computes and saves a new result.
+    print('Memoizing expensive_function() ...')
+
+    result = memoize(expensive_function)(a=np.arange(5), b=456)
+
+    print('result =', result)
+
+    obj = memoize(ExpensiveClass)(c=123, d=789)
+
+    obj.print_result()
+
 ########################################################################
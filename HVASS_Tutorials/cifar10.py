@@ -16,10 +16,14 @@
 # 5) Use the returned data in your own program.
 #
 # Format:
-# The images for the training- and test-sets are returned as 4-dim numpy
+# The images for the training- and test-sets are returned as 4-dim
 # arrays each with the shape: [image_number, height, width, channel]
 # where the individual pixels are floats between 0.0 and 1.0.
 #
+# The images are stored as uint8 in a memory-mapped cache-file which
+# is written the first time the data is loaded, and they are only
+# converted to floats when a batch is selected, see ScaledImages.
+#
 ########################################################################
 #
 # This file is part of the TensorFlow Tutorials available at:
@@ -35,6 +39,7 @@
 import numpy as np
 import pickle
 import os
+from concurrent.futures import ThreadPoolExecutor
 import download
 from dataset import one_hot_encoded
 
@@ -90,6 +95,15 @@ def _get_file_path(filename=""):
     return os.path.join(data_path, "cifar-10-batches-py/", filename)
 
 
+def _get_cache_path(filename):
+    """
+    Return the full path of a cache-file with the uint8 images
+    or the class-numbers.
+    """
+
+    return os.path.join(data_path, "cifar-10-cache/", filename)
+
+
 def _unpickle(filename):
     """
     Unpickle the given file and return the data.
@@ -114,16 +128,14 @@ def _convert_images(raw):
     """
     Convert images from the CIFAR-10 format and
     return a 4-dim array with shape: [image_number, height, width, channel]
-    where the pixels are floats between 0.0 and 1.0.
+    where the pixels are uint8 between 0 and 255.
     """
 
-    # Convert the raw images from the data-files to floating-points.
-    raw_float = np.array(raw, dtype=float) / 255.0
-
-    # Reshape the array to 4-dimensions.
-    images = raw_float.reshape([-1, num_channels, img_size, img_size])
+    # Reshape the raw uint8 array to 4-dimensions.
+    images = np.asarray(raw, dtype=np.uint8).reshape([-1, num_channels, img_size, img_size])
 
     # Reorder the indices of the array.
+    # This is only a view, the pixels are copied when stored in the cache.
     images = images.transpose([0, 2, 3, 1])
 
     return images
@@ -151,6 +163,98 @@ def _load_data(filename):
     return images, cls
 
 
+def _build_cache(filenames, images_path, cls_path):
+    """
+    Unpickle the given data-files in parallel threads and write
+    the uint8 images and the class-numbers to the cache-files.
+    """
+
+    # Create the cache-directory if it does not exist.
+    cache_dir = os.path.dirname(images_path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    num_images = len(filenames) * _images_per_file
+
+    # The images are written directly into a memory-mapped file,
+    # so the whole data-set never has to be held in memory at once.
+    # A temporary file is used so an interrupted run leaves no partial cache.
+    tmp_path = images_path + ".tmp"
+    images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                       shape=(num_images, img_size, img_size, num_channels))
+    cls = np.zeros(shape=[num_images], dtype=int)
+
+    def load_file(i):
+        # Load the images and class-numbers from the data-file
+        # and store them at the position of this file in the data-set.
+        images_batch, cls_batch = _load_data(filename=filenames[i])
+        begin = i * _images_per_file
+        end = begin + len(images_batch)
+        images[begin:end] = images_batch
+        cls[begin:end] = cls_batch
+
+    # Each thread writes to its own slice of the arrays.
+    with ThreadPoolExecutor(max_workers=len(filenames)) as executor:
+        list(executor.map(load_file, range(len(filenames))))
+
+    images.flush()
+    del images
+
+    # The class-numbers are saved first, so an existing images-file
+    # means the cache is complete.
+    np.save(cls_path, cls)
+    os.rename(tmp_path, images_path)
+
+
+def _load_cached(name, filenames):
+    """
+    Return the memory-mapped uint8 images and the class-numbers
+    for the given data-files, building the cache-files if necessary.
+    """
+
+    images_path = _get_cache_path(name + "_images.npy")
+    cls_path = _get_cache_path(name + "_cls.npy")
+
+    if not os.path.exists(images_path):
+        print("Building cache: " + images_path)
+        _build_cache(filenames=filenames, images_path=images_path, cls_path=cls_path)
+
+    # Memory-map the images so loading is almost instant.
+    images = np.load(images_path, mmap_mode='r')
+    cls = np.load(cls_path)
+
+    return images, cls
+
+
+class ScaledImages:
+    """
+    Read-only view of uint8 images with shape [image_number, height, width, channel].
+
+    Indexing returns float32 pixels between 0.0 and 1.0, so only the
+    selected images are converted, e.g. images[idx, :, :, :] for a
+    random batch or images[i:j] when predicting in batches.
+    """
+
+    def __init__(self, raw):
+        # The uint8 images, typically a memory-mapped array.
+        self.raw = raw
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, key):
+        return self.raw[key].astype(np.float32) * np.float32(1.0 / 255.0)
+
+    def __array__(self, dtype=None):
+        # Convert all the images, e.g. when passed to numpy functions.
+        images = self[:]
+        return images if dtype is None else images.astype(dtype, copy=False)
+
+
 ########################################################################
 # Public functions that you may call to download the data-set from
 # the internet and load the data into memory.
@@ -189,36 +293,13 @@ def load_training_data():
     The data-set is split into 5 data-files which are merged here.
 
     Returns the images, class-numbers and one-hot encoded class-labels.
+    The images are a ScaledImages view on the uint8 cache (see above).
     """
 
-    # Pre-allocate the arrays for the images and class-numbers for efficiency.
-    images = np.zeros(shape=[_num_images_train, img_size, img_size, num_channels], dtype=float)
-    cls = np.zeros(shape=[_num_images_train], dtype=int)
-
-    # Begin-index for the current batch.
-    begin = 0
-
-    # For each data-file.
-    for i in range(_num_files_train):
-        # Load the images and class-numbers from the data-file.
-        images_batch, cls_batch = _load_data(filename="data_batch_" + str(i + 1))
-
-        # Number of images in this batch.
-        num_images = len(images_batch)
-
-        # End-index for the current batch.
-        end = begin + num_images
-
-        # Store the images into the array.
-        images[begin:end, :] = images_batch
-
-        # Store the class-numbers into the array.
-        cls[begin:end] = cls_batch
-
-        # The begin-index for the next batch is the current end-index.
-        begin = end
+    filenames = ["data_batch_" + str(i + 1) for i in range(_num_files_train)]
+    images, cls = _load_cached(name="train", filenames=filenames)
 
-    return images, cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
+    return ScaledImages(images), cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
 
 
 def load_test_data():
@@ -226,10 +307,11 @@ def load_test_data():
     Load all the test-data for the CIFAR-10 data-set.
 
     Returns the images, class-numbers and one-hot encoded class-labels.
+    The images are a ScaledImages view on the uint8 cache (see above).
     """
 
-    images, cls = _load_data(filename="test_batch")
+    images, cls = _load_cached(name="test", filenames=["test_batch"])
 
-    return images, cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
+    return ScaledImages(images), cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
 
 ########################################################################
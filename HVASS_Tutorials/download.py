@@ -16,14 +16,30 @@
 #
 ########################################################################
 
+import hashlib
+import shutil
+import socket
 import sys
 import os
+import tempfile
+import urllib.error
 import urllib.request
 import tarfile
 import zipfile
 
 ########################################################################
 
+# Number of bytes read from the internet at a time.
+_chunk_size = 1024 * 1024
+
+# Number of times a broken connection is resumed before giving up.
+_max_retries = 5
+
+# Seconds to wait for the server before the connection is considered broken.
+_timeout = 60
+
+########################################################################
+
 
 def _print_download_progress(count, block_size, total_size):
     """
@@ -42,14 +58,237 @@ def _print_download_progress(count, block_size, total_size):
     sys.stdout.flush()
 
 
+class _DownloadStream:
+    """
+    File-like object which reads a file from the internet and at the
+    same time appends it to a partial download-file and updates its
+    SHA-256 hash.
+
+    If the partial download-file already exists then it is read first
+    and only the remaining bytes are requested using an HTTP Range
+    header. A broken connection is resumed the same way, so the
+    reader of this stream never notices it.
+    """
+
+    def __init__(self, url, part_path):
+        self.url = url
+        self.sha256 = hashlib.sha256()
+
+        # Number of bytes that have been read from the stream.
+        self.position = 0
+
+        # Total size of the file, if the server tells us.
+        self.total_size = None
+
+        # Bytes that were already downloaded are read from the partial file first.
+        self.part_file = open(part_path, mode='a+b')
+        self.part_file.seek(0)
+        self.num_downloaded = os.path.getsize(part_path)
+
+        self.response = None
+        self.num_retries = 0
+
+    def _connect(self):
+        """
+        Request the remaining bytes of the file from the server.
+        """
+
+        request = urllib.request.Request(self.url)
+        if self.num_downloaded > 0:
+            request.add_header('Range', 'bytes={}-'.format(self.num_downloaded))
+
+        try:
+            self.response = urllib.request.urlopen(request, timeout=_timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and self.num_downloaded > 0:
+                # Range Not Satisfiable: there are no bytes after the partial file,
+                # so it is already complete. A wrong file fails the SHA-256 check.
+                e.close()
+                self.total_size = self.num_downloaded
+                return
+            raise
+
+        if self.num_downloaded > 0 and self.response.status != 206:
+            # The server does not support resuming, so start over.
+            print("- Server ignored the Range-request, downloading from the beginning.")
+            if self.position > 0:
+                raise RuntimeError("Cannot restart the download of {} in the middle of the stream".format(self.url))
+            self.part_file.seek(0)
+            self.part_file.truncate()
+            self.num_downloaded = 0
+
+        content_length = self.response.headers.get('Content-Length')
+        if content_length is not None:
+            self.total_size = self.num_downloaded + int(content_length)
+
+    def _read_remote(self, size):
+        """
+        Read up to size bytes from the server, resuming the download
+        if the connection breaks. Returns b'' at the end of the file.
+        """
+
+        while True:
+            if self.total_size is not None and self.num_downloaded >= self.total_size:
+                return b''
+            try:
+                if self.response is None:
+                    self._connect()
+                    if self.response is None:
+                        return b''
+                data = self.response.read(size)
+                if len(data) == 0 and self.total_size is not None and self.num_downloaded < self.total_size:
+                    raise IOError("Connection closed before the end of the file")
+                return data
+            except (urllib.error.URLError, socket.timeout, ConnectionError, IOError) as e:
+                if isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500:
+                    # Client errors such as 404 do not go away by retrying.
+                    raise
+                self.num_retries += 1
+                if self.num_retries > _max_retries:
+                    raise
+                print()
+                print("- Download interrupted ({}), resuming at byte {}".format(e, self.num_downloaded))
+                self.response = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = _chunk_size
+
+        if self.position < self.num_downloaded:
+            # Read the bytes that were downloaded by a previous run.
+            data = self.part_file.read(min(size, self.num_downloaded - self.position))
+        else:
+            # Download new bytes and append them to the partial file.
+            data = self._read_remote(size)
+            self.part_file.write(data)
+            self.num_downloaded += len(data)
+
+            if self.total_size:
+                _print_download_progress(count=self.num_downloaded, block_size=1, total_size=self.total_size)
+
+        self.position += len(data)
+        self.sha256.update(data)
+
+        return data
+
+    def read_to_end(self):
+        """
+        Read the rest of the stream, e.g. padding after the last entry
+        of a tar-ball, so the hash covers the whole file.
+        """
+
+        while len(self.read(_chunk_size)) > 0:
+            pass
+
+    def close(self):
+        self.part_file.close()
+        if self.response is not None:
+            self.response.close()
+
+
+def _safe_members(tar, extract_dir):
+    """
+    Yield the entries of a tar-ball which are extracted inside extract_dir,
+    skipping entries with absolute paths or paths going outside of it.
+    """
+
+    extract_dir = os.path.realpath(extract_dir)
+    for member in tar:
+        path = os.path.realpath(os.path.join(extract_dir, member.name))
+        if member.issym() or member.islnk() or os.path.commonpath([extract_dir, path]) != extract_dir:
+            print("- Skipping unsafe entry in tar-ball: " + member.name)
+            continue
+        yield member
+
+
 ########################################################################
 
 
-def maybe_download_and_extract(url, download_dir):
+def download(url, file_path, sha256=None, extract_dir=None):
+    """
+    Download a file and optionally extract it while it is downloaded.
+
+    The file is first saved as file_path + ".part" and is only renamed
+    to file_path when it is complete and the SHA-256 hash is correct,
+    so an existing file_path is always a complete download. If the
+    partial file exists, e.g. because a previous download was
+    interrupted, then the download is resumed where it stopped.
+
+    :param url:
+        Internet URL for the file to download.
+
+    :param file_path:
+        File-path for saving the downloaded file.
+
+    :param sha256:
+        Expected SHA-256 hex-digest of the file, or None to skip the check.
+
+    :param extract_dir:
+        If not None then a tar-ball (.tar.gz or .tgz) is extracted
+        directly from the downloaded stream, so the file does not have
+        to be read again after the download. The files are extracted
+        into a temporary directory and only moved into this directory
+        when the SHA-256 hash is correct.
+
+    :return:
+        SHA-256 hex-digest of the downloaded file.
+    """
+
+    part_path = file_path + ".part"
+    stream = _DownloadStream(url=url, part_path=part_path)
+
+    # Unverified files are extracted next to extract_dir, not into it.
+    temp_dir = None
+    if extract_dir is not None:
+        temp_dir = tempfile.mkdtemp(prefix=".extract-", dir=extract_dir)
+
+    try:
+        try:
+            if temp_dir is not None:
+                # Stream-mode "r|gz" reads the tar-ball sequentially from the download.
+                with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+                    for member in _safe_members(tar, temp_dir):
+                        tar.extract(member, path=temp_dir)
+
+            # Download the rest of the file, or all of it if it is not extracted.
+            stream.read_to_end()
+        finally:
+            stream.close()
+
+        print()
+
+        digest = stream.sha256.hexdigest()
+        if sha256 is not None and digest != sha256.lower():
+            # The partial file is corrupt, so the next attempt starts over.
+            os.remove(part_path)
+            raise IOError("SHA-256 of {} is {} but should be {}".format(url, digest, sha256))
+
+        if temp_dir is not None:
+            # The hash is correct, so move the extracted files into place.
+            for name in os.listdir(temp_dir):
+                target = os.path.join(extract_dir, name)
+                if os.path.isdir(target) and not os.path.islink(target):
+                    shutil.rmtree(target)
+                os.replace(os.path.join(temp_dir, name), target)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    os.replace(part_path, file_path)
+
+    print("Download finished. SHA-256: " + digest)
+
+    return digest
+
+
+def maybe_download_and_extract(url, download_dir, sha256=None):
     """
     Download and extract the data if it doesn't already exist.
     Assumes the url is a tar-ball file.
 
+    Tar-balls are extracted while they are downloaded and zip-files
+    are extracted after the download. A partial download is resumed.
+
     :param url:
         Internet URL for the tar-file to download.
         Example: "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
@@ -58,6 +297,9 @@ def maybe_download_and_extract(url, download_dir):
         Directory where the downloaded file is saved.
         Example: "data/CIFAR-10/"
 
+    :param sha256:
+        Expected SHA-256 hex-digest of the file, or None to skip the check.
+
     :return:
         Nothing.
     """
@@ -68,27 +310,26 @@ def maybe_download_and_extract(url, download_dir):
     file_path = os.path.join(download_dir, filename)
 
     # Check if the file already exists.
-    # If it exists then we assume it has also been extracted,
+    # The file is only created when the download is complete,
+    # so if it exists then it has also been extracted,
     # otherwise we need to download and extract it now.
     if not os.path.exists(file_path):
         # Check if the download directory exists, otherwise create it.
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
 
-        # Download the file from the internet.
-        file_path, _ = urllib.request.urlretrieve(url=url,
-                                                  filename=file_path,
-                                                  reporthook=_print_download_progress)
+        if file_path.endswith((".tar.gz", ".tgz")):
+            # Download the tar-ball and unpack it at the same time.
+            download(url=url, file_path=file_path, sha256=sha256, extract_dir=download_dir)
+        else:
+            # Download the file from the internet.
+            download(url=url, file_path=file_path, sha256=sha256)
 
-        print()
-        print("Download finished. Extracting files.")
+            if file_path.endswith(".zip"):
+                print("Extracting files.")
 
-        if file_path.endswith(".zip"):
-            # Unpack the zip-file.
-            zipfile.ZipFile(file=file_path, mode="r").extractall(download_dir)
-        elif file_path.endswith((".tar.gz", ".tgz")):
-            # Unpack the tar-ball.
-            tarfile.open(name=file_path, mode="r:gz").extractall(download_dir)
+                # Unpack the zip-file.
+                zipfile.ZipFile(file=file_path, mode="r").extractall(download_dir)
 
         print("Done.")
     else:
@@ -96,3 +337,78 @@ def maybe_download_and_extract(url, download_dir):
 
 
 ########################################################################
+
+if __name__ == '__main__':
+    # This is a short example which downloads a small tar-ball from a
+    # local web-server, first partially and then resuming the download.
+    import http.server
+    import io
+    import threading
+
+    class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+        """
+        Web-server stand-in which supports the HTTP Range header
+        for resuming downloads, which SimpleHTTPRequestHandler does not.
+        """
+
+        def do_GET(self):
+            path = self.translate_path(self.path)
+            with open(path, mode='rb') as file:
+                data = file.read()
+
+            begin = 0
+            range_header = self.headers.get('Range')
+            if range_header is not None:
+                begin = int(range_header.split('=')[1].split('-')[0])
+                if begin >= len(data):
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(begin, len(data) - 1, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(data) - begin))
+            self.end_headers()
+            self.wfile.write(data[begin:])
+
+        def log_message(self, format, *args):
+            pass
+
+    work_dir = tempfile.mkdtemp()
+    serve_dir = os.path.join(work_dir, 'serve')
+    download_dir = os.path.join(work_dir, 'data')
+    os.makedirs(serve_dir)
+    os.makedirs(download_dir)
+
+    # Create a tar-ball with a few files to serve.
+    archive_path = os.path.join(serve_dir, 'example.tar.gz')
+    with tarfile.open(archive_path, mode='w:gz') as tar:
+        for i in range(3):
+            content = os.urandom(300000)
+            info = tarfile.TarInfo(name='example/file_{}.bin'.format(i))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    with open(archive_path, mode='rb') as file:
+        archive = file.read()
+    archive_sha256 = hashlib.sha256(archive).hexdigest()
+
+    # Pretend a previous download was interrupted half-way.
+    with open(os.path.join(download_dir, 'example.tar.gz.part'), mode='wb') as file:
+        file.write(archive[:len(archive) // 2])
+
+    os.chdir(serve_dir)
+    server = http.server.HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/example.tar.gz'.format(server.server_address[1])
+
+    maybe_download_and_extract(url=url, download_dir=download_dir, sha256=archive_sha256)
+    print('Extracted files:', sorted(os.listdir(os.path.join(download_dir, 'example'))))
+
+    server.shutdown()
+    os.chdir(work_dir)
+    shutil.rmtree(work_dir)
+
+########################################################################
@@ -0,0 +1,452 @@
+########################################################################
+#
+# Vectorized ensemble of Convolutional Neural Networks.
+#
+# All members of the ensemble share the network structure from
+# Tutorial #05 but have their own weights. Instead of training and
+# restoring the networks one after another, the weights of all members
+# are stacked along a leading ensemble-dimension so a single
+# session.run() optimizes, or predicts with, every member at once.
+#
+# The convolutions are computed for all members with one depthwise
+# convolution (a grouped convolution where each member is a group)
+# and the fully-connected layers with one batched matrix-multiply.
+#
+# Whether this is faster than the loop of Tutorial #05 depends on the
+# hardware; run benchmark() to measure it.
+#
+# Implemented in Python 3.5
+#
+########################################################################
+
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+import tensorflow as tf
+
+########################################################################
+# Structure of each member, see Tutorial #05.
+
+# Width and height of each image.
+img_size = 28
+
+# Length of an image when flattened to a 1-dim array.
+img_size_flat = img_size * img_size
+
+# Number of colour channels for the images.
+num_channels = 1
+
+# Number of classes.
+num_classes = 10
+
+# Convolutional layers: (filter-size, number of filters).
+_conv_layers = [(5, 16), (5, 36)]
+
+# Number of neurons in the fully-connected layer.
+_fc_size = 128
+
+# Variable-names used by Pretty Tensor in the checkpoints written by
+# Tutorial #05, in the same order as the stacked variables below.
+checkpoint_names = ['layer_conv1/weights', 'layer_conv1/bias',
+                    'layer_conv2/weights', 'layer_conv2/bias',
+                    'layer_fc1/weights', 'layer_fc1/bias',
+                    'fully_connected/weights', 'fully_connected/bias']
+
+########################################################################
+# Private functions for building the stacked network.
+
+
+def _new_weights(shape):
+    return tf.Variable(tf.truncated_normal(shape, stddev=0.05))
+
+
+def _new_biases(shape):
+    return tf.Variable(tf.constant(0.05, shape=shape))
+
+
+def _grouped_conv(layer, weights, biases):
+    """
+    Convolution of every member's input with its own filters.
+
+    :param layer:
+        4-dim tensor [batch, height, width, num_members * num_input_channels]
+        where the channels of member k are k * num_input_channels, ...
+
+    :param weights:
+        Stacked filters [num_members, filter_size, filter_size,
+        num_input_channels, num_filters].
+
+    :param biases:
+        Stacked biases [num_members, num_filters].
+
+    :return:
+        4-dim tensor [batch, height, width, num_members * num_filters].
+    """
+
+    num_members, filter_size, _, num_inputs, num_filters = weights.get_shape().as_list()
+
+    # Depthwise filters of shape [filter_size, filter_size, members * inputs, filters]
+    # so each input-channel is convolved with all the filters of its own member.
+    filters = tf.reshape(tf.transpose(weights, [1, 2, 0, 3, 4]),
+                         [filter_size, filter_size, num_members * num_inputs, num_filters])
+
+    layer = tf.nn.depthwise_conv2d(input=layer, filter=filters,
+                                   strides=[1, 1, 1, 1], padding='SAME')
+
+    # Sum the contributions of the input-channels within each member.
+    if num_inputs > 1:
+        shape = tf.shape(layer)
+        layer = tf.reshape(layer, [shape[0], shape[1], shape[2], num_members, num_inputs, num_filters])
+        layer = tf.reduce_sum(layer, axis=4)
+        layer = tf.reshape(layer, [shape[0], shape[1], shape[2], num_members * num_filters])
+
+    layer += tf.reshape(biases, [num_members * num_filters])
+
+    # 2x2 max-pooling acts on every channel independently.
+    layer = tf.nn.max_pool(value=layer, ksize=[1, 2, 2, 1],
+                           strides=[1, 2, 2, 1], padding='SAME')
+
+    return tf.nn.relu(layer)
+
+
+########################################################################
+
+
+class Ensemble:
+    def __init__(self, num_members, learning_rate=1e-4):
+        """
+        Create the graph for an ensemble of num_members networks whose
+        variables are stacked along the first dimension.
+
+        :param num_members:
+            Number of neural networks in the ensemble.
+
+        :param learning_rate:
+            Learning-rate for the Adam optimizer. Adam updates every
+            variable-element independently, so optimizing the sum of the
+            members' losses is the same as optimizing each member alone.
+
+        :return:
+            Object instance.
+        """
+
+        self.num_members = num_members
+
+        self.graph = tf.Graph()
+
+        with self.graph.as_default():
+            # Training-batches with one batch of images for each member,
+            # because every member is trained on its own random training-set.
+            self.x_members = tf.placeholder(tf.float32, shape=[num_members, None, img_size_flat],
+                                            name='x_members')
+            self.y_true_members = tf.placeholder(tf.float32, shape=[num_members, None, num_classes],
+                                                 name='y_true_members')
+
+            # Images for prediction, which are shared by all the members.
+            self.x = tf.placeholder(tf.float32, shape=[None, img_size_flat], name='x')
+
+            # Stacked variables for all the members.
+            self.variables = []
+            input_channels = num_channels
+            for filter_size, num_filters in _conv_layers:
+                self.variables.append(_new_weights([num_members, filter_size, filter_size,
+                                                    input_channels, num_filters]))
+                self.variables.append(_new_biases([num_members, num_filters]))
+                input_channels = num_filters
+
+            # Two 2x2 max-pooling layers reduce the image-size by a factor 4.
+            num_features = (img_size // 4) * (img_size // 4) * input_channels
+            self.variables.append(_new_weights([num_members, num_features, _fc_size]))
+            self.variables.append(_new_biases([num_members, 1, _fc_size]))
+            self.variables.append(_new_weights([num_members, _fc_size, num_classes]))
+            self.variables.append(_new_biases([num_members, 1, num_classes]))
+
+            # Training-graph.
+            logits_train = self._network(self.x_members)
+            cross_entropy = tf.nn.softmax_cross_entropy_with_logits(logits=logits_train,
+                                                                    labels=self.y_true_members)
+            # Mean over each member's batch and sum over the members.
+            self.loss = tf.reduce_sum(tf.reduce_mean(cross_entropy, axis=1))
+            self.optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate).minimize(self.loss)
+
+            correct = tf.equal(tf.argmax(logits_train, axis=2), tf.argmax(self.y_true_members, axis=2))
+            self.accuracies = tf.reduce_mean(tf.cast(correct, tf.float32), axis=1)
+
+            # Prediction-graph. Every member sees the same images.
+            x_tiled = tf.tile(tf.expand_dims(self.x, 0), [num_members, 1, 1])
+            self.y_pred_members = tf.nn.softmax(self._network(x_tiled))
+            self.y_pred = tf.reduce_mean(self.y_pred_members, axis=0)
+
+            self.init = tf.global_variables_initializer()
+            self.saver = tf.train.Saver()
+
+        self.session = tf.Session(graph=self.graph)
+
+    def _network(self, images):
+        """
+        Build the stacked network.
+
+        :param images:
+            3-dim tensor [num_members, batch, img_size_flat].
+
+        :return:
+            Logits of shape [num_members, batch, num_classes].
+        """
+
+        w_conv1, b_conv1, w_conv2, b_conv2, w_fc1, b_fc1, w_fc2, b_fc2 = self.variables
+        k = self.num_members
+
+        # Move the members into the channel-dimension:
+        # [batch, height, width, num_members * num_channels]
+        layer = tf.reshape(images, [k, -1, img_size, img_size, num_channels])
+        layer = tf.transpose(layer, [1, 2, 3, 0, 4])
+        shape = tf.shape(layer)
+        layer = tf.reshape(layer, [shape[0], img_size, img_size, k * num_channels])
+
+        layer = _grouped_conv(layer, w_conv1, b_conv1)
+        layer = _grouped_conv(layer, w_conv2, b_conv2)
+
+        # Move the members back to the first dimension and flatten each
+        # member's feature-map in the same order as a single network.
+        size = img_size // 4
+        num_filters = _conv_layers[-1][1]
+        layer = tf.reshape(layer, [-1, size, size, k, num_filters])
+        layer = tf.transpose(layer, [3, 0, 1, 2, 4])
+        layer = tf.reshape(layer, [k, -1, size * size * num_filters])
+
+        # Fully-connected layers as batched matrix-multiplications.
+        layer = tf.nn.relu(tf.matmul(layer, w_fc1) + b_fc1)
+        logits = tf.matmul(layer, w_fc2) + b_fc2
+
+        return logits
+
+    def init_variables(self):
+        self.session.run(self.init)
+
+    def optimize(self, num_iterations, training_sets, batch_size=64):
+        """
+        Optimize all the members of the ensemble at the same time.
+
+        :param num_iterations:
+            Number of optimization iterations.
+
+        :param training_sets:
+            List with a tuple (x_train, y_train) for each member.
+
+        :param batch_size:
+            Number of images in the batch of each member.
+
+        :return:
+            Nothing.
+        """
+
+        assert len(training_sets) == self.num_members
+
+        start_time = time.time()
+
+        for i in range(num_iterations):
+            # Get a random batch for each member from its own training-set.
+            x_batch = []
+            y_batch = []
+            for x_train, y_train in training_sets:
+                idx = np.random.choice(len(x_train), size=batch_size, replace=False)
+                x_batch.append(x_train[idx, :])
+                y_batch.append(y_train[idx, :])
+
+            feed_dict_train = {self.x_members: np.stack(x_batch),
+                               self.y_true_members: np.stack(y_batch)}
+
+            if i % 100 == 0:
+                _, acc = self.session.run([self.optimizer, self.accuracies], feed_dict=feed_dict_train)
+
+                msg = "Optimization Iteration: {0:>6}, Training Batch Accuracy: {1}"
+                print(msg.format(i + 1, np.round(acc, 3)))
+            else:
+                self.session.run(self.optimizer, feed_dict=feed_dict_train)
+
+        end_time = time.time()
+        time_dif = end_time - start_time
+        print("Time usage: " + str(timedelta(seconds=int(round(time_dif)))))
+
+    def predict_labels(self, images, batch_size=256):
+        """
+        Calculate the predicted labels of all the members for the given images.
+
+        :param images:
+            2-dim array [num_images, img_size_flat].
+
+        :param batch_size:
+            Number of images for each call to TensorFlow.
+
+        :return:
+            3-dim array [num_members, num_images, num_classes] and the
+            ensemble's averaged labels [num_images, num_classes].
+        """
+
+        num_images = len(images)
+
+        pred_labels = np.zeros(shape=(self.num_members, num_images, num_classes), dtype=np.float32)
+
+        # Every batch is a single session.run() for all the members.
+        i = 0
+        while i < num_images:
+            j = min(i + batch_size, num_images)
+            pred_labels[:, i:j] = self.session.run(self.y_pred_members,
+                                                   feed_dict={self.x: images[i:j, :]})
+            i = j
+
+        return pred_labels, np.mean(pred_labels, axis=0)
+
+    def save(self, save_path):
+        self.saver.save(sess=self.session, save_path=save_path)
+
+    def restore(self, save_path):
+        self.saver.restore(sess=self.session, save_path=save_path)
+
+    def load_members(self, save_paths, names=checkpoint_names):
+        """
+        Load the networks saved separately by Tutorial #05 into the
+        stacked variables, so they can all be used in a single graph.
+
+        :param save_paths:
+            List with the checkpoint-path of each member.
+
+        :param names:
+            Names of the variables in the checkpoints, in the same order
+            as the stacked variables.
+
+        :return:
+            Nothing.
+        """
+
+        assert len(save_paths) == self.num_members
+
+        readers = [tf.train.NewCheckpointReader(path) for path in save_paths]
+
+        with self.graph.as_default():
+            for variable, name in zip(self.variables, names):
+                shape = variable.get_shape().as_list()
+                # The biases of the fully-connected layers have an extra
+                # broadcasting-dimension in the stacked variables.
+                value = np.stack([np.reshape(reader.get_tensor(name), shape[1:]) for reader in readers])
+                self.session.run(variable.assign(value))
+
+
+########################################################################
+
+
+def _tutorial_loop(data, training_sets, num_iterations, batch_size, save_dir):
+    """
+    The training and prediction loop of Tutorial #05: one Pretty Tensor
+    network in one graph, initialized, optimized and saved to its own
+    checkpoint for each member, then restored for each member to
+    predict the test-set in batches of 256 images.
+
+    :return:
+        Time in seconds.
+    """
+
+    import prettytensor as pt
+
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.float32, shape=[None, img_size_flat], name='x')
+        x_image = tf.reshape(x, [-1, img_size, img_size, num_channels])
+        y_true = tf.placeholder(tf.float32, shape=[None, num_classes], name='y_true')
+
+        with pt.defaults_scope(activation_fn=tf.nn.relu):
+            y_pred, loss = pt.wrap(x_image). \
+                conv2d(kernel=5, depth=16, name='layer_conv1'). \
+                max_pool(kernel=2, stride=2). \
+                conv2d(kernel=5, depth=36, name='layer_conv2'). \
+                max_pool(kernel=2, stride=2). \
+                flatten(). \
+                fully_connected(size=_fc_size, name='layer_fc1'). \
+                softmax_classifier(class_count=num_classes, labels=y_true)
+
+        optimizer = tf.train.AdamOptimizer(learning_rate=1e-4).minimize(loss)
+        correct = tf.equal(tf.argmax(y_pred, axis=1), tf.argmax(y_true, axis=1))
+        accuracy = tf.reduce_mean(tf.cast(correct, tf.float32))
+        init = tf.global_variables_initializer()
+        saver = tf.train.Saver(max_to_keep=100)
+        session = tf.Session()
+
+        start_time = time.time()
+
+        for k, (x_train, y_train) in enumerate(training_sets):
+            session.run(init)
+            for i in range(num_iterations):
+                idx = np.random.choice(len(x_train), size=batch_size, replace=False)
+                feed_dict_train = {x: x_train[idx, :], y_true: y_train[idx, :]}
+                session.run(optimizer, feed_dict=feed_dict_train)
+                if i % 100 == 0:
+                    session.run(accuracy, feed_dict=feed_dict_train)
+            saver.save(sess=session, save_path=os.path.join(save_dir, 'network{0}'.format(k)))
+
+        images = data.test.images
+        for k in range(len(training_sets)):
+            saver.restore(sess=session, save_path=os.path.join(save_dir, 'network{0}'.format(k)))
+            i = 0
+            while i < len(images):
+                j = min(i + 256, len(images))
+                session.run(y_pred, feed_dict={x: images[i:j, :]})
+                i = j
+
+        time_tutorial = time.time() - start_time
+        session.close()
+
+    return time_tutorial
+
+
+def benchmark(data, num_members=5, num_iterations=1000, batch_size=64):
+    """
+    Compare the wall-clock time of the loop of Tutorial #05, which
+    optimizes, saves and restores the networks one after another,
+    against optimizing and predicting with all of them at once.
+
+    :param data:
+        MNIST data-set from tensorflow.examples.tutorials.mnist.input_data.
+
+    :return:
+        Tuple with the time in seconds for the tutorial's loop and the vectorized ensemble.
+    """
+
+    training_sets = []
+    for _ in range(num_members):
+        idx = np.random.permutation(len(data.train.images))
+        training_sets.append((data.train.images[idx], data.train.labels[idx]))
+
+    # The loop of Tutorial #05, with its checkpoints in a temporary directory.
+    save_dir = tempfile.mkdtemp(prefix='ensemble_benchmark')
+    try:
+        time_tutorial = _tutorial_loop(data, training_sets, num_iterations=num_iterations,
+                                       batch_size=batch_size, save_dir=save_dir)
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    # Vectorized: all the networks in one graph.
+    ensemble = Ensemble(num_members=num_members)
+    start_time = time.time()
+    ensemble.init_variables()
+    ensemble.optimize(num_iterations=num_iterations, training_sets=training_sets, batch_size=batch_size)
+    ensemble.predict_labels(data.test.images)
+    time_vectorized = time.time() - start_time
+
+    msg = "Members: {0}, Iterations: {1}, Tutorial #05 loop: {2:.1f} sec, Vectorized: {3:.1f} sec, Ratio: {4:.2f}x"
+    print(msg.format(num_members, num_iterations, time_tutorial, time_vectorized,
+                     time_tutorial / time_vectorized))
+
+    return time_tutorial, time_vectorized
+
+
+########################################################################
+
+if __name__ == '__main__':
+    from tensorflow.examples.tutorials.mnist import input_data
+
+    benchmark(data=input_data.read_data_sets('data/MNIST/', one_hot=True))
+
+########################################################################
@@ -0,0 +1,267 @@
+########################################################################
+#
+# Convert a DataSet of image-files into memory-mappable shards.
+#
+# The DataSet-class in dataset.py only holds the paths of the image-
+# files, so every program using it has to decode thousands of small
+# JPEG-files one at a time. The function write_shards() decodes and
+# resizes all the images once using a pool of processes and writes them
+# to a few large files, each holding a fixed number of images as a
+# uint8 array with shape [image_number, height, width, channel].
+# The class-numbers and an index with the shard-files are written too.
+#
+# The class Shards then memory-maps these files, so loading the
+# data-set is almost instant and batches are read from a few
+# contiguous files instead of thousands of small ones.
+#
+# Example usage:
+#   dataset = load_cached(cache_path='knifey-spoony.pkl', in_dir='knifey-spoony/')
+#   write_shards(dataset, out_dir='knifey-spoony-shards/', image_size=(200, 200))
+#   shards = Shards(out_dir='knifey-spoony-shards/')
+#   x_batch, y_batch = shards.random_batch(batch_size=64)
+#
+# Implemented in Python 3.5
+#
+########################################################################
+
+import json
+import os
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+
+import numpy as np
+import PIL.Image
+
+from dataset import one_hot_encoded
+
+########################################################################
+
+# Default number of images in each shard-file.
+default_shard_size = 1024
+
+# Filename of the index for a set of shards.
+_index_filename = "{}-index.json"
+
+
+########################################################################
+
+
+def _load_image(args):
+    """
+    Decode an image-file and resize it. This runs in the worker-processes.
+
+    :param args:
+        Tuple with the path of the image-file and the (width, height) to resize to.
+
+    :return:
+        uint8 array with shape [height, width, 3].
+    """
+
+    path, image_size = args
+
+    with PIL.Image.open(path) as image:
+        image = image.convert('RGB')
+        if image.size != tuple(image_size):
+            image = image.resize(image_size, PIL.Image.BILINEAR)
+
+        return np.asarray(image, dtype=np.uint8)
+
+
+def _save_shard(path, images):
+    """
+    Save a shard of images to a temporary file and rename it when complete.
+    """
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode='wb') as file:
+        np.save(file, images)
+    os.replace(tmp_path, path)
+
+
+def write_shards(dataset, out_dir, image_size, test=False, shard_size=default_shard_size, num_workers=None):
+    """
+    Decode and resize all the images in the training- or test-set
+    of a DataSet-object on a pool of processes, and write them to
+    shard-files with shard_size images in each.
+
+    The index-file is written last, so the shards can only be
+    loaded if all of them have been written.
+
+    :param dataset:
+        DataSet-object, see dataset.py.
+
+    :param out_dir:
+        Directory for the shard-files.
+
+    :param image_size:
+        Tuple (width, height) that all the images are resized to.
+
+    :param test:
+        Boolean. Write the test-set (True) or training-set (False).
+
+    :param shard_size:
+        Number of images in each shard-file, the last shard may be smaller.
+
+    :param num_workers:
+        Number of processes for decoding the images. Default is the number of CPUs.
+
+    :return:
+        Path of the index-file.
+    """
+
+    name = "test" if test else "train"
+
+    # Paths of the image-files and their class-numbers.
+    paths = list(dataset.get_paths(test=test))
+    class_numbers = np.asarray(dataset.class_numbers_test if test else dataset.class_numbers, dtype=np.int32)
+    num_images = len(paths)
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    width, height = image_size
+    shards = []
+
+    # Start-time used for printing time-usage below.
+    start_time = time.time()
+
+    with Pool(processes=num_workers) as pool:
+        # The images are decoded in parallel but returned in order,
+        # so image number i is always at the same position in the shards.
+        images = pool.imap(_load_image, [(path, (width, height)) for path in paths], chunksize=16)
+
+        for begin in range(0, num_images, shard_size):
+            end = min(begin + shard_size, num_images)
+
+            # Fill the array for this shard with the decoded images.
+            shard = np.empty(shape=[end - begin, height, width, 3], dtype=np.uint8)
+            for i in range(end - begin):
+                shard[i] = next(images)
+
+            filename = "{}-{:05d}.npy".format(name, len(shards))
+            _save_shard(os.path.join(out_dir, filename), shard)
+            shards.append({"filename": filename, "num_images": end - begin})
+
+            print("- Shard written: {} ({}/{} images)".format(filename, end, num_images))
+
+    # Save the class-numbers for all the images.
+    labels_filename = "{}-labels.npy".format(name)
+    _save_shard(os.path.join(out_dir, labels_filename), class_numbers)
+
+    # Save the index with the shards and the information about the data-set.
+    index = {"shards": shards,
+             "labels": labels_filename,
+             "image_shape": [height, width, 3],
+             "num_images": num_images,
+             "class_names": dataset.class_names,
+             "num_classes": dataset.num_classes,
+             "paths": paths}
+    index_path = os.path.join(out_dir, _index_filename.format(name))
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, mode='w') as file:
+        json.dump(index, file)
+    os.replace(tmp_path, index_path)
+
+    # Print the time-usage.
+    time_dif = time.time() - start_time
+    print("Time usage: " + str(timedelta(seconds=int(round(time_dif)))))
+
+    return index_path
+
+
+########################################################################
+
+
+class Shards:
+    def __init__(self, out_dir, test=False):
+        """
+        Load the shards written by write_shards() as memory-mapped arrays.
+
+        :param out_dir:
+            Directory with the shard-files.
+
+        :param test:
+            Boolean. Load the test-set (True) or training-set (False).
+        """
+
+        name = "test" if test else "train"
+
+        with open(os.path.join(out_dir, _index_filename.format(name)), mode='r') as file:
+            index = json.load(file)
+
+        self.class_names = index["class_names"]
+        self.num_classes = index["num_classes"]
+        self.paths = index["paths"]
+        self.image_shape = tuple(index["image_shape"])
+
+        # Memory-mapped uint8 images for each shard.
+        self.shards = [np.load(os.path.join(out_dir, shard["filename"]), mmap_mode='r') for shard in index["shards"]]
+
+        # Index of the first image in each shard.
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+        # Class-numbers and one-hot encoded labels for all the images.
+        self.cls = np.load(os.path.join(out_dir, index["labels"]))
+        self.labels = one_hot_encoded(class_numbers=self.cls, num_classes=self.num_classes)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def get_images(self, idx):
+        """
+        Return the uint8 images with the given image-numbers.
+
+        :param idx:
+            Array of integers with the image-numbers.
+
+        :return:
+            uint8 array with shape [len(idx), height, width, channel].
+        """
+
+        idx = np.asarray(idx)
+
+        # Shard and position within the shard of each image.
+        shard_numbers = np.searchsorted(self.offsets, idx, side='right') - 1
+        positions = idx - self.offsets[shard_numbers]
+
+        images = np.empty(shape=(len(idx),) + self.image_shape, dtype=np.uint8)
+        for shard_number in np.unique(shard_numbers):
+            mask = shard_numbers == shard_number
+            images[mask] = self.shards[shard_number][positions[mask]]
+
+        return images
+
+    def random_batch(self, batch_size):
+        """
+        Return a random batch of images with pixels between 0.0 and 1.0,
+        and their one-hot encoded labels.
+        """
+
+        idx = np.random.choice(len(self), size=batch_size, replace=False)
+
+        # Sorting the image-numbers reads each shard-file in order.
+        idx.sort()
+
+        x_batch = self.get_images(idx).astype(np.float32) / 255.0
+        y_batch = self.labels[idx]
+
+        return x_batch, y_batch
+
+
+########################################################################
+
+if __name__ == '__main__':
+    import sys
+
+    from dataset import DataSet
+
+    # Usage: python shards.py in_dir out_dir width height
+    in_dir, out_dir = sys.argv[1], sys.argv[2]
+    image_size = (int(sys.argv[3]), int(sys.argv[4]))
+
+    dataset = DataSet(in_dir=in_dir, exts=('.jpg', '.jpeg', '.png'))
+    write_shards(dataset, out_dir=out_dir, image_size=image_size, test=False)
+    write_shards(dataset, out_dir=out_dir, image_size=image_size, test=True)
+
+########################################################################
@@ -0,0 +1,89 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from benchmarks.run_benchmarks import StepTimer, train_fn, percentile_ms
+from cost_report import FLAGS, MODELS
+
+ACCUMULATION = {
+    'models': ['ConvVariationalAutoencoder', 'MLPClassifier', 'PCAClassifier'],
+    'accumulate_steps': [1, 4, 16],
+    'warmup_updates': 2,
+    'updates': 20
+}
+
+
+def time_updates(accumulator, warmup_steps, seconds):
+    # Records the time of the accumulator's step(), the optimizer update every accumulate_steps training steps
+    step = accumulator.step
+
+    def timed_step(session, i):
+        start = time.perf_counter()
+        step(session, i)
+        if i >= warmup_steps:
+            seconds.append(time.perf_counter() - start)
+
+    accumulator.step = timed_step
+
+
+def accumulation_model(name, accumulate_steps, updates):
+    # Runs in a fresh process per model and accumulate_steps, so ru_maxrss is the peak of that configuration
+    model = MODELS[name](accumulate_steps=accumulate_steps)
+    warmup_steps = ACCUMULATION['warmup_updates'] * accumulate_steps
+    timer = StepTimer(warmup_steps=warmup_steps)
+    model.tracer = timer
+    update_seconds = []
+    time_updates(model.accumulator, warmup_steps, update_seconds)
+    model.num_iterations = warmup_steps + updates * accumulate_steps
+    model.require_improvement = model.num_iterations
+    train_fn(model)()
+    model.session.close()
+
+    step_seconds = np.array(timer.step_seconds)
+    total_seconds = step_seconds.sum() + sum(update_seconds)
+    tf_peaks = [row['tf_peak_mb'] for row in model.memory.rows if row['tf_peak_mb'] is not None]
+    return {'accumulate_steps': accumulate_steps, 'batch_size': model.batch_size,
+            'effective_batch_size': model.batch_size * accumulate_steps,
+            'micro_step_ms_p50': percentile_ms(step_seconds, 50),
+            'update_ms': total_seconds * 1000.0 / updates,
+            'examples_per_sec': float(model.batch_size * len(step_seconds) / total_seconds),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'tf_peak_mb': max(tf_peaks) if tf_peaks else None}
+
+
+def run_accumulation(model_names, accumulate_steps, updates):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    print("{:<28}{:>6}{:>10}{:>16}{:>12}{:>14}{:>14}".format('model', 'K', 'eff.batch', 'micro step ms', 'update ms',
+                                                             'examples/sec', 'peak rss mb'))
+    for name in model_names:
+        results[name] = []
+        for k in accumulate_steps:
+            with context.Pool(processes=1) as pool:
+                result = pool.apply(accumulation_model, (name, k, updates))
+            results[name].append(result)
+            print("{:<28}{:>6}{:>10}{:>16.3f}{:>12.3f}{:>14.1f}{:>14.1f}".format(
+                name, k, result['effective_batch_size'], result['micro_step_ms_p50'], result['update_ms'],
+                result['examples_per_sec'], result['peak_rss_mb']))
+    return {'settings': dict(ACCUMULATION, models=model_names, accumulate_steps=accumulate_steps, updates=updates),
+            'models': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Step time and peak memory of training with gradient accumulation '
+                                                 'over K micro-batches of the FLAGS batch size')
+    parser.add_argument('--models', nargs='+', default=ACCUMULATION['models'], choices=sorted(MODELS))
+    parser.add_argument('--accumulate-steps', nargs='+', type=int, default=ACCUMULATION['accumulate_steps'])
+    parser.add_argument('--updates', type=int, default=ACCUMULATION['updates'], help='timed optimizer updates per run')
+    parser.add_argument('--output', default='accumulation.json', help='JSON results file')
+    args = parser.parse_args()
+
+    results = run_accumulation(args.models, args.accumulate_steps, args.updates)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to {}".format(args.output))
@@ -0,0 +1,91 @@
+import argparse
+import json
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.run_benchmarks import StepTimer, train_fn, percentile_ms
+from cost_report import MODELS
+from models.utils import tf_helpers
+
+BATCH_NORM = {
+    'model': 'Auxiliary',
+    'variants': ['cond', 'where'],
+    'warmup_steps': 20,
+    'steps': 200
+}
+
+
+def cond_batch_norm_wrapper(inputs, is_training, decay=0.999, epsilon=1e-4):
+    # The batch norm the Auxiliary model used before tf_helpers.batch_norm_wrapper: a tf.cond per layer between the
+    # batch statistics, with the population updates as its control dependencies, and the population statistics
+    num_features = inputs.get_shape()[-1]
+    pop_mean = tf.Variable(tf.zeros([num_features]), trainable=False)
+    pop_var = tf.Variable(tf.ones([num_features]), trainable=False)
+    offset = tf.Variable(tf.zeros([num_features]))
+    scale = tf.Variable(tf.ones([num_features]))
+
+    def batch_norm():
+        batch_mean, batch_var = tf.nn.moments(inputs, [0])
+        train_mean = tf.assign(pop_mean, pop_mean * decay + batch_mean * (1 - decay))
+        train_var = tf.assign(pop_var, pop_var * decay + batch_var * (1 - decay))
+        with tf.control_dependencies([train_mean, train_var]):
+            return tf.nn.batch_normalization(inputs, mean=batch_mean, variance=batch_var, offset=offset, scale=scale,
+                                             variance_epsilon=epsilon)
+
+    def pop_norm():
+        return tf.nn.batch_normalization(inputs, pop_mean, pop_var, offset=offset, scale=scale,
+                                         variance_epsilon=epsilon)
+
+    return tf.cond(is_training, batch_norm, pop_norm)
+
+
+def batch_norm_model(variant, steps):
+    # Runs in a fresh process per variant; 'cond' swaps the tf.cond batch norm into tf_helpers before the model is
+    # built, 'where' keeps the current batch_norm_wrapper
+    if variant == 'cond':
+        tf_helpers.batch_norm_wrapper = cond_batch_norm_wrapper
+    model = MODELS[BATCH_NORM['model']]()
+    timer = StepTimer(warmup_steps=BATCH_NORM['warmup_steps'])
+    model.tracer = timer
+    model.num_iterations = BATCH_NORM['warmup_steps'] + steps
+    model.require_improvement = model.num_iterations
+    train_fn(model)()
+    model.session.close()
+
+    step_seconds = np.array(timer.step_seconds)
+    return {'batch_size': model.batch_size,
+            'examples_per_sec': float(model.batch_size * len(step_seconds) / step_seconds.sum()),
+            'step_ms_p50': percentile_ms(step_seconds, 50),
+            'step_ms_p99': percentile_ms(step_seconds, 99)}
+
+
+def run_batch_norm(variants, steps):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    print("{:<10}{:>14}{:>14}{:>14}".format('variant', 'step ms p50', 'step ms p99', 'examples/sec'))
+    for variant in variants:
+        with context.Pool(processes=1) as pool:
+            results[variant] = pool.apply(batch_norm_model, (variant, steps))
+        print("{:<10}{:>14.3f}{:>14.3f}{:>14.1f}".format(variant, results[variant]['step_ms_p50'],
+                                                         results[variant]['step_ms_p99'],
+                                                         results[variant]['examples_per_sec']))
+    if 'cond' in results and 'where' in results:
+        print("p50 step time where/cond: {:.3f}".format(results['where']['step_ms_p50'] /
+                                                        results['cond']['step_ms_p50']))
+    return {'settings': dict(BATCH_NORM, variants=variants, steps=steps), 'variants': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Auxiliary training step time with the tf.cond batch norm it used '
+                                                 'before against the current tf.where batch_norm_wrapper')
+    parser.add_argument('--variants', nargs='+', default=BATCH_NORM['variants'], choices=BATCH_NORM['variants'])
+    parser.add_argument('--steps', type=int, default=BATCH_NORM['steps'], help='timed training steps per variant')
+    parser.add_argument('--output', default='batch_norm.json', help='JSON results file')
+    args = parser.parse_args()
+
+    results = run_batch_norm(args.variants, args.steps)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to {}".format(args.output))
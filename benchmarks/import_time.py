@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Cumulative import time budget in ms per module, the model modules are dominated by importing tensorflow
+BUDGETS_MS = {
+    'models.utils.metrics': 500,
+    'models.utils.MNIST_pickled_preprocess': 500,
+    'models.vanilla_vae.vae': 4000,
+    'models.conv_vae.convolutional_vae': 4000,
+    'models.semi_supervised_vae.semi_supervised': 4000,
+    'models.semi_supervised_vae.pretrained_semi_supervised': 4000,
+    'models.semi_supervised_conv_vae.conv_semi_supervised': 4000,
+    'models.auxiliary_semi_supervised.auxiliary_classifier': 4000,
+    'models.mlp.mlp_classifier': 4000,
+    'models.pca.pca_classifier': 4000,
+}
+
+# Plotting and evaluation dependencies that must only be imported by the functions using them
+FORBIDDEN = ('matplotlib', 'sklearn')
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# -X importtime was added in Python 3.7, older interpreters ignore the option and print no import times
+MIN_PYTHON = (3, 7)
+
+
+def import_times(module):
+    # {imported package: (self ms, cumulative ms)} of importing module in a fresh interpreter
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=REPO_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1000.0, int(cumulative_us) / 1000.0)
+    return times
+
+
+def check(modules, scale):
+    results, failures = {}, []
+    print("{:<56}{:>12}{:>10}  {}".format('module', 'import ms', 'budget', 'heaviest imports'))
+    for module in modules:
+        times = import_times(module)
+        total = times[module][1]
+        budget = BUDGETS_MS[module] * scale
+        forbidden = sorted(name for name in times if name.split('.')[0] in FORBIDDEN)
+        heaviest = sorted((name for name in times if name != module and '.' not in name),
+                          key=lambda name: -times[name][1])[:3]
+        results[module] = {'import_ms': total, 'budget_ms': budget, 'forbidden_imports': forbidden}
+        print("{:<56}{:>12.1f}{:>10.0f}  {}".format(module, total, budget, ", ".join(
+            "{} {:.0f}".format(name, times[name][1]) for name in heaviest)))
+        if total > budget:
+            failures.append("{} took {:.1f} ms to import, budget {:.0f} ms".format(module, total, budget))
+        if forbidden:
+            failures.append("{} imports {}".format(module, ", ".join(forbidden)))
+    return results, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of the model and inference modules against a budget')
+    parser.add_argument('--modules', nargs='+', default=sorted(BUDGETS_MS), choices=sorted(BUDGETS_MS))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget, e.g. for slow machines')
+    parser.add_argument('--output', help='JSON results file')
+    args = parser.parse_args()
+
+    if sys.version_info < MIN_PYTHON:
+        sys.exit("benchmarks.import_time needs Python {}.{} or newer for -X importtime, this is {}.{}".format(
+            MIN_PYTHON[0], MIN_PYTHON[1], sys.version_info[0], sys.version_info[1]))
+    results, failures = check(args.modules, args.scale)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print("Over budget: " + failure)
+    sys.exit(1 if failures else 0)
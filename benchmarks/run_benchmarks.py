@@ -0,0 +1,164 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+from cost_report import FLAGS, MODELS
+from models.utils.tf_helpers import session_callable
+
+BENCHMARK = {
+    'warmup_steps': 20,
+    'steps': 200,
+    'inference_batch_sizes': [1, 32, 256],
+    'inference_runs': 50,
+    'tolerance': 0.1
+}
+
+# Metrics where a larger value is an improvement, all others are latencies or memory
+HIGHER_IS_BETTER = ('examples_per_sec',)
+
+
+class StepTimer(object):
+    """Stands in for the trainer's StepTracer and records the wall-clock time of every optimizer step after the
+    warmup steps."""
+
+    def __init__(self, warmup_steps):
+        self.warmup_steps = warmup_steps
+        self.step_seconds = []
+
+    def make_step(self, session, fetches, feed_list):
+        run_callable = session_callable(session, fetches, feed_list)
+
+        def step_fn(step, *feed_values):
+            start = time.perf_counter()
+            results = run_callable(*feed_values)
+            if step >= self.warmup_steps:
+                self.step_seconds.append(time.perf_counter() - start)
+            return results
+
+        return step_fn
+
+    def close(self):
+        # Called by the training loop at its end, the timings are read by the caller
+        pass
+
+
+def train_fn(model):
+    # The VAEs train with train(), the classifiers with train_neural_network()
+    return model.train if hasattr(model, 'train') else model.train_neural_network
+
+
+def inference_feed(model, batch_size, rng):
+    # (fetch, feed_dict) of the prediction each model is used for: the latent mean of the VAEs, otherwise the class
+    x = rng.uniform(size=(batch_size, model.input_dim)).astype(np.float32)
+    y = np.eye(FLAGS['num_classes'])[rng.randint(FLAGS['num_classes'], size=batch_size)]
+    if hasattr(model, 'z_mu'):
+        return model.z_mu, {model.x: x}
+    if hasattr(model, 'x_lab_mu'):
+        return model.y_pred_cls, {model.x_lab_mu: x, model.x_lab_logvar: rng.normal(size=x.shape), model.y_lab: y}
+    if hasattr(model, 'is_training'):
+        return model.y_pred_cls, {model.x_lab: x, model.y_lab: y, model.is_training: False}
+    return model.y_pred_cls, {model.x: x, model.y: y}
+
+
+def percentile_ms(seconds, q):
+    return float(np.percentile(seconds, q) * 1000.0)
+
+
+def benchmark_model(name, steps, jit=False):
+    # Runs in a fresh process per model, so ru_maxrss is the model's own peak
+    model = MODELS[name](jit=jit)
+    timer = StepTimer(warmup_steps=BENCHMARK['warmup_steps'])
+    model.tracer = timer
+    model.num_iterations = BENCHMARK['warmup_steps'] + steps
+    model.require_improvement = model.num_iterations
+    train_fn(model)()
+
+    step_seconds = np.array(timer.step_seconds)
+    result = {
+        'batch_size': model.batch_size,
+        'examples_per_sec': float(model.batch_size * len(step_seconds) / step_seconds.sum()),
+        'step_ms_p50': percentile_ms(step_seconds, 50),
+        'step_ms_p99': percentile_ms(step_seconds, 99)
+    }
+
+    rng = np.random.RandomState(FLAGS['seed'])
+    for batch_size in BENCHMARK['inference_batch_sizes']:
+        fetch, feed_dict = inference_feed(model, batch_size, rng)
+        model.session.run(fetch, feed_dict=feed_dict)
+        run_seconds = []
+        for _ in range(BENCHMARK['inference_runs']):
+            start = time.perf_counter()
+            model.session.run(fetch, feed_dict=feed_dict)
+            run_seconds.append(time.perf_counter() - start)
+        result['inference_ms_p50_batch{}'.format(batch_size)] = percentile_ms(run_seconds, 50)
+        result['inference_ms_p99_batch{}'.format(batch_size)] = percentile_ms(run_seconds, 99)
+    model.session.close()
+
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return result
+
+
+def run_benchmarks(model_names, steps, jit=False):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name in model_names:
+        print("Benchmarking {}".format(name))
+        with context.Pool(processes=1) as pool:
+            results[name] = pool.apply(benchmark_model, (name, steps, jit))
+    return {'settings': dict(BENCHMARK, steps=steps, jit=jit), 'models': results}
+
+
+def compare(results, baseline, tolerance):
+    # Metrics that got worse by more than tolerance (relative) compared to the baseline
+    regressions = []
+    print("{:<28}{:<28}{:>12}{:>12}{:>10}".format('model', 'metric', 'baseline', 'current', 'change'))
+    for name, metrics in sorted(results['models'].items()):
+        base_metrics = baseline['models'].get(name, {})
+        for key, value in sorted(metrics.items()):
+            base = base_metrics.get(key)
+            if not base or key == 'batch_size':
+                continue
+            change = (value - base) / float(base)
+            worse = -change if key in HIGHER_IS_BETTER else change
+            print("{:<28}{:<28}{:>12.2f}{:>12.2f}{:>+10.1%}".format(name, key, base, value, change))
+            if worse > tolerance:
+                regressions.append((name, key, base, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Training throughput, step latency, inference latency and peak '
+                                                 'memory per model on synthetic MNIST-shaped data')
+    parser.add_argument('--models', nargs='+', default=sorted(MODELS), choices=sorted(MODELS))
+    parser.add_argument('--steps', type=int, default=BENCHMARK['steps'], help='timed training steps per model')
+    parser.add_argument('--jit', action='store_true', help='build the models with XLA JIT auto-clustering')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--compare', help='baseline JSON results; exit with status 1 if a metric regressed')
+    parser.add_argument('--tolerance', type=float, default=BENCHMARK['tolerance'],
+                        help='allowed relative regression when comparing')
+    args = parser.parse_args()
+
+    if args.jit:
+        # XLA reads the CPU clustering flag at the first session; the spawned model processes inherit it
+        xla_flags = os.environ.get('TF_XLA_FLAGS', '')
+        if '--tf_xla_cpu_global_jit' not in xla_flags:
+            os.environ['TF_XLA_FLAGS'] = (xla_flags + ' --tf_xla_cpu_global_jit').strip()
+
+    results = run_benchmarks(args.models, args.steps, args.jit)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, key, base, value in regressions:
+            print("Regression: {} {} {:.2f} -> {:.2f}".format(name, key, base, value))
+        sys.exit(1 if regressions else 0)
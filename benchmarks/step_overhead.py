@@ -0,0 +1,103 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.run_benchmarks import train_fn, percentile_ms
+from cost_report import FLAGS, MODELS
+from models.utils.tf_helpers import session_callable
+
+OVERHEAD = {
+    'batch_sizes': [50, 100, 200],
+    'warmup_steps': 10,
+    'steps': 100
+}
+
+
+class OverheadTimer(object):
+    """Stands in for the trainer's StepTracer. Every training step runs once, untimed, through the session callable
+    the trainers use, so the model trains as in a normal run. With the same feed values, the tensors among the
+    step's fetches, e.g. the cost, are then run both through session.run with a feed_dict and through a session
+    callable, alternating which goes first, and both times are recorded after the warmup steps. The timed runs
+    leave out the optimizer and update ops, so they never change the model state."""
+
+    def __init__(self, warmup_steps):
+        self.warmup_steps = warmup_steps
+        self.run_seconds = []
+        self.callable_seconds = []
+
+    def make_step(self, session, fetches, feed_list):
+        train_callable = session_callable(session, fetches, feed_list)
+        # Tensors only have no side effects, the ops (optimizer, updates, gradient accumulation) are left out
+        probe_fetches = [fetch for fetch in fetches if isinstance(fetch, tf.Tensor)]
+        probe_callable = session_callable(session, probe_fetches, feed_list)
+
+        def session_run(*feed_values):
+            return session.run(probe_fetches, feed_dict=dict(zip(feed_list, feed_values)))
+
+        def step_fn(step, *feed_values):
+            results = train_callable(*feed_values)
+            timed = [(session_run, self.run_seconds), (probe_callable, self.callable_seconds)]
+            for fn, seconds in (timed if step % 2 == 0 else reversed(timed)):
+                start = time.perf_counter()
+                fn(*feed_values)
+                if step >= self.warmup_steps:
+                    seconds.append(time.perf_counter() - start)
+            return results
+
+        return step_fn
+
+    def close(self):
+        # Called by the training loop at its end, the timings are read by the caller
+        pass
+
+
+def overhead_model(name, batch_size, steps):
+    # Runs in a fresh process per model and batch size; the models take their batch size from FLAGS
+    FLAGS['batch_size'] = batch_size
+    model = MODELS[name]()
+    timer = OverheadTimer(warmup_steps=OVERHEAD['warmup_steps'])
+    model.tracer = timer
+    model.num_iterations = OVERHEAD['warmup_steps'] + steps
+    model.require_improvement = model.num_iterations
+    train_fn(model)()
+    model.session.close()
+
+    run_ms, callable_ms = percentile_ms(timer.run_seconds, 50), percentile_ms(timer.callable_seconds, 50)
+    return {'batch_size': model.batch_size, 'session_run_ms_p50': run_ms, 'callable_ms_p50': callable_ms,
+            'saved_ms_per_step': run_ms - callable_ms, 'saved_share': (run_ms - callable_ms) / run_ms}
+
+
+def run_overhead(model_names, batch_sizes, steps):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    print("{:<28}{:>8}{:>16}{:>14}{:>10}{:>8}".format('model', 'batch', 'session.run ms', 'callable ms', 'saved ms',
+                                                      'saved'))
+    for name in model_names:
+        results[name] = []
+        for batch_size in batch_sizes:
+            with context.Pool(processes=1) as pool:
+                result = pool.apply(overhead_model, (name, batch_size, steps))
+            results[name].append(result)
+            print("{:<28}{:>8}{:>16.3f}{:>14.3f}{:>10.3f}{:>8.1%}".format(
+                name, result['batch_size'], result['session_run_ms_p50'], result['callable_ms_p50'],
+                result['saved_ms_per_step'], result['saved_share']))
+    return {'settings': dict(OVERHEAD, batch_sizes=batch_sizes, steps=steps), 'models': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-call time of the side-effect free fetches of the training step '
+                                                 'through session.run with a feed_dict against a session callable')
+    parser.add_argument('--models', nargs='+', default=sorted(MODELS), choices=sorted(MODELS))
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=OVERHEAD['batch_sizes'])
+    parser.add_argument('--steps', type=int, default=OVERHEAD['steps'], help='timed training steps per run')
+    parser.add_argument('--output', default='step_overhead.json', help='JSON results file')
+    args = parser.parse_args()
+
+    results = run_overhead(args.models, args.batch_sizes, args.steps)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("Results written to {}".format(args.output))
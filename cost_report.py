@@ -0,0 +1,171 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from models.auxiliary_semi_supervised.auxiliary_classifier import Auxiliary
+from models.conv_vae.convolutional_vae import ConvVariationalAutoencoder
+from models.mlp.mlp_classifier import MLPClassifier
+from models.pca.pca_classifier import PCAClassifier
+from models.semi_supervised_vae.semi_supervised import GenerativeClassifier
+from models.utils.MNIST_pickled_preprocess import synthetic_mnist
+from models.utils.graph_cost import graph_cost
+from models.vanilla_vae.vae import VariationalAutoencoder
+
+# Optimizer settings do not change the graph size, architectures follow the train_*.py FLAGS
+FLAGS = {
+    'num_iterations': 1,
+    'batch_size': 200,
+    'seed': 31415,
+    'alpha': 0.1,
+    'require_improvement': 5000,
+    'learning_rate': 3e-4,
+    'beta1': 0.9,
+    'beta2': 0.999,
+    'input_dim': 28 * 28,
+    'num_classes': 10,
+    'latent_dim': 50,
+    'n_labeled': 100,
+    'filter_sizes': [5, 5],
+    'num_filters': [16, 36],
+    'fc_size': 128,
+    'n_components': 22
+}
+
+
+def encoded(n, dim, rng):
+    # (mu, logvar, y) arrays standing in for the output of encode_dataset
+    return [rng.normal(size=(n, dim)).astype(np.float32), rng.normal(size=(n, dim)).astype(np.float32),
+            np.eye(FLAGS['num_classes'])[np.arange(n) % FLAGS['num_classes']]]
+
+
+def mnist_data():
+    # Models are built on MNIST-shaped random data, the graph does not depend on the pixel values
+    return synthetic_mnist(seed=FLAGS['seed'])
+
+
+def build_vae(**options):
+    return VariationalAutoencoder(batch_size=FLAGS['batch_size'], learning_rate=FLAGS['learning_rate'],
+                                  beta1=FLAGS['beta1'], beta2=FLAGS['beta2'],
+                                  require_improvement=FLAGS['require_improvement'], seed=FLAGS['seed'],
+                                  num_iterations=FLAGS['num_iterations'], input_dim=FLAGS['input_dim'],
+                                  latent_dim=FLAGS['latent_dim'], data=mnist_data(), **options)
+
+
+def build_conv_vae(**options):
+    return ConvVariationalAutoencoder(batch_size=FLAGS['batch_size'], learning_rate=FLAGS['learning_rate'],
+                                      beta1=FLAGS['beta1'], beta2=FLAGS['beta2'],
+                                      require_improvement=FLAGS['require_improvement'], seed=FLAGS['seed'],
+                                      num_iterations=FLAGS['num_iterations'], input_dim=FLAGS['input_dim'],
+                                      latent_dim=FLAGS['latent_dim'], filter_sizes=FLAGS['filter_sizes'],
+                                      fc_size=FLAGS['fc_size'], num_filters=FLAGS['num_filters'], data=mnist_data(),
+                                      **options)
+
+
+def build_generative_classifier(**options):
+    rng = np.random.RandomState(FLAGS['seed'])
+    num_examples, dim = 1000, FLAGS['latent_dim']
+    return GenerativeClassifier(num_batches=10, learning_rate=FLAGS['learning_rate'], beta1=FLAGS['beta1'],
+                                beta2=FLAGS['beta2'], alpha=FLAGS['alpha'],
+                                require_improvement=FLAGS['require_improvement'], seed=FLAGS['seed'],
+                                n_labeled=FLAGS['n_labeled'], num_iterations=FLAGS['num_iterations'],
+                                input_dim=dim, latent_dim=FLAGS['latent_dim'],
+                                train_lab=encoded(FLAGS['n_labeled'], dim, rng),
+                                train_unlab=encoded(num_examples - FLAGS['n_labeled'], dim, rng),
+                                valid=encoded(100, dim, rng), test=encoded(100, dim, rng), **options)
+
+
+def build_auxiliary(**options):
+    return Auxiliary(batch_size=FLAGS['batch_size'], learning_rate=FLAGS['learning_rate'], beta1=FLAGS['beta1'],
+                     beta2=FLAGS['beta2'], alpha=FLAGS['alpha'], require_improvement=FLAGS['require_improvement'],
+                     seed=FLAGS['seed'], n_labeled=FLAGS['n_labeled'], num_iterations=FLAGS['num_iterations'],
+                     data=mnist_data(), **options)
+
+
+def build_mlp(**options):
+    return MLPClassifier(batch_size=FLAGS['batch_size'], learning_rate=FLAGS['learning_rate'], beta1=FLAGS['beta1'],
+                         beta2=FLAGS['beta2'], require_improvement=FLAGS['require_improvement'], seed=FLAGS['seed'],
+                         num_iterations=FLAGS['num_iterations'], input_dim=FLAGS['input_dim'],
+                         num_classes=FLAGS['num_classes'], data=mnist_data(), **options)
+
+
+def build_pca(**options):
+    rng = np.random.RandomState(FLAGS['seed'])
+    dim = FLAGS['n_components']
+
+    def split(n):
+        return encoded(n, dim, rng)[0::2]
+
+    return PCAClassifier(batch_size=FLAGS['batch_size'], learning_rate=FLAGS['learning_rate'], beta1=FLAGS['beta1'],
+                         beta2=FLAGS['beta2'], require_improvement=FLAGS['require_improvement'], seed=FLAGS['seed'],
+                         num_iterations=FLAGS['num_iterations'], input_dim=dim, num_classes=FLAGS['num_classes'],
+                         train=split(1000), valid=split(100), test=split(100), **options)
+
+
+MODELS = {
+    'VariationalAutoencoder': build_vae,
+    'ConvVariationalAutoencoder': build_conv_vae,
+    'GenerativeClassifier': build_generative_classifier,
+    'Auxiliary': build_auxiliary,
+    'MLPClassifier': build_mlp,
+    'PCAClassifier': build_pca,
+}
+
+
+def placeholder_sizes(model):
+    # The semi-supervised models take num_lab_batch labeled and num_ulab_batch unlabeled rows per step
+    if not hasattr(model, 'num_ulab_batch'):
+        return {}
+    sizes = {name: model.num_lab_batch for name in ('x_labeled', 'x_lab_mu', 'x_lab_logvar', 'y_lab')}
+    sizes.update({name: model.num_ulab_batch for name in ('x_unlabeled', 'x_unlab_mu', 'x_unlab_logvar')})
+    return sizes
+
+
+def build_report(model_names):
+    report = {}
+    for name in model_names:
+        print("Building {}".format(name))
+        model = MODELS[name]()
+        report[name] = graph_cost(model.G, model.batch_size, placeholder_sizes(model))
+        model.session.close()
+    return report
+
+
+def compare(report, baseline, tolerance):
+    # Totals that grew by more than tolerance (relative) compared to the baseline
+    regressions = []
+    for name, cost in sorted(report.items()):
+        if name not in baseline:
+            continue
+        for key, value in sorted(cost['total'].items()):
+            base = baseline[name]['total'].get(key)
+            if base is None:
+                continue
+            print("{:<28}{:<28}{:>16}{:>16}{:>+10.1%}".format(name, key, base, value,
+                                                            (value - base) / float(base) if base else 0.0))
+            if value > base * (1 + tolerance):
+                regressions.append((name, key, base, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Static parameter, FLOP and op counts per model and scope')
+    parser.add_argument('--models', nargs='+', default=sorted(MODELS), choices=sorted(MODELS))
+    parser.add_argument('--output', default='cost_report.json', help='JSON report file')
+    parser.add_argument('--compare', help='baseline JSON report; exit with status 1 if a total grew')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='allowed relative growth when comparing')
+    args = parser.parse_args()
+
+    report = build_report(args.models)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Report written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, key, base, value in regressions:
+            print("Regression: {} {} {} -> {}".format(name, key, base, value))
+        sys.exit(1 if regressions else 0)
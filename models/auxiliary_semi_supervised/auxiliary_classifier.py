@@ -9,12 +9,20 @@ import tensorflow as tf
 from models.auxiliary_semi_supervised.decoder import px_given_zya, pa_given_zy
 from models.auxiliary_semi_supervised.encoder import qa_given_x, qz_given_ayx, qy_given_ax
 from models.classifier import softmax_classifier
-from models.utils.MNIST_pickled_preprocess import load_numpy_split, create_semisupervised, binarize_images
-from models.utils.batch_processing import get_next_batch
-from models.utils.distributions import auxiliary_elbo, tf_binary_xentropy
+from models.utils.MNIST_pickled_preprocess import load_semisupervised, binarize_images, compact_images
+from models.utils.batch_processing import get_batch_size, get_next_wrapped_batch, stream_weights
+from models.utils.compact_images import BITS, concatenate_images, encoded_features, float_rows
+from models.utils.distributions import auxiliary_elbo, tf_bernoulli_log_lik, draw_bernoulli
 from models.utils.distributions import prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import cls_accuracy, print_test_accuracy, convert_labels_to_cls, plot_images, plot_roc
-from models.utils.tf_helpers import one_label_tensor, variable_summaries
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.resident_split import ResidentSplit
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import one_label_tensor, variable_summaries, session_config, session_callable
+from models.utils.tf_helpers import image_input
 
 
 # TODO plot reconstructed images
@@ -36,7 +44,16 @@ class Auxiliary(object):
                  n_labeled,
                  num_iterations,
                  latent_dim=100,
-                 hidden_dim=500
+                 hidden_dim=500,
+                 compact=None,
+                 dynamic_binarization=False,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 balance_classes=False,
+                 labeled_fraction=None,
+                 accumulate_steps=1,
+                 data=None
                  ):
         self.latent_dim = latent_dim
         self.hidden_dim = hidden_dim
@@ -52,9 +69,17 @@ class Auxiliary(object):
         self.min_std = 0.1
         self.log_file = 'auxiliary.log'
         self.batch_norm = True
+        self.compact = compact
+        # (train, valid, test) used instead of the MNIST pickle, see MNIST_pickled_preprocess.load_numpy
+        self.data = data
+        self.dynamic_binarization = dynamic_binarization
+        # compact is None or an encoding of CompactImages, bit-packing needs binarized training images
+        assert not (compact == BITS and dynamic_binarization), 'use uint8 images with dynamic_binarization'
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
         """
                Initialize an skip deep generative model consisting of
                discriminative classifier q(y|a,x),
@@ -80,24 +105,48 @@ class Auxiliary(object):
         with self.G.as_default():
             self.train_x_l, self.train_l_y, self.train_u_x, self.train_u_y, self.valid_x, self.valid_y, \
             self.test_x, self.test_y, self.input_dim = self.extract_data()
+            self.memory.record('data_load')
+            # Without labeled_fraction the batches are split in half and the two loss sums count equally, as they
+            # always have; with it the sums are weighted to their share of the data
+            half_split = labeled_fraction is None
+            self.num_lab_batch, self.num_ulab_batch, _ = get_batch_size(num_examples=self.num_examples,
+                                                                        num_lab=self.n_labeled,
+                                                                        batch_size=self.batch_size,
+                                                                        labeled_fraction=0.5 if half_split
+                                                                        else labeled_fraction)
+            if half_split:
+                self.lab_weight, self.ulab_weight = 1.0, 1.0
+            else:
+                self.lab_weight, self.ulab_weight = stream_weights(self.num_examples, self.n_labeled,
+                                                                   self.num_lab_batch, self.num_ulab_batch)
             self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x')
             self.is_training = tf.placeholder(tf.bool)
-            self.x_lab = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_labeled')
-            self.x_unlab = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlabeled')
-            self.y_lab = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y_lab')
+            # Labeled batches are drawn in the graph from the resident labeled split unless fed, as for evaluation
+            # The images are fed and kept resident as stored, compact ones are decoded to float32 in the graph
+            self.labeled = ResidentSplit([[None, encoded_features(self.input_dim, self.compact)],
+                                          [None, self.num_classes]], name='resident_labeled',
+                                         dtypes=[tf.float32 if self.compact is None else tf.uint8, tf.float32])
+            x_lab, y_lab = self.labeled.sample(self.num_lab_batch, balance_classes)
+            self.x_lab, self.x_lab_images = image_input(self.input_dim, self.compact, name='x_labeled', default=x_lab)
+            self.x_unlab, x_unlab_images = image_input(self.input_dim, self.compact, name='x_unlabeled')
+            self.y_lab = tf.placeholder_with_default(y_lab, shape=[None, self.num_classes], name='y_lab')
+            self.x_lab_sample, self.x_unlab_sample = self.binarize(self.x_lab_images), self.binarize(x_unlab_images)
             self.y_true_cls = tf.argmax(self.y_lab, axis=1)
             self._objective()
             self.saver = tf.train.Saver()
             self.merged = tf.summary.merge_all()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.marginal_lik_lab],
+                                                 feed_list=[self.x_lab, self.y_lab, self.is_training])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/auxiliary_semi_supervised_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
 
     def _objective(self):
-        self.split_batch_size = int(self.batch_size / 2)
-        # TODO clean up batch assignment
-        self.num_lab_batch, self.num_ulab_batch = self.split_batch_size, self.split_batch_size
         self.num_batches = self.num_examples / self.batch_size
         logging.debug(
             "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
@@ -108,10 +157,11 @@ class Auxiliary(object):
                                                                                                         self.num_iterations / self.num_batches)))
         self.labeled_ELBO, self.y_lab_logits, self.x_recon_lab_mu, self.classifier_loss, \
         self.y_pred_cls = self.labeled_model()
-        self.marginal_lik_lab = tf.reduce_mean(self.total_lab_loss())
+        # Weighted as in training, the labeled term of the cost
+        self.marginal_lik_lab = tf.reduce_mean(self.lab_weight * self.total_lab_loss())
         if self.n_labeled == self.num_examples:
-            self.train_x_l = np.concatenate((self.train_x_l, self.train_u_x, self.valid_x), axis=0)
-            self.train_l_y = np.concatenate((self.train_l_y, self.train_u_y, self.valid_y), axis=0)
+            self.train_x_l = concatenate_images((self.train_x_l, self.train_u_x, self.valid_x))
+            self.train_l_y = concatenate_images((self.train_l_y, self.train_u_y, self.valid_y))
             # TODO check calculations
             self.total_marg_lik = self.marginal_lik_lab
             loss = "labeled loss"
@@ -119,7 +169,7 @@ class Auxiliary(object):
             logging.debug(loss)
         else:
             self.unlabeled_ELBO, self.y_ulab_logits = self.unlabeled_model()
-            self.total_marg_lik = tf.reduce_mean(self.total_lab_loss() + self.total_unlab_loss())
+            self.total_marg_lik = tf.reduce_mean(self.marginal_lik_lab + self.ulab_weight * self.total_unlab_loss())
             loss = "labeled + unlabeled loss"
             print(loss)
 
@@ -127,66 +177,80 @@ class Auxiliary(object):
         self.cost = ((self.total_marg_lik) * self.num_examples + prior_weights()) / (
             -self.num_examples)
         tf.summary.scalar('cost', self.cost)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
+        # Batch norm population statistics, fetched by every training step next to the optimizer
+        self.batch_norm_updates = tf.group(*tf.get_collection(tf.GraphKeys.UPDATE_OPS))
 
     def extract_data(self):
-        train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy_split(binarize_y=True)
-        x_l, y_l, x_u, y_u = create_semisupervised(train_x, train_y, self.n_labeled)
-        t_x_l, t_y_l = x_l.T, y_l.T
-        t_x_u, t_y_u = x_u.T, y_u.T
-        x_valid, y_valid = valid_x.T, valid_y.T
-        x_test, y_test = test_x.T, test_y.T
-
-        id_x_keep = np.std(t_x_u, axis=0) > self.min_std
+        train_x, train_y, split, x_valid, y_valid, x_test, y_test = load_semisupervised(self.n_labeled, seed=self.seed,
+                                                                                        data=self.data)
+
+        id_x_keep = np.std(train_x[split.unlabeled], axis=0) > self.min_std
         input_dim = len(id_x_keep[np.where(id_x_keep == True)])
         idx_print = "idx_keep count:{}".format(input_dim)
         print(idx_print)
         logging.debug(idx_print)
 
-        t_x_l = binarize_images(t_x_l)[:, id_x_keep]
-        t_x_u = binarize_images(t_x_u)[:, id_x_keep]
-        x_valid = binarize_images(x_valid)[:, id_x_keep]
-        x_test = binarize_images(x_test)[:, id_x_keep]
+        # Labeled and unlabeled examples are views on one preprocessed copy of the training images; with compact each
+        # split is encoded as soon as it is preprocessed, and decoded per batch in the graph
+        if self.dynamic_binarization:
+            # Training intensities are binarized in-graph per minibatch, evaluation splits once with a fixed seed
+            rng = np.random.RandomState(self.seed)
+            train_x = compact_images(train_x[:, id_x_keep], self.compact)
+            x_valid = compact_images(binarize_images(x_valid, rng)[:, id_x_keep], self.compact)
+            x_test = compact_images(binarize_images(x_test, rng)[:, id_x_keep], self.compact)
+        else:
+            train_x = compact_images(binarize_images(train_x)[:, id_x_keep], self.compact)
+            x_valid = compact_images(binarize_images(x_valid)[:, id_x_keep], self.compact)
+            x_test = compact_images(binarize_images(x_test)[:, id_x_keep], self.compact)
+        t_x_l, t_y_l, t_x_u, t_y_u = split.views(train_x, train_y)
 
         train_data_print = "x_l:{}, y_l:{}, x_u:{}, y_{}".format(t_x_l.shape, t_y_l.shape, t_x_u.shape, t_y_u.shape)
         print(train_data_print)
         logging.debug(train_data_print)
-        return t_x_l, t_y_l, t_x_u, t_y_u, x_valid, y_valid, x_test, y_test, t_x_l.shape[1]
+        return t_x_l, t_y_l, t_x_u, t_y_u, x_valid, y_valid, x_test, y_test, input_dim
+
+    def binarize(self, x):
+        if not self.dynamic_binarization:
+            return x
+        return tf.cond(self.is_training, lambda: draw_bernoulli(x), lambda: x)
 
     def train_neural_network(self):
         train_print = "Training Auxiliary VAE:"
         print(train_print)
         logging.debug(train_print)
         self.session.run(tf.global_variables_initializer())
+        self.labeled.load(self.session, self.train_x_l, self.train_l_y)
 
         best_validation_accuracy = 0
         last_improvement = 0
 
         start_time = time.time()
-        idx_labeled = 0
         idx_unlabeled = 0
 
+        # The training accuracy and labeled loss come from the labeled batch drawn in the graph in the same step, only
+        # its predicted classes and labels are fetched
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer,
+                                                         self.batch_norm_updates, self.y_pred_cls, self.y_lab,
+                                                         self.marginal_lik_lab],
+                                           feed_list=[self.x_unlab, self.is_training])
+        self.telemetry.start()
         for i in range(self.num_iterations):
 
-            # Batch Training
-            x_l_batch, y_l_batch, idx_labeled = get_next_batch(self.train_x_l, self.train_l_y, idx_labeled,
-                                                               self.num_lab_batch)
-            x_u_batch, _, idx_unlabeled = get_next_batch(self.train_u_x, self.train_u_y, idx_unlabeled,
-                                                         self.num_ulab_batch)
-            feed_dict_train = {self.x_lab: x_l_batch, self.y_lab: y_l_batch,
-                               self.x_unlab: x_u_batch, self.is_training: True}
-
-            summary, batch_loss, _ = self.session.run(
-                [self.merged, self.cost, self.optimizer],
-                feed_dict=feed_dict_train)
-            train_correct, _, batch_marg_lik_lab = self.predict_cls(images=x_l_batch,
-                                                                    labels=y_l_batch,
-                                                                    cls_true=convert_labels_to_cls(y_l_batch))
-            acc_train, _ = cls_accuracy(train_correct)
+            # Batch Training, the labeled batch is drawn in the graph
+            (x_u_batch,), idx_unlabeled = get_next_wrapped_batch([self.train_u_x], idx_unlabeled, self.num_ulab_batch)
+            self.telemetry.lap('data')
+            summary, batch_loss, _, _, cls_pred, y_l_batch, batch_marg_lik_lab = train_step(i, x_u_batch, True)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
+            acc_train, _ = cls_accuracy(convert_labels_to_cls(y_l_batch) == cls_pred)
 
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
@@ -194,9 +258,12 @@ class Auxiliary(object):
                                                             labels=self.test_y,
                                                             cls_true=convert_labels_to_cls(self.test_y))
                 acc_validation, _ = cls_accuracy(correct)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -215,6 +282,11 @@ class Auxiliary(object):
                 #     print("No improvement found in a while, stopping optimization.")
                 #     # Break out from the for-loop.
                 #     break
+            if idx_unlabeled < self.num_ulab_batch:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
+        self.telemetry.close()
+        self.tracer.close()
         # Ending time.
         end_time = time.time()
         time_dif = end_time - start_time
@@ -223,10 +295,8 @@ class Auxiliary(object):
         logging.debug(time_dif_print)
 
     def reconstruct(self, x_test, y_test):
-        x_recon = self.session.run(self.x_recon_lab_mu,
-                                   feed_dict={self.x_lab: x_test, self.y_lab: y_test, self.is_training: False})
-        log_lik = -tf.reduce_sum(tf_binary_xentropy(x_true=x_test, x_approx=x_recon))
-        return x_recon, log_lik.eval()
+        return self.session.run([self.x_recon_lab_mu, self.recon_log_lik],
+                                feed_dict={self.x_lab: x_test, self.y_lab: y_test, self.is_training: False})
 
     def test_reconstruction(self):
         num_images = 20
@@ -236,11 +306,13 @@ class Auxiliary(object):
         log_lik_print = "test log_lik:{}".format(log_lik / num_images)
         print(log_lik_print)
         logging.debug(log_lik_print)
-        plot_images(x_test, x_recon, num_images, "auxiliary")
+        plot_images(float_rows(self.test_x, slice(0, num_images)), x_recon, num_images, "auxiliary")
 
     def total_lab_loss(self):
         # gradient of -KL(q(z|y,x) ~p(x,y) || p(x,y,z))
-        beta = self.alpha * (float(self.batch_size) / self.num_lab_batch)
+        # alpha * batch_size / num_lab_batch per labeled example once weighted by lab_weight: the half split keeps its
+        # old weight and the weighted split gets alpha * N / N_l
+        beta = self.alpha * (float(self.batch_size) / (self.num_lab_batch * self.lab_weight))
         weighted_classifier_loss = beta * self.classifier_loss
         labeled_loss = tf.reduce_sum(tf.subtract(self.labeled_ELBO, weighted_classifier_loss))
         tf.summary.scalar('labeled_loss', labeled_loss)
@@ -261,18 +333,15 @@ class Auxiliary(object):
         num_images = len(images)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
         i = 0
-        num_batches = num_images / self.split_batch_size
+        # Per num_lab_batch examples, the labeled share of a training batch
+        num_batches = num_images / float(self.num_lab_batch)
         total_marg = 0.0
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x_lab: batch_images,
-                         self.y_lab: batch_labels,
-                         self.is_training: False}
-            cls_pred[i:j], batch_marg = self.session.run([self.y_pred_cls, self.marginal_lik_lab],
-                                                         feed_dict=feed_dict)
+            cls_pred[i:j], batch_marg = self.predict_step(batch_images, batch_labels, False)
             total_marg += batch_marg
             i = j
         correct = (cls_true == cls_pred)
@@ -294,20 +363,22 @@ class Auxiliary(object):
         logits = self.session.run(self.y_lab_logits, feed_dict=feed_dict)
         plot_roc(logits, self.test_y, self.num_classes, name='auxiliary')
         self.test_reconstruction()
+        self.memory.record('test')
+        report_renderer.submit()
 
     def unlabeled_model(self):
         # Ulabeled
-        a, a_mu, a_logvar = qa_given_x(self.x_unlab, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+        a, a_mu, a_logvar = qa_given_x(self.x_unlab_sample, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                                        latent_dim=self.latent_dim, is_training=self.is_training, reuse=True)
 
-        logits = qy_given_ax(a=a, x=self.x_unlab, latent_dim=self.latent_dim,
+        logits = qy_given_ax(a=a, x=self.x_unlab_sample, latent_dim=self.latent_dim,
                              num_classes=self.num_classes, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                              is_training=self.is_training, batch_norm=self.batch_norm, reuse=True)
         elbo = []
         total_log_lik = 0.0
         for label in range(self.num_classes):
             y_ulab = one_label_tensor(label, self.num_ulab_batch, self.num_classes)
-            z, z_mu, z_logvar = qz_given_ayx(a=a, y=y_ulab, x=self.x_unlab, latent_dim=self.latent_dim,
+            z, z_mu, z_logvar = qz_given_ayx(a=a, y=y_ulab, x=self.x_unlab_sample, latent_dim=self.latent_dim,
                                              num_classes=self.num_classes, hidden_dim=self.hidden_dim,
                                              input_dim=self.input_dim, is_training=self.is_training,
                                              batch_norm=self.batch_norm, reuse=True)
@@ -317,27 +388,28 @@ class Auxiliary(object):
                                                               num_classes=self.num_classes,
                                                               is_training=self.is_training, batch_norm=self.batch_norm,
                                                               reuse=True)
-            x_recon_mu = px_given_zya(y=y_ulab, z=z, qa=a, latent_dim=self.latent_dim,
-                                      num_classes=self.num_classes,
-                                      hidden_dim=self.hidden_dim, input_dim=self.input_dim,
-                                      is_training=self.is_training,
-                                      batch_norm=self.batch_norm, reuse=True)
-            class_elbo = auxiliary_elbo(x_recon=x_recon_mu, x=self.x_unlab, y=y_ulab, qz=[z, z_mu, z_logvar],
-                                        qa=[a, a_mu, a_logvar], pa=[a_recon, a_recon_mu, a_recon_logvar])
+            x_recon_mu, x_recon_logits = px_given_zya(y=y_ulab, z=z, qa=a, latent_dim=self.latent_dim,
+                                                      num_classes=self.num_classes,
+                                                      hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+                                                      is_training=self.is_training,
+                                                      batch_norm=self.batch_norm, reuse=True)
+            class_elbo = auxiliary_elbo(x_logits=x_recon_logits, x=self.x_unlab_sample, y=y_ulab,
+                                        qz=[z, z_mu, z_logvar], qa=[a, a_mu, a_logvar],
+                                        pa=[a_recon, a_recon_mu, a_recon_logvar])
             elbo.append(class_elbo)
         elbo = tf.convert_to_tensor(elbo)
         print("unlabeled class_elbo:{}".format(elbo))
         return tf.transpose(elbo), logits
 
     def labeled_model(self):
-        a, a_mu, a_logvar = qa_given_x(self.x_lab, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+        a, a_mu, a_logvar = qa_given_x(self.x_lab_sample, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                                        latent_dim=self.latent_dim, is_training=self.is_training)
 
-        logits = qy_given_ax(a=a, x=self.x_lab, latent_dim=self.latent_dim,
+        logits = qy_given_ax(a=a, x=self.x_lab_sample, latent_dim=self.latent_dim,
                              num_classes=self.num_classes, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                              is_training=self.is_training, batch_norm=self.batch_norm)
 
-        z, z_mu, z_logvar = qz_given_ayx(a=a, y=self.y_lab, x=self.x_lab, latent_dim=self.latent_dim,
+        z, z_mu, z_logvar = qz_given_ayx(a=a, y=self.y_lab, x=self.x_lab_sample, latent_dim=self.latent_dim,
                                          num_classes=self.num_classes, hidden_dim=self.hidden_dim,
                                          input_dim=self.input_dim, is_training=self.is_training,
                                          batch_norm=self.batch_norm)
@@ -346,10 +418,13 @@ class Auxiliary(object):
                                                           hidden_dim=self.hidden_dim,
                                                           num_classes=self.num_classes, is_training=self.is_training,
                                                           batch_norm=self.batch_norm)
-        x_recon_mu = px_given_zya(y=self.y_lab, z=z, qa=a, latent_dim=self.latent_dim,
-                                  num_classes=self.num_classes, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
-                                  is_training=self.is_training, batch_norm=self.batch_norm)
-        elbo = auxiliary_elbo(x_recon=x_recon_mu, x=self.x_lab, y=self.y_lab, qz=[z, z_mu, z_logvar],
+        x_recon_mu, x_recon_logits = px_given_zya(y=self.y_lab, z=z, qa=a, latent_dim=self.latent_dim,
+                                                  num_classes=self.num_classes, hidden_dim=self.hidden_dim,
+                                                  input_dim=self.input_dim, is_training=self.is_training,
+                                                  batch_norm=self.batch_norm)
+        # Log likelihood of the fed images under the reconstruction, from the logits
+        self.recon_log_lik = tf_bernoulli_log_lik(x_true=self.x_lab_images, logits=x_recon_logits)
+        elbo = auxiliary_elbo(x_logits=x_recon_logits, x=self.x_lab_sample, y=self.y_lab, qz=[z, z_mu, z_logvar],
                               qa=[a, a_mu, a_logvar], pa=[a_recon, a_recon_mu, a_recon_logvar])
 
         classifier_loss, y_pred_cls = softmax_classifier(logits=logits, y_true=self.y_lab)
@@ -28,10 +28,10 @@ def px_given_zya(z, y, qa, hidden_dim, input_dim, latent_dim, num_classes, is_tr
 
         # Reconstruction layer
         # x_mu = mlp_neuron(h2, w_mu, b_mu, activation=False)
-        fully_connected = mlp_neuron(h2, w_mu, b_mu, activation=False)  # TODO look at activation?
+        x_logits = mlp_neuron(h2, w_mu, b_mu, activation=False)
 
-        x_mu = tf.nn.sigmoid(fully_connected)
-        return x_mu
+        x_mu = tf.nn.sigmoid(x_logits)
+        return x_mu, x_logits
 
 
 def pa_given_zy(z, y, hidden_dim, latent_dim, num_classes, is_training, batch_norm, reuse=False):
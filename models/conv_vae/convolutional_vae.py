@@ -10,8 +10,15 @@ from models.conv_vae.decoder import px_given_z1
 from models.conv_vae.encoder import q_z1_given_x
 from models.utils.MNIST_pickled_preprocess import extract_data
 from models.utils.batch_processing import get_next_batch
+from models.utils.compact_images import concatenate_images, float_rows
 from models.utils.distributions import elbo_M1, prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import plot_images, plot_cost
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import image_input, session_config, session_callable
 
 
 class ConvVariationalAutoencoder(object):
@@ -30,7 +37,13 @@ class ConvVariationalAutoencoder(object):
                  num_filters,
                  batch_norm=False,
                  keep_prob=1,
-                 gpu_memory_fraction=1
+                 gpu_memory_fraction=1,
+                 compact=None,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 accumulate_steps=1,
+                 data=None
                  ):
         self.input_dim, self.latent_dim = input_dim, latent_dim
         self.filter_sizes = filter_sizes
@@ -39,6 +52,9 @@ class ConvVariationalAutoencoder(object):
         self.batch_size = batch_size
         self.batch_norm = batch_norm
         self.keep_prob = keep_prob
+        self.compact = compact
+        # (train, valid, test) used instead of the MNIST pickle, see MNIST_pickled_preprocess.load_numpy
+        self.data = data
         self.seed = seed
         self.require_improvement = require_improvement
         self.num_iterations = num_iterations
@@ -47,6 +63,10 @@ class ConvVariationalAutoencoder(object):
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
+        self.jit = jit
+        self.trace_steps, self.telemetry_every = trace_steps, telemetry_every
         self.config = tf.ConfigProto(log_device_placement=False)
         self.config.gpu_options.per_process_gpu_memory_fraction = gpu_memory_fraction
 
@@ -61,27 +81,36 @@ class ConvVariationalAutoencoder(object):
     def _build_graph(self):
         self.G = tf.Graph()
         with self.G.as_default():
-            self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x')
-            self.x_image = tf.reshape(self.x, [-1, 28, 28, 1])
+            # Fed with rows of the splits as stored, compact ones are decoded to float32 in the graph
+            self.x, self.x_images = image_input(self.input_dim, self.compact, name='x')
+            self.x_image = tf.reshape(self.x_images, [-1, 28, 28, 1])
             self._objective()
             self.saver = tf.train.Saver()
-            self.session = tf.Session(config=self.config)
+            self.session = tf.Session(config=session_config(jit=self.jit, config=self.config))
+            self.validation_step = session_callable(self.session, [self.cost, self.loglik], feed_list=[self.x])
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=self.trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=self.telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
             self.merged = tf.summary.merge_all()
 
     def _objective(self):
         self.num_examples = 50000
         train_x_l, train_l_y, train_u_x, train_u_y, self.valid_x, self.valid_y, self.test_x, self.test_y = extract_data(
-            self.num_examples)
+            self.num_examples, compact=self.compact, seed=self.seed, data=self.data)
+        self.memory.record('data_load')
         self.num_batches = int(self.num_examples / self.batch_size)
         logging.debug("num batches:{}, batch_size:{}, epochs:{}".format(self.num_batches, self.batch_size, int(
             self.num_iterations / self.num_batches)))
-        self.train_x = np.concatenate((train_x_l, train_u_x), axis=0)
-        self.train_y = np.concatenate((train_l_y, train_u_y), axis=0)
+        self.train_x = concatenate_images((train_x_l, train_u_x))
+        self.train_y = concatenate_images((train_l_y, train_u_y))
         elbo, self.x_recon_mu, self.z_sample, self.z_mu, self.z_logvar, self.loglik = self.build_model()
         self.cost = (elbo * self.num_batches + prior_weights()) / (-self.batch_size * self.num_batches)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train(self):
         train_print = "Training Conv VAE Model:"
@@ -102,12 +131,16 @@ class ConvVariationalAutoencoder(object):
         start_time = time.time()
         idx = 0
         epochs = 0
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.loglik, self.optimizer],
+                                           feed_list=[self.x])
+        self.telemetry.start()
         for i in range(self.num_iterations):
             # Batch Training
             x_batch, _, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            summary, batch_loss, batch_log_lik, _ = self.session.run(
-                [self.merged, self.cost, self.loglik, self.optimizer],
-                feed_dict={self.x: x_batch})
+            self.telemetry.lap('data')
+            summary, batch_loss, batch_log_lik, _ = train_step(i, x_batch)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             # Batch Trainin
             if idx == self.num_examples:
                 epochs += 1
@@ -116,6 +149,7 @@ class ConvVariationalAutoencoder(object):
                 is_epoch = False
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (is_epoch) or (i == (self.num_iterations - 1)):
                 validation_loss, val_log_lik = self.validation_loss(images=self.valid_x)
@@ -124,9 +158,12 @@ class ConvVariationalAutoencoder(object):
                 self.validation_cost.append(validation_loss)
                 self.validation_log_lik.append(val_log_lik)
                 # Calculate the accuracy
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if validation_loss < best_validation_loss:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_loss = validation_loss
                     last_improvement = i
@@ -144,11 +181,16 @@ class ConvVariationalAutoencoder(object):
                                                                                  int(batch_log_lik),
                                                                                  int(validation_loss),
                                                                                  int(val_log_lik), improved_str))
+            if is_epoch:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 logging.debug("No improvement found in a while, stopping optimization.")
                 # Break o    ut from the for-loop.
                 break  # Ending time.
+        self.telemetry.close()
+        self.tracer.close()
         end_time = time.time()
         time_dif = end_time - start_time
         print("Time usage: " + str(timedelta(seconds=int(round(time_dif)))))
@@ -157,16 +199,15 @@ class ConvVariationalAutoencoder(object):
 
     def validation_loss(self, images):
         num_images = len(images)
+        num_val_batches = int(num_images / self.batch_size)
         total_loss = 0.0
         total_log_lik = 0.0
         i = 0
-        num_val_batches = int(num_images / self.batch_size)
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
-            feed_dict = {self.x: batch_images}
-            batch_loss, log_lik = self.session.run([self.cost, self.loglik], feed_dict=feed_dict)
+            batch_loss, log_lik = self.validation_step(batch_images)
             total_loss += batch_loss
             total_log_lik += log_lik
             i = j
@@ -186,11 +227,11 @@ class ConvVariationalAutoencoder(object):
         print("z:{}".format(z.shape))
         z = tf.expand_dims(tf.expand_dims(z, 1), 1)
         print("expanded z:{}".format(z.shape))
-        x_mu = px_given_z1(z1=z, input_dim=self.input_dim,
-                           num_channels=50,
-                           filter_sizes=self.filter_sizes,
-                           fc_size=self.fc_size, num_filters=self.num_filters)
-        loss, log_lik = elbo_M1(x_recon=x_mu, x_true=self.x, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
+        x_mu, x_logits = px_given_z1(z1=z, input_dim=self.input_dim,
+                                     num_channels=50,
+                                     filter_sizes=self.filter_sizes,
+                                     fc_size=self.fc_size, num_filters=self.num_filters)
+        loss, log_lik = elbo_M1(x_logits=x_logits, x_true=self.x_images, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
         return tf.reduce_sum(loss), x_mu, z, z_mu, z_logvar, log_lik / self.batch_size
 
     def train_test(self):
@@ -200,6 +241,8 @@ class ConvVariationalAutoencoder(object):
         test_perf = "Test Loss:{}, Log_lik:{}".format(test_loss, test_log_lik)
         print(test_perf)
         logging.debug(test_perf)
+        self.memory.record('test')
+        report_renderer.submit()
 
         nega_valid_log_lik = np.multiply(self.validation_log_lik, -1)
         neg_train_log_lik = np.multiply(self.train_log_lik, -1)
@@ -214,7 +257,7 @@ class ConvVariationalAutoencoder(object):
         # TODO improve reconstruction plot and plot many images
         num_images = 5
         x_test = self.test_x[0:num_images, ]
-        plot_images(x_test, self.decode(x_test), num_images, "conv_vae")
+        plot_images(float_rows(self.test_x, slice(0, num_images)), self.decode(x_test), num_images, "conv_vae")
 
     def decode(self, x_test):
         return self.session.run(self.x_recon_mu, feed_dict={self.x: x_test})
@@ -27,8 +27,9 @@ def px_given_z1(z1, input_dim, num_channels, filter_sizes, fc_size, num_filters,
         layer_fc1 = fc_layer(input=layer_flat, num_inputs=num_features, num_outputs=fc_size, use_relu=True)
         print("layer fc1: {}".format(layer_fc1))
 
-        # x_mu = mlp_neuron(h2, w_mu, b_mu, activation=False)
-        x_mu = tf.nn.sigmoid(fc_layer(input=layer_fc1, num_inputs=fc_size, num_outputs=input_dim, use_relu=False))
+        # Logits for the fused Bernoulli log likelihood, x_mu for reconstructions
+        x_logits = fc_layer(input=layer_fc1, num_inputs=fc_size, num_outputs=input_dim, use_relu=False)
+        x_mu = tf.nn.sigmoid(x_logits)
         tf.summary.image('x_mu', tf.reshape(x_mu[0], [1, 28, 28, 1]))
 
-    return x_mu
+    return x_mu, x_logits
@@ -8,8 +8,14 @@ import tensorflow as tf
 
 from models.utils.MNIST_pickled_preprocess import extract_data
 from models.utils.batch_processing import get_next_batch
+from models.utils.compact_images import concatenate_images
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import convert_labels_to_cls, cls_accuracy, print_test_accuracy, plot_roc
-from models.utils.tf_helpers import create_nn_weights, mlp_neuron
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import create_nn_weights, mlp_neuron, image_input, session_config, session_callable
 
 
 class MLPClassifier(object):
@@ -23,7 +29,13 @@ class MLPClassifier(object):
                  num_iterations,
                  input_dim,
                  num_classes,
-                 hidden_dim=500
+                 hidden_dim=500,
+                 compact=None,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 accumulate_steps=1,
+                 data=None
                  ):
         self.input_dim = input_dim
         self.hidden_dim = hidden_dim
@@ -34,37 +46,55 @@ class MLPClassifier(object):
         self.learning_rate, self.beta1, self.beta2 = learning_rate, beta1, beta2
         self.log_file = 'mlp_classifier.log'
         self.num_classes = num_classes
+        self.compact = compact
+        # (train, valid, test) used instead of the MNIST pickle, see MNIST_pickled_preprocess.load_numpy
+        self.data = data
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
 
         ''' Create Graph '''
         self.G = tf.Graph()
         with self.G.as_default():
-            self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x')
+            # Fed with rows of the splits as stored, compact ones are decoded to float32 in the graph
+            self.x, self.x_images = image_input(self.input_dim, self.compact, name='x')
             self.y = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y')
             self._objective()
             self.saver = tf.train.Saver()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.auc, self.auc_update = tf.contrib.metrics.streaming_auc(predictions=self.y_logits, labels=self.y,
+                                                                         curve='ROC')
+            self.reset_metrics = tf.local_variables_initializer()
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.auc_update],
+                                                 feed_list=[self.x, self.y])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/mlp_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
             self.merged = tf.summary.merge_all()
 
     def _objective(self):
         n_train_examples = 50000
         train_x_l, train_l_y, train_u_x, train_u_y, self.valid_x, self.valid_y, self.test_x, self.test_y = extract_data(
-            n_train_examples)
-        self.train_x = np.concatenate((train_x_l, train_u_x), axis=0)
-        self.train_y = np.concatenate((train_l_y, train_u_y), axis=0)
+            n_train_examples, compact=self.compact, seed=self.seed, data=self.data)
+        self.memory.record('data_load')
+        self.train_x = concatenate_images((train_x_l, train_u_x))
+        self.train_y = concatenate_images((train_l_y, train_u_y))
         num_batches = int(n_train_examples / self.batch_size)
         logging.debug("num batches:{}, batch_size:{}, epochs:{}".format(num_batches, self.batch_size, int(
             self.num_iterations / num_batches)))
 
         self.y_logits, self.y_pred_cls, self.cost = self.build_model()
         tf.summary.scalar('cost', self.cost)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train_neural_network(self):
         print_training = "Training MLP:"
@@ -77,12 +107,18 @@ class MLPClassifier(object):
         start_time = time.time()
         idx = 0
 
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer],
+                                           feed_list=[self.x, self.y])
+        self.telemetry.start()
         for i in range(self.num_iterations):
             # Batch Training
             x_batch, y_batch, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            summary, batch_loss, _ = self.session.run([self.merged, self.cost, self.optimizer],
-                                                      feed_dict={self.x: x_batch, self.y: y_batch})
+            self.telemetry.lap('data')
+            summary, batch_loss, _ = train_step(i, x_batch, y_batch)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
@@ -90,9 +126,12 @@ class MLPClassifier(object):
                                               labels=self.valid_y,
                                               cls_true=convert_labels_to_cls(self.valid_y))
                 acc_validation, _ = cls_accuracy(correct)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -104,6 +143,9 @@ class MLPClassifier(object):
                             " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str)
                 print(print_opt)
                 logging.debug(print_opt)
+            if idx == self.train_x.shape[0]:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print_impro = "No improvement found in a while, stopping optimization."
                 print(print_impro)
@@ -111,6 +153,8 @@ class MLPClassifier(object):
                 # Break out from the for-loop.
                 break
                 # Ending time.
+        self.telemetry.close()
+        self.tracer.close()
         end_time = time.time()
         time_dif = end_time - start_time
         print_time = "Time usage: " + str(timedelta(seconds=int(round(time_dif))))
@@ -121,21 +165,16 @@ class MLPClassifier(object):
         num_images = len(images)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
         i = 0
-        mean_auc, batch_auc = tf.contrib.metrics.streaming_auc(predictions=self.y_logits, labels=self.y,
-                                                               curve='ROC')
-        self.session.run(tf.local_variables_initializer())
+        # The streaming AUC update of each batch returns the AUC over the batches so far
         final_mean_value = 0.0
+        self.session.run(self.reset_metrics)
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x: batch_images,
-                         self.y: batch_labels}
-            cls_pred[i:j] = self.session.run(self.y_pred_cls,
-                                             feed_dict=feed_dict)
+            cls_pred[i:j], final_mean_value = self.predict_step(batch_images, batch_labels)
             i = j
-            final_mean_value, auc = self.session.run([mean_auc, batch_auc], feed_dict=feed_dict)
         print_auc = 'Final Mean AUC: %f' % final_mean_value
         print(print_auc)
         logging.debug(print_auc)
@@ -149,7 +188,7 @@ class MLPClassifier(object):
             w_h2, b_h2 = create_nn_weights('y_h2', 'infer', [self.hidden_dim, self.hidden_dim])
             w_y, b_y = create_nn_weights('y_fully_connected', 'infer', [self.hidden_dim, self.num_classes])
 
-            h1 = mlp_neuron(self.x, w_h1, b_h1)
+            h1 = mlp_neuron(self.x_images, w_h1, b_h1)
             h2 = mlp_neuron(h1, w_h2, b_h2)
             logits = mlp_neuron(h2, w_y, b_y, activation=False)
             y_pred = tf.nn.softmax(logits)
@@ -169,3 +208,5 @@ class MLPClassifier(object):
         logits = self.session.run(self.y_logits, feed_dict=feed_dict)
         plot_roc(logits, self.test_y, self.num_classes, name='MLP')
         print_test_accuracy(correct, cls_pred, self.test_y, logging)
+        self.memory.record('test')
+        report_renderer.submit()
@@ -7,8 +7,13 @@ import numpy as np
 import tensorflow as tf
 
 from models.utils.batch_processing import get_next_batch
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import convert_labels_to_cls, cls_accuracy, print_test_accuracy, plot_roc
-from models.utils.tf_helpers import create_nn_weights, mlp_neuron
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import create_nn_weights, mlp_neuron, session_config, session_callable
 
 
 class PCAClassifier(object):
@@ -26,7 +31,10 @@ class PCAClassifier(object):
                  valid,
                  test,
                  hidden_dim=500,
-
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 accumulate_steps=1
                  ):
         self.input_dim = input_dim
         self.hidden_dim = hidden_dim
@@ -43,6 +51,8 @@ class PCAClassifier(object):
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
 
         ''' Create Graph '''
         self.G = tf.Graph()
@@ -51,10 +61,19 @@ class PCAClassifier(object):
             self.y = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y')
             self._objective()
             self.saver = tf.train.Saver()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.auc, self.auc_update = tf.contrib.metrics.streaming_auc(predictions=self.y_logits, labels=self.y,
+                                                                         curve='ROC')
+            self.reset_metrics = tf.local_variables_initializer()
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.auc_update],
+                                                 feed_list=[self.x, self.y])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/pca_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
             self.merged = tf.summary.merge_all()
 
     def _objective(self):
@@ -66,8 +85,10 @@ class PCAClassifier(object):
 
         self.y_logits, self.y_pred_cls, self.cost = self.build_model()
         tf.summary.scalar('cost', self.cost)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train_neural_network(self):
         print_training = "Training PCA MLP:"
@@ -80,12 +101,18 @@ class PCAClassifier(object):
         start_time = time.time()
         idx = 0
 
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer],
+                                           feed_list=[self.x, self.y])
+        self.telemetry.start()
         for i in range(self.num_iterations):
             # Batch Training
             x_batch, y_batch, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            summary, batch_loss, _ = self.session.run([self.merged, self.cost, self.optimizer],
-                                                      feed_dict={self.x: x_batch, self.y: y_batch})
+            self.telemetry.lap('data')
+            summary, batch_loss, _ = train_step(i, x_batch, y_batch)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
@@ -93,9 +120,12 @@ class PCAClassifier(object):
                                               labels=self.valid_y,
                                               cls_true=convert_labels_to_cls(self.valid_y))
                 acc_validation, _ = cls_accuracy(correct)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -107,6 +137,9 @@ class PCAClassifier(object):
                             " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str)
                 print(print_opt)
                 logging.debug(print_opt)
+            if idx == self.train_x.shape[0]:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print_imp = "No improvement found in a while, stopping optimization."
                 print(print_imp)
@@ -114,6 +147,8 @@ class PCAClassifier(object):
                 # Break out from the for-loop.
                 break
                 # Ending time.
+        self.telemetry.close()
+        self.tracer.close()
         end_time = time.time()
         time_dif = end_time - start_time
         print_time = "Time usage: " + str(timedelta(seconds=int(round(time_dif))))
@@ -124,21 +159,16 @@ class PCAClassifier(object):
         num_images = len(images)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
         i = 0
-        mean_auc, batch_auc = tf.contrib.metrics.streaming_auc(predictions=self.y_logits, labels=self.y,
-                                                               curve='ROC')
-        self.session.run(tf.local_variables_initializer())
+        # The streaming AUC update of each batch returns the AUC over the batches so far
         final_mean_value = 0.0
+        self.session.run(self.reset_metrics)
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x: batch_images,
-                         self.y: batch_labels}
-            cls_pred[i:j] = self.session.run(self.y_pred_cls,
-                                             feed_dict=feed_dict)
+            cls_pred[i:j], final_mean_value = self.predict_step(batch_images, batch_labels)
             i = j
-            final_mean_value, auc = self.session.run([mean_auc, batch_auc], feed_dict=feed_dict)
         print_auc = 'Final Mean AUC: %f' % final_mean_value
         print(print_auc)
         logging.debug(print_auc)
@@ -171,3 +201,5 @@ class PCAClassifier(object):
         logits = self.session.run(self.y_logits, feed_dict=feed_dict)
         plot_roc(logits, self.test_y, self.num_classes, name='PCA')
         print_test_accuracy(correct, cls_pred, self.test_y, logging)
+        self.memory.record('test')
+        report_renderer.submit()
@@ -9,13 +9,19 @@ import tensorflow as tf
 from models.classifier import softmax_classifier
 from models.semi_supervised_conv_vae.decoder import pz1_given_z2y
 from models.semi_supervised_conv_vae.encoder import q_z2_given_z1y, qy_given_z1
-from models.utils.batch_processing import get_encoded_next_batch, get_batch_size
+from models.utils.batch_processing import get_next_wrapped_batch, get_batch_size, stream_weights
 from models.utils.distributions import draw_norm
 from models.utils.distributions import elbo_M2
 from models.utils.distributions import prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import cls_accuracy, print_test_accuracy, convert_labels_to_cls, plot_images, plot_roc, \
     plot_cost, plot_line
-from models.utils.tf_helpers import one_label_tensor, variable_summaries
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.resident_split import ResidentSplit
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import one_label_tensor, variable_summaries, session_config, session_callable
 
 
 # TODO binarize input images
@@ -42,7 +48,14 @@ class ConvGenerativeClassifier(object):
                  batch_norm=False,
                  keep_prob=1,
                  gpu_memory_fraction=1,
-                 hidden_dim=600
+                 hidden_dim=600,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 balance_classes=False,
+                 batch_size=None,
+                 labeled_fraction=None,
+                 accumulate_steps=1
                  ):
         self.input_dim, self.latent_dim = input_dim, latent_dim
         self.hidden_dim = hidden_dim
@@ -63,6 +76,11 @@ class ConvGenerativeClassifier(object):
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
+        self.jit = jit
+        self.trace_steps, self.telemetry_every = trace_steps, telemetry_every
+        self.balance_classes = balance_classes
         self.config = tf.ConfigProto(log_device_placement=False)
         self.config.gpu_options.per_process_gpu_memory_fraction = gpu_memory_fraction
 
@@ -74,53 +92,77 @@ class ConvGenerativeClassifier(object):
         self.validation_cost = []
         self.validation_accuracy = []
         self.train_cost = []
+        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
+                                                                                  num_batches=self.num_batches,
+                                                                                  num_lab=self.n_labeled,
+                                                                                  batch_size=batch_size,
+                                                                                  labeled_fraction=labeled_fraction)
+        self.num_batches = self.num_examples / float(self.batch_size)
+        self.lab_weight, self.ulab_weight = stream_weights(self.num_examples, self.n_labeled, self.num_lab_batch,
+                                                           self.num_ulab_batch)
+        logging.debug(
+            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
+                                                                                                    self.batch_size,
+                                                                                                    self.num_lab_batch,
+                                                                                                    self.num_ulab_batch,
+                                                                                                    int(
+                                                                                                        self.num_iterations / self.num_batches)))
         self._build_graph()
 
     def _build_graph(self):
         self.G = tf.Graph()
         with self.G.as_default():
-            self.x_lab_mu = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_lab_mu')
+            # Labeled batches are drawn in the graph from the resident labeled split unless fed, as for evaluation
+            self.labeled = ResidentSplit([[None, self.input_dim], [None, self.input_dim], [None, self.num_classes]],
+                                         name='resident_labeled')
+            x_lab_mu, x_lab_logvar, y_lab = self.labeled.sample(self.num_lab_batch, self.balance_classes)
+            self.x_lab_mu = tf.placeholder_with_default(x_lab_mu, shape=[None, self.input_dim], name='x_lab_mu')
             self.x_unlab_mu = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlab_mu')
-            self.x_lab_logvar = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_ulab_logvar')
+            self.x_lab_logvar = tf.placeholder_with_default(x_lab_logvar, shape=[None, self.input_dim],
+                                                            name='x_ulab_logvar')
             self.x_unlab_logvar = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlab_logvar')
-            self.y_lab = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y_lab')
+            self.y_lab = tf.placeholder_with_default(y_lab, shape=[None, self.num_classes], name='y_lab')
             self.y_true_cls = tf.argmax(self.y_lab, axis=1)
             self._objective()
             self.saver = tf.train.Saver()
             self.merged = tf.summary.merge_all()
-            self.session = tf.Session(config=self.config)
+            self.session = tf.Session(config=session_config(jit=self.jit, config=self.config))
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.eval_cost],
+                                                 feed_list=[self.x_lab_mu, self.x_lab_logvar, self.y_lab])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/semi_supervised_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=self.trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=self.telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
 
     def _objective(self):
 
         # Labeled
-        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
-                                                                                  num_batches=self.num_batches,
-                                                                                  num_lab=self.n_labeled)
-        logging.debug(
-            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
-                                                                                                    self.batch_size,
-                                                                                                    self.num_lab_batch,
-                                                                                                    self.num_ulab_batch,
-                                                                                                    int(
-                                                                                                        self.num_iterations / self.num_batches)))
         self.labeled_ELBO, self.y_lab_logits, self.x_recon_lab_mu, self.classifier_loss, self.y_pred_cls = self.labeled_model()
+        labeled_loss = self.total_lab_loss()
         if self.n_labeled == self.num_examples:
             self.train_x_l_mu = np.concatenate((self.train_x_l_mu, self.train_x_u_mu), axis=0)
             self.train_x_l_logvar = np.concatenate((self.train_x_l_logvar, self.train_x_u_logvar), axis=0)
             self.train_l_y = np.concatenate((self.train_l_y, self.train_u_y), axis=0)
 
-            self.cost = ((self.total_lab_loss() * self.num_examples) + prior_weights()) / (
+            weights_prior = prior_weights()
+            self.cost = ((labeled_loss * self.num_examples) + weights_prior) / (
                 -self.batch_size * self.num_examples)
         else:
             self.unlabeled_ELBO, self.y_ulab_logits = self.unlabeled_model()
-            self.cost = ((self.total_lab_loss() + self.total_unlab_loss()) * self.num_examples + prior_weights()) / (
-                -self.batch_size * self.num_examples)
+            weights_prior = prior_weights()
+            # The labeled and unlabeled sums are weighted to their share of the data
+            self.cost = ((self.lab_weight * labeled_loss + self.ulab_weight * self.total_unlab_loss()) *
+                         self.num_examples + weights_prior) / (-self.batch_size * self.num_examples)
+        # Labeled cost of an evaluation batch
+        self.eval_cost = (labeled_loss * self.num_examples + weights_prior) / (-self.batch_size * self.num_examples)
         tf.summary.scalar('cost', self.cost)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train_neural_network(self):
         train_print = "Training Conv VAE Model:"
@@ -135,34 +177,30 @@ class ConvGenerativeClassifier(object):
         logging.debug(train_print)
         logging.debug(params_print)
         self.session.run(tf.global_variables_initializer())
+        self.labeled.load(self.session, self.train_x_l_mu, self.train_x_l_logvar, self.train_l_y)
         best_validation_accuracy = 0
         last_improvement = 0
 
         start_time = time.time()
-        idx_labeled = 0
         idx_unlabeled = 0
         epochs = 0
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer],
+                                           feed_list=[self.x_unlab_mu, self.x_unlab_logvar])
+        self.telemetry.start()
         for i in range(self.num_iterations):
 
-            # Batch Training
-            x_l_mu, x_l_logvar, y_l_batch, idx_labeled = get_encoded_next_batch(self.train_x_l_mu,
-                                                                                self.train_x_l_logvar,
-                                                                                self.train_l_y,
-                                                                                idx_labeled,
-                                                                                self.num_lab_batch)
-            x_u_mu, x_u_logvar, _, idx_unlabeled = get_encoded_next_batch(self.train_x_u_mu, self.train_x_u_logvar,
-                                                                          self.train_u_y,
-                                                                          idx_unlabeled,
-                                                                          self.num_ulab_batch)
-            feed_dict_train = {self.x_lab_mu: x_l_mu, self.y_lab: y_l_batch, self.x_unlab_mu: x_u_mu,
-                               self.x_lab_logvar: x_l_logvar,
-                               self.x_unlab_logvar: x_u_logvar}
-            summary, batch_loss, _ = self.session.run([self.merged, self.cost, self.optimizer],
-                                                      feed_dict=feed_dict_train)
+            # Batch Training, only the unlabeled batch is fed
+            (x_u_mu, x_u_logvar), idx_unlabeled = get_next_wrapped_batch([self.train_x_u_mu, self.train_x_u_logvar],
+                                                                         idx_unlabeled, self.num_ulab_batch)
+            self.telemetry.lap('data')
+            summary, batch_loss, _ = train_step(i, x_u_mu, x_u_logvar)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
             # Batch Trainin
-            if idx_labeled + idx_unlabeled == self.num_examples:
+            if idx_unlabeled < self.num_ulab_batch:
                 epochs += 1
                 is_epoch = True
             else:
@@ -178,9 +216,12 @@ class ConvGenerativeClassifier(object):
                 self.validation_accuracy.append(acc_validation)
                 self.validation_cost.append(valid_cost)
                 self.train_cost.append(batch_loss)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -192,11 +233,16 @@ class ConvGenerativeClassifier(object):
                       " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str))
                 logging.debug("Iteration: {}, Training Loss: {}, "
                               " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str))
+            if is_epoch:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 logging.debug("No improvement found in a while, stopping optimization.")
                 # Break out from the for-loop.
                 break
+        self.telemetry.close()
+        self.tracer.close()
         # Ending time.
         end_time = time.time()
         time_dif = end_time - start_time
@@ -218,7 +264,8 @@ class ConvGenerativeClassifier(object):
 
     def total_lab_loss(self):
         # gradient of -KL(q(z|y,x) ~p(x,y) || p(x,y,z))
-        beta = self.alpha * (float(self.batch_size) / self.num_lab_batch)
+        # alpha * N / N_l per labeled example, whatever the share of labeled examples in the batch
+        beta = self.alpha * (float(self.num_examples) / self.n_labeled)
         weighted_classifier_loss = beta * self.classifier_loss
         labeled_loss = tf.reduce_sum(tf.subtract(self.labeled_ELBO, weighted_classifier_loss))
         tf.summary.scalar('labeled_loss', labeled_loss)
@@ -239,21 +286,17 @@ class ConvGenerativeClassifier(object):
         num_images = len(mu)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
         i = 0
-        total_cost = 0.0
         num_val_batches = int(num_images / self.batch_size)
+        total_cost = 0.0
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_mu = mu[i:j, :]
             batch_logavar = logvar[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x_lab_mu: batch_mu,
-                         self.x_lab_logvar: batch_logavar,
-                         self.y_lab: batch_labels}
-            cls_pred[i:j], batch_cost = self.session.run([self.y_pred_cls, self.cost], feed_dict=feed_dict)
-            i = j
+            cls_pred[i:j], batch_cost = self.predict_step(batch_mu, batch_logavar, batch_labels)
             total_cost += batch_cost
-            # print("batch auc:{}".format(auc))
+            i = j
         # Create a boolean array whether each image is correctly classified.
         correct = (cls_true == cls_pred)
         return correct, cls_pred, total_cost / num_val_batches
@@ -275,6 +318,8 @@ class ConvGenerativeClassifier(object):
                   best_epoch=best_epoch)
         plot_line(self.validation_accuracy, name='Validation Accuracy', epochs=epochs,
                   best_epoch=best_epoch)
+        self.memory.record('test')
+        report_renderer.submit()
 
     def unlabeled_model(self):
         # Ulabeled
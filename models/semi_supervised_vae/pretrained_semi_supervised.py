@@ -9,12 +9,19 @@ import tensorflow as tf
 from models.classifier import softmax_classifier
 from models.semi_supervised_vae.decoder import pz1_given_z2y
 from models.semi_supervised_vae.encoder import q_z2_given_z1y, qy_given_z1
-from models.utils.MNIST_pickled_preprocess import load_numpy_split, create_semisupervised
-from models.utils.batch_processing import get_batch_size, get_next_batch
+from models.utils.MNIST_pickled_preprocess import load_semisupervised
+from models.utils.batch_processing import get_batch_size, get_next_batch, get_next_wrapped_batch, stream_weights
+from models.utils.compact_images import concatenate_images
 from models.utils.distributions import elbo_M1, compute_ELBO
 from models.utils.distributions import prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import cls_accuracy, print_test_accuracy, convert_labels_to_cls, plot_images
-from models.utils.tf_helpers import one_label_tensor, variable_summaries
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.resident_split import ResidentSplit
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import one_label_tensor, variable_summaries, session_config, session_callable
 from models.vanilla_vae.decoder import px_given_z1
 from models.vanilla_vae.encoder import q_z1_given_x
 
@@ -32,7 +39,14 @@ class PreTrainedGenerativeClassifier(object):
                  num_iterations,
                  input_dim, latent_dim,
                  hidden_dim=600,
-                 restore_vae=False
+                 restore_vae=False,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 balance_classes=False,
+                 batch_size=None,
+                 labeled_fraction=None,
+                 accumulate_steps=1
                  ):
         self.input_dim, self.latent_dim = input_dim, latent_dim
         self.hidden_dim = hidden_dim
@@ -50,67 +64,91 @@ class PreTrainedGenerativeClassifier(object):
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
+        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
+                                                                                  num_batches=self.num_batches,
+                                                                                  num_lab=self.n_labeled,
+                                                                                  batch_size=batch_size,
+                                                                                  labeled_fraction=labeled_fraction)
+        self.num_batches = self.num_examples / float(self.batch_size)
+        self.lab_weight, self.ulab_weight = stream_weights(self.num_examples, self.n_labeled, self.num_lab_batch,
+                                                           self.num_ulab_batch)
+        logging.debug(
+            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
+                                                                                                    self.batch_size,
+                                                                                                    self.num_lab_batch,
+                                                                                                    self.num_ulab_batch,
+                                                                                                    int(
+                                                                                                        self.num_iterations / self.num_batches)))
 
         ''' Create Graph '''
         self.G = tf.Graph()
         with self.G.as_default():
             self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x')
-            self.x_lab = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_labeled')
+            # Labeled batches are drawn in the graph from the resident labeled split unless fed, as for evaluation
+            self.labeled = ResidentSplit([[None, self.input_dim], [None, self.num_classes]], name='resident_labeled')
+            x_lab, y_lab = self.labeled.sample(self.num_lab_batch, balance_classes)
+            self.x_lab = tf.placeholder_with_default(x_lab, shape=[None, self.input_dim], name='x_labeled')
             self.x_unlab = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlabeled')
-            self.y_lab = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y_lab')
+            self.y_lab = tf.placeholder_with_default(y_lab, shape=[None, self.num_classes], name='y_lab')
             self.y_true_cls = tf.argmax(self.y_lab, axis=1)
             self.train_x_l, self.train_l_y, self.train_u_x, self.train_u_y, self.valid_x, self.valid_y, \
             self.test_x, self.test_y = self.extract_data()
+            self.memory.record('data_load')
             print(self.train_l_y.shape, self.train_u_y.shape)
-            self.train_x = np.concatenate((self.train_x_l, self.train_u_x), axis=0)
-            self.train_y = np.concatenate((self.train_l_y, self.train_u_y), axis=0)
+            self.train_x = concatenate_images((self.train_x_l, self.train_u_x))
+            self.train_y = concatenate_images((self.train_l_y, self.train_u_y))
             self._objective()
             self.saver = tf.train.Saver()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.vae_validation_step = session_callable(self.session, [self.vae_cost, self.log_lik],
+                                                        feed_list=[self.x])
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.log_lik, self.auc_update],
+                                                 feed_list=[self.x_lab, self.x, self.y_lab])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/pre_semi_supervised_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.vae_telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every,
+                                            name='vae_telemetry')
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
             self.merged = tf.summary.merge_all()
 
     def _objective(self):
 
         # Labeled
-        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
-                                                                                  num_batches=self.num_batches,
-                                                                                  num_lab=self.n_labeled)
-        logging.debug(
-            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
-                                                                                                    self.batch_size,
-                                                                                                    self.num_lab_batch,
-                                                                                                    self.num_ulab_batch,
-                                                                                                    int(
-                                                                                                        self.num_iterations / self.num_batches)))
         self.labeled_ELBO, self.y_lab_logits, self.x_recon_lab_mu, self.classifier_loss, \
         self.y_pred_cls = self.labeled_model()
         self.vae_elbo, self.log_lik = self.vae_model()
         self.vae_cost = (self.vae_elbo * self.num_batches + prior_weights()) / (-self.batch_size * self.num_batches)
+        self.auc, self.auc_update = tf.contrib.metrics.streaming_auc(self.y_lab_logits, self.y_lab, curve='ROC')
+        self.reset_metrics = tf.local_variables_initializer()
         if self.n_labeled == self.num_examples:
-            self.train_x_l = np.concatenate((self.train_x_l, self.train_u_x), axis=0)
-            self.train_l_y = np.concatenate((self.train_l_y, self.train_u_y), axis=0)
+            self.train_x_l = concatenate_images((self.train_x_l, self.train_u_x))
+            self.train_l_y = concatenate_images((self.train_l_y, self.train_u_y))
             self.cost = ((self.total_lab_loss() * self.num_batches) + prior_weights()) / (
                 -self.num_batches * self.num_batches)
         else:
             self.unlabeled_ELBO, self.y_ulab_logits = self.unlabeled_model()
-            self.cost = ((self.total_lab_loss() + self.total_unlab_loss()) * self.num_batches + prior_weights()) / (
-                -self.batch_size * self.num_batches)
-
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
-        self.vae_optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                    beta2=self.beta2).minimize(self.vae_cost)
+            # The labeled and unlabeled sums are weighted to their share of the data
+            self.cost = ((self.lab_weight * self.total_lab_loss() + self.ulab_weight * self.total_unlab_loss()) *
+                         self.num_batches + prior_weights()) / (-self.batch_size * self.num_batches)
+
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
+        self.vae_accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                          beta1=self.beta1, beta2=self.beta2),
+                                                   self.accumulate_steps)
+        self.vae_optimizer = self.vae_accumulator.minimize(self.vae_cost)
 
     def extract_data(self):
-        train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy_split(binarize_y=True)
-        x_l, y_l, x_u, y_u = create_semisupervised(train_x, train_y, self.n_labeled)
-        t_x_l, t_y_l = x_l.T, y_l.T
-        t_x_u, t_y_u = x_u.T, y_u.T
-        x_valid, y_valid = valid_x.T, valid_y.T
-        x_test, y_test = test_x.T, test_y.T
+        train_x, train_y, split, x_valid, y_valid, x_test, y_test = load_semisupervised(self.n_labeled, seed=self.seed)
+        t_x_l, t_y_l, t_x_u, t_y_u = split.views(train_x, train_y)
 
         print("x_l:{}, y_l:{}, x_u:{}, y_{}".format(t_x_l.shape, t_y_l.shape, t_x_u.shape, t_y_u.shape))
         logging.debug("x_l:{}, y_l:{}, x_u:{}, y_{}".format(t_x_l.shape, t_y_l.shape, t_x_u.shape, t_y_u.shape))
@@ -119,23 +157,22 @@ class PreTrainedGenerativeClassifier(object):
     def vae_model(self):
         z, z_mu, z_logvar = q_z1_given_x(self.x, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                                          latent_dim=self.latent_dim)
-        x_mu = px_given_z1(z1=z, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
-                           latent_dim=self.latent_dim)
-        loss, log_lik = elbo_M1(x_recon=x_mu, x_true=self.x, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
+        x_mu, x_logits = px_given_z1(z1=z, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+                                     latent_dim=self.latent_dim)
+        loss, log_lik = elbo_M1(x_logits=x_logits, x_true=self.x, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
         return tf.reduce_sum(loss), log_lik / self.batch_size
 
     def vae_validation_loss(self, images):
         num_images = len(images)
-        total_loss = 0.0
-        total_log_lik = 0.0
         i = 0
         num_val_batches = int(10000 / self.batch_size)
+        total_loss = 0.0
+        total_log_lik = 0.0
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
-            feed_dict = {self.x: batch_images}
-            batch_loss, log_lik = self.session.run([self.vae_cost, self.log_lik], feed_dict=feed_dict)
+            batch_loss, log_lik = self.vae_validation_step(batch_images)
             total_loss += batch_loss
             total_log_lik += log_lik
             i = j
@@ -145,36 +182,40 @@ class PreTrainedGenerativeClassifier(object):
         print("Training Vanilla VAE:")
         logging.debug("Training Vanilla VAE:")
         self.session.run(tf.global_variables_initializer())
+        self.labeled.load(self.session, self.train_x_l, self.train_l_y)
         best_validation_loss = 1e20
         last_improvement = 0
 
         start_time = time.time()
         idx = 0
-        idx_labeled = 0
         idx_unlabeled = 0
 
+        vae_step = session_callable(self.session, [self.merged, self.vae_cost, self.log_lik, self.vae_optimizer],
+                                    feed_list=[self.x, self.x_unlab])
+        self.vae_telemetry.start()
         for i in range(self.num_iterations):
-            # Batch Training
+            # Batch Training, the labeled batch is drawn in the graph
             x_batch, _, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            x_l_batch, y_l_batch, idx_labeled = get_next_batch(self.train_x_l, self.train_l_y, idx_labeled,
-                                                               self.num_lab_batch)
-            x_u_batch, _, idx_unlabeled = get_next_batch(self.train_u_x, self.train_u_y, idx_unlabeled,
-                                                         self.num_ulab_batch)
-
-            feed_dict = {self.x: x_batch, self.x_lab: x_l_batch, self.x_unlab: x_u_batch, self.y_lab: y_l_batch}
-            summary, batch_loss, log_lik, _ = self.session.run(
-                [self.merged, self.vae_cost, self.log_lik, self.vae_optimizer],
-                feed_dict=feed_dict)
+            (x_u_batch,), idx_unlabeled = get_next_wrapped_batch([self.train_u_x], idx_unlabeled, self.num_ulab_batch)
+
+            self.vae_telemetry.lap('data')
+            summary, batch_loss, log_lik, _ = vae_step(x_batch, x_u_batch)
+            self.vae_accumulator.step(self.session, i)
+            self.vae_telemetry.lap('compute')
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.vae_telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
 
                 validation_loss, val_log_lik = self.vae_validation_loss(images=self.valid_x)
+                self.vae_telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if validation_loss < best_validation_loss:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.vae_telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_loss = validation_loss
                     last_improvement = i
@@ -191,11 +232,15 @@ class PreTrainedGenerativeClassifier(object):
                               " Validation: Loss {}, log_lik {} {}".format(i + 1, int(batch_loss), int(log_lik),
                                                                            int(validation_loss),
                                                                            int(val_log_lik), improved_str))
+            if idx == self.train_x.shape[0]:
+                self.memory.record('epoch', step=i)
+            self.vae_telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 logging.debug("No improvement found in a while, stopping optimization.")
                 # Break o    ut from the for-loop.
                 break  # Ending time.
+        self.vae_telemetry.close()
         end_time = time.time()
         time_dif = end_time - start_time
         print("Time usage: " + str(timedelta(seconds=int(round(time_dif)))))
@@ -204,6 +249,7 @@ class PreTrainedGenerativeClassifier(object):
     def train_neural_network(self):
         if self.restore_vae:
             self.saver.restore(sess=self.session, save_path=self.save_path)
+            self.labeled.load(self.session, self.train_x_l, self.train_l_y)
         else:
             self.train_vae()
         print("Training Pre_trained Semi_Supervised VAE:")
@@ -213,26 +259,24 @@ class PreTrainedGenerativeClassifier(object):
         last_improvement = 0
 
         start_time = time.time()
-        idx_labeled = 0
         idx_unlabeled = 0
         idx = 0
 
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer],
+                                           feed_list=[self.x, self.x_unlab])
+        self.telemetry.start()
         for i in range(self.num_iterations):
 
-            # Batch Training
-            # Batch Training
+            # Batch Training, the labeled batch is drawn in the graph
             x_batch, _, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            x_l_batch, y_l_batch, idx_labeled = get_next_batch(self.train_x_l, self.train_l_y, idx_labeled,
-                                                               self.num_lab_batch)
-            x_u_batch, _, idx_unlabeled = get_next_batch(self.train_u_x, self.train_u_y, idx_unlabeled,
-                                                         self.num_ulab_batch)
-            feed_dict_train = {self.x: x_batch, self.x_lab: x_l_batch, self.y_lab: y_l_batch,
-                               self.x_unlab: x_u_batch}
-
-            summary, batch_loss, _ = self.session.run([self.merged, self.cost, self.optimizer],
-                                                      feed_dict=feed_dict_train)
+            (x_u_batch,), idx_unlabeled = get_next_wrapped_batch([self.train_u_x], idx_unlabeled, self.num_ulab_batch)
+            self.telemetry.lap('data')
+            summary, batch_loss, _ = train_step(i, x_batch, x_u_batch)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
@@ -240,9 +284,12 @@ class PreTrainedGenerativeClassifier(object):
                                                        labels=self.valid_y,
                                                        cls_true=convert_labels_to_cls(self.valid_y))
                 acc_validation, _ = cls_accuracy(correct)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -258,10 +305,15 @@ class PreTrainedGenerativeClassifier(object):
                               " Validation:  log_lik {},  Acc {}, {}".format(i + 1, int(batch_loss), int(log_lik),
                                                                              acc_validation,
                                                                              improved_str))
+            if idx == self.train_x.shape[0]:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 # Break out from the for-loop.
                 break
+        self.telemetry.close()
+        self.tracer.close()
         # Ending time.
         end_time = time.time()
         time_dif = end_time - start_time
@@ -279,7 +331,8 @@ class PreTrainedGenerativeClassifier(object):
 
     def total_lab_loss(self):
         # gradient of -KL(q(z|y,x) ~p(x,y) || p(x,y,z))
-        beta = self.alpha * (float(self.batch_size) / self.num_lab_batch)
+        # alpha * N / N_l per labeled example, whatever the share of labeled examples in the batch
+        beta = self.alpha * (float(self.num_examples) / self.n_labeled)
         weighted_classifier_loss = beta * self.classifier_loss
         labeled_loss = tf.reduce_sum(tf.subtract(self.labeled_ELBO, weighted_classifier_loss))
         tf.summary.scalar('labeled_loss', labeled_loss)
@@ -301,25 +354,20 @@ class PreTrainedGenerativeClassifier(object):
     def predict_cls(self, images, labels, cls_true):
         num_images = len(images)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
-        total_log_lik = 0.0
         i = 0
         num_val_batches = int(10000 / self.batch_size)
-        mean_value, update_op = tf.contrib.metrics.streaming_auc(self.y_lab_logits, self.y_lab, curve='ROC')
+        total_log_lik = 0.0
+        # The streaming AUC update of each batch returns the AUC over the batches so far
         final_mean_value = 0.0
-        self.session.run(tf.local_variables_initializer())
+        self.session.run(self.reset_metrics)
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x_lab: batch_images,
-                         self.x: batch_images,
-                         self.y_lab: batch_labels}
-            cls_pred[i:j], log_lik = self.session.run([self.y_pred_cls, self.log_lik],
-                                                      feed_dict=feed_dict)
+            cls_pred[i:j], log_lik, final_mean_value = self.predict_step(batch_images, batch_images, batch_labels)
             total_log_lik += log_lik
             i = j
-            final_mean_value = mean_value.eval(feed_dict=feed_dict)
         print('Final Mean AUC: %f' % final_mean_value)
         logging.debug('Final Mean AUC: %f' % final_mean_value)
         # Create a boolean array whether each image is correctly classified.
@@ -334,6 +382,8 @@ class PreTrainedGenerativeClassifier(object):
                                                 cls_true=(convert_labels_to_cls(self.test_y)))
         print_test_accuracy(correct, cls_pred, self.test_y, logging)
         self.test_reconstruction()
+        self.memory.record('test')
+        report_renderer.submit()
 
     def unlabeled_model(self):
         # Ulabeled
@@ -349,10 +399,10 @@ class PreTrainedGenerativeClassifier(object):
                                                                 num_classes=self.num_classes,
                                                                 hidden_dim=self.hidden_dim,
                                                                 reuse=True)
-            x_recon_mu = px_given_z1(z1_recon, latent_dim=self.latent_dim,
-                                     hidden_dim=self.hidden_dim, input_dim=self.input_dim, reuse=True)
-            _elbo = tf.expand_dims(compute_ELBO(x_recon=x_recon_mu, x=self.x_unlab, y=y_ulab, z=[z2, z2_mu, z2_logvar]),
-                                   1)
+            x_recon_mu, x_recon_logits = px_given_z1(z1_recon, latent_dim=self.latent_dim,
+                                                     hidden_dim=self.hidden_dim, input_dim=self.input_dim, reuse=True)
+            _elbo = tf.expand_dims(compute_ELBO(x_logits=x_recon_logits, x=self.x_unlab, y=y_ulab,
+                                                z=[z2, z2_mu, z2_logvar]), 1)
 
             if label == 0:
                 class_elbo = tf.identity(_elbo)
@@ -372,9 +422,9 @@ class PreTrainedGenerativeClassifier(object):
                                               num_classes=self.num_classes, hidden_dim=self.hidden_dim)
         z1_recon, z1_mu_recon, z1_var_recon = pz1_given_z2y(y=self.y_lab, z2=z2, latent_dim=self.latent_dim,
                                                             num_classes=self.num_classes, hidden_dim=self.hidden_dim)
-        x_recon_mu = px_given_z1(z1_recon, latent_dim=self.latent_dim,
-                                 hidden_dim=self.hidden_dim, input_dim=self.input_dim, reuse=True)
-        elbo = compute_ELBO(x_recon=x_recon_mu, x=self.x_lab, y=self.y_lab, z=[z2, z2_mu, z2_logvar])
+        x_recon_mu, x_recon_logits = px_given_z1(z1_recon, latent_dim=self.latent_dim,
+                                                 hidden_dim=self.hidden_dim, input_dim=self.input_dim, reuse=True)
+        elbo = compute_ELBO(x_logits=x_recon_logits, x=self.x_lab, y=self.y_lab, z=[z2, z2_mu, z2_logvar])
 
         classifier_loss, y_pred_cls = softmax_classifier(logits=logits, y_true=self.y_lab)
         return elbo, logits, x_recon_mu, classifier_loss, y_pred_cls
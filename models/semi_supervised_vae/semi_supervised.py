@@ -9,12 +9,18 @@ import tensorflow as tf
 from models.classifier import softmax_classifier
 from models.semi_supervised_vae.decoder import pz1_given_z2y
 from models.semi_supervised_vae.encoder import q_z2_given_z1y, qy_given_z1
-from models.utils.batch_processing import get_encoded_next_batch, get_batch_size
+from models.utils.batch_processing import get_next_wrapped_batch, get_batch_size, stream_weights
 from models.utils.distributions import draw_norm
 from models.utils.distributions import elbo_M2
 from models.utils.distributions import prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import cls_accuracy, print_test_accuracy, convert_labels_to_cls, plot_images, plot_roc
-from models.utils.tf_helpers import one_label_tensor, variable_summaries
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.resident_split import ResidentSplit
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import one_label_tensor, variable_summaries, session_config, session_callable
 
 
 # TODO binarize input images
@@ -35,7 +41,14 @@ class GenerativeClassifier(object):
                  train_unlab,
                  valid,
                  test,
-                 hidden_dim=600
+                 hidden_dim=600,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 balance_classes=False,
+                 batch_size=None,
+                 labeled_fraction=None,
+                 accumulate_steps=1
                  ):
         self.input_dim, self.latent_dim = input_dim, latent_dim
         self.hidden_dim = hidden_dim
@@ -56,37 +69,58 @@ class GenerativeClassifier(object):
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
+        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
+                                                                                  num_batches=self.num_batches,
+                                                                                  num_lab=self.n_labeled,
+                                                                                  batch_size=batch_size,
+                                                                                  labeled_fraction=labeled_fraction)
+        self.num_batches = self.num_examples / float(self.batch_size)
+        self.lab_weight, self.ulab_weight = stream_weights(self.num_examples, self.n_labeled, self.num_lab_batch,
+                                                           self.num_ulab_batch)
+        logging.debug(
+            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
+                                                                                                    self.batch_size,
+                                                                                                    self.num_lab_batch,
+                                                                                                    self.num_ulab_batch,
+                                                                                                    int(
+                                                                                                        self.num_iterations / self.num_batches)))
 
         ''' Create Graph '''
         self.G = tf.Graph()
         with self.G.as_default():
-            self.x_lab_mu = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_lab_mu')
+            # Labeled batches are drawn in the graph from the resident labeled split unless fed, as for evaluation
+            self.labeled = ResidentSplit([[None, self.input_dim], [None, self.input_dim], [None, self.num_classes]],
+                                         name='resident_labeled')
+            x_lab_mu, x_lab_logvar, y_lab = self.labeled.sample(self.num_lab_batch, balance_classes)
+            self.x_lab_mu = tf.placeholder_with_default(x_lab_mu, shape=[None, self.input_dim], name='x_lab_mu')
             self.x_unlab_mu = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlab_mu')
-            self.x_lab_logvar = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_ulab_logvar')
+            self.x_lab_logvar = tf.placeholder_with_default(x_lab_logvar, shape=[None, self.input_dim],
+                                                            name='x_ulab_logvar')
             self.x_unlab_logvar = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x_unlab_logvar')
-            self.y_lab = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='y_lab')
+            self.y_lab = tf.placeholder_with_default(y_lab, shape=[None, self.num_classes], name='y_lab')
             self.y_true_cls = tf.argmax(self.y_lab, axis=1)
             self._objective()
             self.saver = tf.train.Saver()
             self.merged = tf.summary.merge_all()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.auc, self.auc_update = tf.contrib.metrics.streaming_auc(predictions=self.y_lab_logits,
+                                                                         labels=self.y_lab, curve='ROC')
+            self.reset_metrics = tf.local_variables_initializer()
+            self.predict_step = session_callable(self.session, [self.y_pred_cls, self.auc_update],
+                                                 feed_list=[self.x_lab_mu, self.x_lab_logvar, self.y_lab])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/semi_supervised_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
 
     def _objective(self):
 
         # Labeled
-        self.num_lab_batch, self.num_ulab_batch, self.batch_size = get_batch_size(num_examples=self.num_examples,
-                                                                                  num_batches=self.num_batches,
-                                                                                  num_lab=self.n_labeled)
-        logging.debug(
-            "num batches:{}, batch_size:{},  num_lab_batch {}, num_ulab_batch:{}, epochs:{}".format(self.num_batches,
-                                                                                                    self.batch_size,
-                                                                                                    self.num_lab_batch,
-                                                                                                    self.num_ulab_batch,
-                                                                                                    int(
-                                                                                                        self.num_iterations / self.num_batches)))
         self.labeled_ELBO, self.y_lab_logits, self.x_recon_lab_mu, self.classifier_loss, self.y_pred_cls = self.labeled_model()
         if self.n_labeled == self.num_examples:
             self.train_x_l_mu = np.concatenate((self.train_x_l_mu, self.train_x_u_mu), axis=0)
@@ -97,42 +131,41 @@ class GenerativeClassifier(object):
                 -self.batch_size * self.num_examples)
         else:
             self.unlabeled_ELBO, self.y_ulab_logits = self.unlabeled_model()
-            self.cost = ((self.total_lab_loss() + self.total_unlab_loss()) * self.num_examples + prior_weights()) / (
-                -self.batch_size * self.num_examples)
+            # The labeled and unlabeled sums are weighted to their share of the data
+            self.cost = ((self.lab_weight * self.total_lab_loss() + self.ulab_weight * self.total_unlab_loss()) *
+                         self.num_examples + prior_weights()) / (-self.batch_size * self.num_examples)
         tf.summary.scalar('cost', self.cost)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train_neural_network(self):
         print("Training Semisupervised VAE:")
         logging.debug("Training Semisupervised VAE:")
         self.session.run(tf.global_variables_initializer())
+        self.labeled.load(self.session, self.train_x_l_mu, self.train_x_l_logvar, self.train_l_y)
         best_validation_accuracy = 0
         last_improvement = 0
 
         start_time = time.time()
-        idx_labeled = 0
         idx_unlabeled = 0
 
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.optimizer],
+                                           feed_list=[self.x_unlab_mu, self.x_unlab_logvar])
+        self.telemetry.start()
         for i in range(self.num_iterations):
 
-            # Batch Training
-            x_l_mu, x_l_logvar, y_l_batch, idx_labeled = get_encoded_next_batch(self.train_x_l_mu,
-                                                                                self.train_x_l_logvar,
-                                                                                self.train_l_y,
-                                                                                idx_labeled,
-                                                                                self.num_lab_batch)
-            x_u_mu, x_u_logvar, _, idx_unlabeled = get_encoded_next_batch(self.train_x_u_mu, self.train_x_u_logvar,
-                                                                          self.train_u_y,
-                                                                          idx_unlabeled,
-                                                                          self.num_ulab_batch)
-            feed_dict_train = {self.x_lab_mu: x_l_mu, self.y_lab: y_l_batch, self.x_unlab_mu: x_u_mu,
-                               self.x_lab_logvar: x_l_logvar,
-                               self.x_unlab_logvar: x_u_logvar}
-            summary, batch_loss, _ = self.session.run([self.merged, self.cost, self.optimizer],
-                                                      feed_dict=feed_dict_train)
+            # Batch Training, only the unlabeled batch is fed
+            (x_u_mu, x_u_logvar), idx_unlabeled = get_next_wrapped_batch([self.train_x_u_mu, self.train_x_u_logvar],
+                                                                         idx_unlabeled, self.num_ulab_batch)
+            self.telemetry.lap('data')
+            summary, batch_loss, _ = train_step(i, x_u_mu, x_u_logvar)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
@@ -141,9 +174,12 @@ class GenerativeClassifier(object):
                                               labels=self.valid_y,
                                               cls_true=convert_labels_to_cls(self.valid_y))
                 acc_validation, _ = cls_accuracy(correct)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if acc_validation > best_validation_accuracy:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_accuracy = acc_validation
                     last_improvement = i
@@ -155,11 +191,16 @@ class GenerativeClassifier(object):
                       " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str))
                 logging.debug("Iteration: {}, Training Loss: {}, "
                               " Validation Acc:{}, {}".format(i + 1, batch_loss, acc_validation, improved_str))
+            if idx_unlabeled < self.num_ulab_batch:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 logging.debug("No improvement found in a while, stopping optimization.")
                 # Break out from the for-loop.
                 break
+        self.telemetry.close()
+        self.tracer.close()
         # Ending time.
         end_time = time.time()
         time_dif = end_time - start_time
@@ -180,7 +221,8 @@ class GenerativeClassifier(object):
 
     def total_lab_loss(self):
         # gradient of -KL(q(z|y,x) ~p(x,y) || p(x,y,z))
-        beta = self.alpha * (float(self.batch_size) / self.num_lab_batch)
+        # alpha * N / N_l per labeled example, whatever the share of labeled examples in the batch
+        beta = self.alpha * (float(self.num_examples) / self.n_labeled)
         weighted_classifier_loss = beta * self.classifier_loss
         labeled_loss = tf.reduce_sum(tf.subtract(self.labeled_ELBO, weighted_classifier_loss))
         tf.summary.scalar('labeled_loss', labeled_loss)
@@ -201,23 +243,17 @@ class GenerativeClassifier(object):
         num_images = len(mu)
         cls_pred = np.zeros(shape=num_images, dtype=np.int)
         i = 0
-        mean_auc, batch_auc = tf.contrib.metrics.streaming_auc(predictions=self.y_lab_logits, labels=self.y_lab,
-                                                               curve='ROC')
-        self.session.run(tf.local_variables_initializer())
+        # The streaming AUC update of each batch returns the AUC over the batches so far
         final_mean_value = 0.0
+        self.session.run(self.reset_metrics)
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_mu = mu[i:j, :]
             batch_logavar = logvar[i:j, :]
             batch_labels = labels[i:j, :]
-            feed_dict = {self.x_lab_mu: batch_mu,
-                         self.x_lab_logvar: batch_logavar,
-                         self.y_lab: batch_labels}
-            cls_pred[i:j] = self.session.run(self.y_pred_cls, feed_dict=feed_dict)
-            final_mean_value, auc = self.session.run([mean_auc, batch_auc], feed_dict=feed_dict)
+            cls_pred[i:j], final_mean_value = self.predict_step(batch_mu, batch_logavar, batch_labels)
             i = j
-            # print("batch auc:{}".format(auc))
         print('Final Mean AUC: %f' % final_mean_value)
         logging.debug('Final Mean AUC: %f' % final_mean_value)
         # Create a boolean array whether each image is correctly classified.
@@ -237,6 +273,8 @@ class GenerativeClassifier(object):
         logits = self.session.run(self.y_lab_logits, feed_dict=feed_dict)
         plot_roc(logits, self.test_y, self.num_classes, name='VAE')
         print_test_accuracy(correct, cls_pred, self.test_y, logging)
+        self.memory.record('test')
+        report_renderer.submit()
 
     def unlabeled_model(self):
         # Ulabeled
@@ -3,26 +3,41 @@
 Borrowed from original implementation: https://github.com/dpkingma/nips14-ssl (anglepy)
 '''
 ###
-import matplotlib
-matplotlib.use('Agg')
-
 import gzip
+import hashlib
 import os
 import pickle
 import random
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+from models.utils.compact_images import CompactImages
+from models.utils.split_views import SemiSupervisedSplit
+
+
+def synthetic_mnist(seed=0, n_train=50000, n_valid=10000, n_test=10000, n_classes=10, input_dim=28 * 28):
+    # Uniform MNIST-shaped images with balanced labels as (train, valid, test) in the layout of the pickle, passed
+    # as data to load_numpy so that models can be built and benchmarked without the dataset
+    rng = np.random.RandomState(seed)
+
+    def make_split(n):
+        return rng.uniform(size=(n, input_dim)).astype(np.float32), rng.permutation(np.arange(n) % n_classes)
 
-def load_numpy(path, binarize_y=False):
-    # MNIST dataset
-    f = gzip.open(path, 'rb')
-    u = pickle._Unpickler(f)
-    u.encoding = 'latin1'
-    train, valid, test = u.load()
-    # train, valid, test = pickle.load(f)
-    f.close()
+    return make_split(n_train), make_split(n_valid), make_split(n_test)
+
+
+def load_numpy(path, binarize_y=False, data=None):
+    # MNIST dataset, or the given (train, valid, test) data instead of the pickle at path
+    if data is not None:
+        # Copies, since preprocessing such as binarize_images works in place
+        train, valid, test = [(x.copy(), y) for x, y in data]
+    else:
+        f = gzip.open(path, 'rb')
+        u = pickle._Unpickler(f)
+        u.encoding = 'latin1'
+        train, valid, test = u.load()
+        # train, valid, test = pickle.load(f)
+        f.close()
     train_x, train_y = train
     valid_x, valid_y = valid
     test_x, test_y = test
@@ -34,10 +49,57 @@ def load_numpy(path, binarize_y=False):
     return train_x.T, train_y, valid_x.T, valid_y, test_x.T, test_y
 
 
+def mnist_dir():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.abspath(os.path.join(dir_path, '..', 'mnist'))
+
+
+def cache_root():
+    # Per user cache for data derived from the MNIST pickle, outside the source tree
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'learning_tensor_flow')
+
+
+def file_digest(path):
+    # Identity of a data file in cache keys: the start of its SHA-256
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()[:16]
+
+
+def load_compact(path, encoding, cache_dir=None, data=None):
+    # load_numpy with [N, D] CompactImages instead of the transposed float images. The encoded images are cached per
+    # data file and encoding, so the float images are only loaded the first time; given data is encoded in memory
+    if data is not None:
+        train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy(path, data=data)
+        return (compact_images(train_x.T, encoding), train_y, compact_images(valid_x.T, encoding), valid_y,
+                compact_images(test_x.T, encoding), test_y)
+    cache_dir = cache_dir or cache_root()
+    cache_path = os.path.join(cache_dir, 'mnist_{}_{}.npz'.format(file_digest(path), encoding))
+    if not os.path.exists(cache_path):
+        arrays = list(load_numpy(path))
+        for i in (0, 2, 4):
+            # The float split is released as soon as it is encoded
+            arrays[i] = compact_images(arrays[i].T, encoding)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, num_features=arrays[0].num_features, **{'a{}'.format(i): np.asarray(a) for i, a in
+                                                                 enumerate(arrays)})
+        os.rename(tmp_path, cache_path)
+        return tuple(arrays)
+    with np.load(cache_path) as cached:
+        num_features = int(cached['num_features'])
+        return tuple(CompactImages(data=cached['a{}'.format(i)], encoding=encoding, num_features=num_features)
+                     if i % 2 == 0 else cached['a{}'.format(i)] for i in range(6))
+
+
 # Loads data where data is split into class labels
 def load_numpy_split(binarize_y=False, n_train=50000):
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    path = os.path.abspath(os.path.join(dir_path, '..', 'mnist/mnist_28.pkl.gz'))
+    path = os.path.join(mnist_dir(), 'mnist_28.pkl.gz')
     train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy(path, False)
 
     train_x = train_x[0:n_train]
@@ -100,31 +162,52 @@ def create_semisupervised(x, y, n_labeled):
     return np.hstack(x_labeled), np.hstack(y_labeled), np.hstack(x_unlabeled), np.hstack(y_unlabeled)
 
 
-def binarize_images(images):
-    for i in range(images.shape[0]):
-        means = images[i]
-        samples = np.random.binomial(n=1, p=means)
-        images[i, :] = samples
+def binarize_images(images, rng=np.random):
+    images[:] = rng.binomial(n=1, p=images)
     return images
 
 
-def extract_data(n_labeled):
-    train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy_split(binarize_y=True)
-    x_l, y_l, x_u, y_u = create_semisupervised(train_x, train_y, n_labeled)
-    t_x_l, t_y_l = x_l.T, y_l.T
-    t_x_u, t_y_u = x_u.T, y_u.T
-    x_valid, y_valid = valid_x.T, valid_y.T
-    x_test, y_test = test_x.T, test_y.T
+def compact_images(images, encoding):
+    # uint8 keeps 1 byte per pixel, bits keeps 1 bit per (binarized) pixel; rows are decoded to float32 in the graph
+    return CompactImages.from_float(images, encoding=encoding) if encoding else images
+
+
+def load_semisupervised(n_labeled, n_train=50000, seed=None, cache_dir=None, compact=None, data=None):
+    # Training images and labels are kept once as [n_train, D] / [n_train, C] arrays, the split only holds indices.
+    # The labeled and unlabeled examples come out shuffled across classes, not sorted by class as from
+    # create_semisupervised. With a seed the split is cached under the user cache dir. With compact the images are
+    # CompactImages of that encoding, see load_compact; data replaces the MNIST pickle, see load_numpy.
+    path = os.path.join(mnist_dir(), 'mnist_28.pkl.gz')
+    if compact:
+        train_x, train_y, x_valid, valid_y, x_test, test_y = load_compact(path, compact, data=data)
+        train_x = CompactImages(data=train_x.data[0:n_train], encoding=compact, num_features=train_x.num_features)
+    else:
+        train_x, train_y, valid_x, valid_y, test_x, test_y = load_numpy(path, data=data)
+        train_x, x_valid, x_test = train_x.T[0:n_train], valid_x.T, test_x.T
+    train_y = train_y[0:n_train]
+    if cache_dir is None and data is None:
+        cache_dir = os.path.join(cache_root(), 'splits')
+    split = SemiSupervisedSplit(cls=train_y, n_labeled=n_labeled, seed=seed, cache_dir=cache_dir)
+    y_valid, y_test = binarize_labels(valid_y).T, binarize_labels(test_y).T
+    return train_x, np.eye(10)[train_y], split, x_valid, y_valid, x_test, y_test
+
 
-    # t_x_l = binarize_images(t_x_l)
-    # t_x_u = binarize_images(t_x_u)
+def extract_data(n_labeled, compact=None, seed=None, data=None):
+    train_x, train_y, split, x_valid, y_valid, x_test, y_test = load_semisupervised(n_labeled, seed=seed,
+                                                                                    compact=compact, data=data)
+
+    # train_x = binarize_images(train_x)
     # x_valid = binarize_images(x_valid)
     # x_test = binarize_images(x_test)
+    t_x_l, t_y_l, t_x_u, t_y_u = split.views(train_x, train_y)
     print("x_l:{}, y_l:{}, x_u:{}, y_{}".format(t_x_l.shape, t_y_l.shape, t_x_u.shape, t_y_u.shape))
     return t_x_l, t_y_l, t_x_u, t_y_u, x_valid, y_valid, x_test, y_test
 
 
 if __name__ == '__main__':
+    from models.utils.metrics import pyplot
+
+    plt = pyplot()
     num_lab = 50000
     x_lab, y_lab, x_ulab, y_ulab, _, _, _, _ = extract_data(100)
     print(x_lab[0])
@@ -1,16 +1,35 @@
-def get_batch_size(num_examples, num_batches, num_lab):
-    num_ulab = num_examples - num_lab
-    assert num_lab % num_batches == 0, '#Labelled % #Batches != 0'
-    assert num_ulab % num_batches == 0, '#Unlabelled % #Batches != 0'
-    assert num_examples % num_batches == 0, '#Examples % #Batches != 0'
+import numpy as np
+
 
-    batch_size = num_examples // num_batches
-    num_lab_batch = num_lab // num_batches
-    num_ulab_batch = num_ulab // num_batches
+def get_batch_size(num_examples, num_batches=None, num_lab=0, batch_size=None, labeled_fraction=None):
+    # Labeled and unlabeled examples per batch. batch_size defaults to num_examples // num_batches and labeled_fraction
+    # to the labeled share of the data; neither has to divide the data, the unlabeled stream wraps around
+    # (get_next_wrapped_batch) and the loss sums are reweighted to the data by stream_weights. Both streams keep at
+    # least one example per batch.
+    num_ulab = num_examples - num_lab
+    if batch_size is None:
+        batch_size = num_examples // num_batches
+    if labeled_fraction is None:
+        labeled_fraction = num_lab / float(num_examples)
+    if num_ulab == 0:
+        num_lab_batch = batch_size
+    else:
+        num_lab_batch = min(max(int(round(batch_size * labeled_fraction)), 1), batch_size - 1)
+    num_ulab_batch = batch_size - num_lab_batch
     print("num_lab_batch:{}, num_ulab_batch:{}, batch_size:{}".format(num_lab_batch, num_ulab_batch, batch_size))
     return num_lab_batch, num_ulab_batch, batch_size
 
 
+def stream_weights(num_examples, num_lab, num_lab_batch, num_ulab_batch):
+    # Weights of the labeled and unlabeled loss sums of a batch for the batch to estimate batch_size / num_examples of
+    # the loss over all the data; both are 1 when the batch holds the two streams in proportion to the data
+    batch_size = num_lab_batch + num_ulab_batch
+    lab_weight = num_lab * batch_size / float(num_lab_batch * num_examples)
+    if num_ulab_batch == 0:
+        return lab_weight, 0.0
+    return lab_weight, (num_examples - num_lab) * batch_size / float(num_ulab_batch * num_examples)
+
+
 def get_next_batch(x_images, y_labels, idx, batch_size):
     num_images = x_images.shape[0]
     if idx == num_images:
@@ -37,3 +56,17 @@ def get_encoded_next_batch(x_mu, x_logvar, y_labels, idx, batch_size):
     x_logvar_batch = x_logvar[idx:j, :]
     y_true_batch = y_labels[idx:j, :]
     return x_mu_batch, x_logvar_batch, y_true_batch, j
+
+
+def get_next_wrapped_batch(arrays, idx, batch_size):
+    # The next batch_size rows of every array from idx, continued from the first row at the end so that every batch is
+    # full whatever the number of rows; returns the batches and the next idx
+    num_rows = arrays[0].shape[0]
+    if batch_size == 0 or num_rows == 0:
+        return [array[0:0] for array in arrays], idx
+    if idx + batch_size <= num_rows:
+        batches = [array[idx:idx + batch_size] for array in arrays]
+    else:
+        rows = (idx + np.arange(batch_size)) % num_rows
+        batches = [array[rows] for array in arrays]
+    return batches, (idx + batch_size) % num_rows
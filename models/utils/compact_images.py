@@ -0,0 +1,78 @@
+import numpy as np
+
+from models.utils.split_views import concatenate_rows
+
+UINT8 = 'uint8'
+BITS = 'bits'
+
+
+class CompactImages(object):
+    """Images kept in memory as uint8 grayscale (1 byte/pixel) or bit-packed binary (1 bit/pixel).
+
+    Slicing returns the selected rows still encoded, so batching code such as get_next_batch and the
+    validation loops feed them as they are to a tf_helpers.image_input placeholder, which decodes them in the
+    graph. decode() is the host-side decoding for the few rows that are needed as floats, e.g. for plots.
+    """
+
+    def __init__(self, data, encoding, num_features):
+        assert encoding in (UINT8, BITS), 'unknown encoding {}'.format(encoding)
+        self.data = data
+        self.encoding = encoding
+        self.num_features = num_features
+
+    @classmethod
+    def from_float(cls, images, encoding=UINT8):
+        if encoding == UINT8:
+            data = np.round(np.clip(images, 0.0, 1.0) * 255).astype(np.uint8)
+        else:
+            data = np.packbits(images > 0.5, axis=1)
+        return cls(data=data, encoding=encoding, num_features=images.shape[1])
+
+    @property
+    def shape(self):
+        # Shape of the encoded rows, as they are fed
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def decode(self, rows):
+        if self.encoding == UINT8:
+            return rows.astype(np.float32) * np.float32(1.0 / 255)
+        return np.unpackbits(rows, axis=1)[:, :self.num_features].astype(np.float32)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __array__(self, dtype=None):
+        # The encoded rows; decoding the whole dataset on the host is never implicit
+        return self.data if dtype is None else self.data.astype(dtype, copy=False)
+
+
+def encoded_features(num_features, encoding=None):
+    # Columns of the rows fed for images of num_features pixels
+    return (num_features + 7) // 8 if encoding == BITS else num_features
+
+
+def float_rows(images, key):
+    # Rows of images as float32 on the host, decoded if they are compact
+    if isinstance(images, CompactImages):
+        return images.decode(images.data[key])
+    return np.asarray(images[key], dtype=np.float32)
+
+
+def concatenate_images(arrays):
+    rows = concatenate_rows(arrays)
+    if rows is not None:
+        return rows
+    compact = [a for a in arrays if isinstance(a, CompactImages)]
+    if compact:
+        if len(compact) < len(arrays) or len(set(a.encoding for a in compact)) > 1:
+            raise ValueError('cannot concatenate images of different encodings')
+        return CompactImages(data=np.concatenate([a.data for a in arrays], axis=0), encoding=arrays[0].encoding,
+                             num_features=arrays[0].num_features)
+    return np.concatenate([np.asarray(a) for a in arrays], axis=0)
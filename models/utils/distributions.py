@@ -22,11 +22,33 @@ def tf_gaussian_marg(mu, log_var):
 
 
 def tf_binary_xentropy(x_true, x_approx, const=1e-10):
-    print("x_approx:{}, x_true:{}".format(x_approx, x_true))
     return - (x_true * tf.log(tf.clip_by_value(x_approx, const, 1.0)) + tf.subtract(1.0, x_true) * tf.log(
         tf.clip_by_value(tf.subtract(1.0, x_approx), const, 1.0)))
 
 
+def tf_bernoulli_log_lik(x_true, logits, axis=None):
+    # Sigmoid and log fused, stable for saturated logits where log(sigmoid) would need clipping
+    return - tf.reduce_sum(tf.nn.sigmoid_cross_entropy_with_logits(labels=x_true, logits=logits), axis=axis)
+
+
+def tf_normal_log_lik(x, mu, log_var, axis=None):
+    return - 0.5 * tf.reduce_sum(logc + log_var + tf.squared_difference(x, mu) * tf.exp(-log_var), axis=axis)
+
+
+def tf_stdnormal_log_lik(x, axis=None):
+    return - 0.5 * tf.reduce_sum(logc + tf.square(x), axis=axis)
+
+
+def tf_gaussian_kl(mu, log_var, axis=1):
+    # KL(N(mu, exp(log_var)) || N(0, 1)) in closed form, the log(2 pi) terms of the marginal and entropy cancel
+    return - 0.5 * tf.reduce_sum(1.0 + log_var - tf.square(mu) - tf.exp(log_var), axis=axis)
+
+
+def tf_uniform_categorical_log_prior(y, num_classes=10):
+    # log p(y) of one hot y under a uniform prior, same as the softmax cross entropy with constant logits
+    return - np.log(num_classes) * tf.reduce_sum(y, axis=1)
+
+
 def l2_loss():
     l2 = tf.add_n([tf.nn.l2_loss(v) for v in tf.trainable_variables()])
     return l2
@@ -38,6 +60,12 @@ def draw_norm(dim, mu, logvar):
     return tf.add(mu, tf.multiply(std, epsilon))
 
 
+def draw_bernoulli(probs):
+    # Fresh binarization of intensities in [0, 1] each time the op runs
+    epsilon = tf.random_uniform(tf.shape(probs), name='epsilon')
+    return tf.cast(tf.less(epsilon, probs), tf.float32)
+
+
 def prior_weights():
     prior_weights_loss = 0.
     weights = tf.trainable_variables()
@@ -52,67 +80,50 @@ def reconstruction_loss(x_input, x_hat):
 
 
 def regularization_loss(z_mu, z_logvar):
-    z_regularization = -0.5 * tf.reduce_sum(1 + z_logvar - tf.pow(z_mu, 2) - tf.exp(z_logvar), axis=1)
-    return z_regularization
+    return tf_gaussian_kl(z_mu, z_logvar)
 
 
 def elbo_M2(z1_recon, z1, y, z2):
-    num_classes = 10
-    y_prior = (1. / num_classes) * tf.ones_like(y)
-    log_prior_y = - tf.nn.softmax_cross_entropy_with_logits(logits=y_prior, labels=y)
-
-    log_lik = tf.reduce_sum(tf_normal_logpdf(x=z1, mu=z1_recon[0], log_var=z1_recon[1]), 1)
-    log_post_z = tf.reduce_sum(tf_gaussian_ent(z2[2]), 1)
-    log_prior_z = tf.reduce_sum(tf_gaussian_marg(z2[1], z2[2]), 1)
+    log_prior_y = tf_uniform_categorical_log_prior(y)
+    log_lik = tf_normal_log_lik(x=z1, mu=z1_recon[0], log_var=z1_recon[1], axis=1)
+    return log_prior_y + log_lik - tf_gaussian_kl(z2[1], z2[2])
 
-    return log_prior_y + log_lik + log_prior_z - log_post_z
 
-
-def elbo_M1(x_recon, x_true, z1, z1_mu, z1_lsgms):
-    log_lik = -tf.reduce_sum(tf_binary_xentropy(x_true=x_true, x_approx=x_recon))
-    log_post_z = tf.reduce_sum(tf_gaussian_ent(z1_lsgms), axis=1)
-    log_prior_z = tf.reduce_sum(tf_gaussian_marg(z1_mu, z1_lsgms), axis=1)
+def elbo_M1(x_logits, x_true, z1, z1_mu, z1_lsgms):
+    log_lik = tf_bernoulli_log_lik(x_true=x_true, logits=x_logits)
 
     negative_log_lik = tf.scalar_mul(-1, log_lik)
     tf.summary.scalar('negative_log_lik', negative_log_lik)
-    cost = log_lik + log_prior_z - log_post_z
-    print("M1 cost {}, {}, {}".format(log_lik, log_post_z, log_prior_z))
+    cost = log_lik - tf_gaussian_kl(z1_mu, z1_lsgms)
+    print("M1 cost {}".format(cost))
     print("z1 shape:{}".format(z1.shape))
     return cost, log_lik
 
 
-def elbo_M1_M2(x_recon, z1_recon, xtrue, y, z2, z1):
-    m1_cost = elbo_M1(x_recon=x_recon, x_true=xtrue, z1=z1[0], z1_mu=z1[1], z1_lsgms=z1[2])[0]
+def elbo_M1_M2(x_logits, z1_recon, xtrue, y, z2, z1):
+    m1_cost = elbo_M1(x_logits=x_logits, x_true=xtrue, z1=z1[0], z1_mu=z1[1], z1_lsgms=z1[2])[0]
     m2_cost = elbo_M2(z1_recon=z1_recon, z1=z1[0], y=y, z2=z2)
     print("costs {} {}".format(m1_cost.shape, m2_cost.shape))
     cost = tf.add(m1_cost, m2_cost)
     return cost
 
 
-def compute_ELBO(x_recon, x, y, z):
-    num_classes = 10
-    y_prior = (1. / num_classes) * tf.ones_like(y)
-
-    log_prior_z = tf.reduce_sum(tf_gaussian_marg(z[1], z[2]), 1)
-    log_prior_y = -tf.nn.softmax_cross_entropy_with_logits(logits=y_prior, labels=y)
-    log_lik = -tf.reduce_sum(tf_binary_xentropy(x_true=x, x_approx=x_recon))
-    log_post_z = tf.reduce_sum(tf_gaussian_ent(z[2]), 1)
+def compute_ELBO(x_logits, x, y, z):
+    log_prior_y = tf_uniform_categorical_log_prior(y)
+    log_lik = tf_bernoulli_log_lik(x_true=x, logits=x_logits)
     negative_log_lik = tf.scalar_mul(-1, log_lik)
     tf.summary.scalar('negative_log_lik', negative_log_lik)
-    # log_prior_y - tf.add(reconstruction_loss(x, x_recon[0]), regularization_loss(z[1], z[2]))
-    return log_prior_y + log_lik + log_prior_z - log_post_z
+    return log_prior_y + log_lik - tf_gaussian_kl(z[1], z[2])
 
 
-def auxiliary_elbo(x_recon, x, y, qz, qa, pa):
-    num_classes = 10
-    y_prior = (1. / num_classes) * tf.ones_like(y)
+def auxiliary_elbo(x_logits, x, y, qz, qa, pa):
+    log_px = tf_bernoulli_log_lik(x_true=x, logits=x_logits)
+    log_qz = tf_normal_log_lik(x=qz[0], mu=qz[1], log_var=qz[2], axis=1)
+    log_qa = tf_normal_log_lik(x=qa[0], mu=qa[1], log_var=qa[2])
 
-    log_px = -tf.reduce_sum(tf_binary_xentropy(x_true=x, x_approx=x_recon))
-    log_qz = tf.reduce_sum(tf_normal_logpdf(x=qz[0], mu=qz[1], log_var=qz[2]), 1)
-    log_qa = tf.reduce_sum(tf_normal_logpdf(x=qa[0], mu=qa[1], log_var=qa[2]))
-
-    log_pz = tf.reduce_sum(tf_stdnormal_logpdf(x=qz[0]))
-    log_py = -tf.nn.softmax_cross_entropy_with_logits(logits=y_prior, labels=y)
-    log_pa = tf.reduce_sum(tf_normal_logpdf(x=qa[0], mu=pa[1], log_var=pa[2]))
+    log_pz = tf_stdnormal_log_lik(x=qz[0])
+    log_py = tf_uniform_categorical_log_prior(y)
+    log_pa = tf_normal_log_lik(x=qa[0], mu=pa[1], log_var=pa[2])
 
     return log_px + log_py + log_pz + log_pa - log_qa - log_qz
+
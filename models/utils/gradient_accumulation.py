@@ -0,0 +1,40 @@
+import tensorflow as tf
+
+
+class GradientAccumulator(object):
+    """Gradient accumulation over accumulate_steps micro-batches for an optimizer.
+
+    minimize(loss) returns the op every training step runs: with accumulate_steps=1 the optimizer's own minimize,
+    otherwise an op adding the gradients of loss to non-trainable accumulators. The training loop calls
+    step(session, i) after every training step; every accumulate_steps steps it applies the mean of the accumulated
+    gradients with one optimizer update and zeroes the accumulators. The costs are normalized per batch, so the mean
+    keeps their scale and the learning rate does not depend on accumulate_steps.
+    """
+
+    def __init__(self, optimizer, accumulate_steps=1):
+        self.optimizer = optimizer
+        self.accumulate_steps = accumulate_steps
+        self.apply_op = None
+
+    def minimize(self, loss, var_list=None):
+        if self.accumulate_steps == 1:
+            return self.optimizer.minimize(loss, var_list=var_list)
+        grads_and_vars = [(grad, var) for grad, var in self.optimizer.compute_gradients(loss, var_list=var_list)
+                          if grad is not None]
+        with tf.name_scope('gradient_accumulation'):
+            # Only the accumulate op takes the control dependencies of the caller's context; the update runs on its
+            # own without feeds, so the accumulators and the update are built outside them
+            with tf.control_dependencies(None):
+                accumulators = [tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False)
+                                for _, var in grads_and_vars]
+                update = self.optimizer.apply_gradients([(acc / float(self.accumulate_steps), var)
+                                                         for acc, (_, var) in zip(accumulators, grads_and_vars)])
+                with tf.control_dependencies([update]):
+                    self.apply_op = tf.group(*[acc.assign(tf.zeros_like(acc)) for acc in accumulators])
+            accumulate = tf.group(*[acc.assign_add(tf.convert_to_tensor(grad))
+                                    for acc, (grad, _) in zip(accumulators, grads_and_vars)])
+        return accumulate
+
+    def step(self, session, step):
+        if self.apply_op is not None and (step + 1) % self.accumulate_steps == 0:
+            session.run(self.apply_op)
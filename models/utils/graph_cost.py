@@ -0,0 +1,99 @@
+from collections import defaultdict
+
+import numpy as np
+import tensorflow as tf
+
+from models.utils.profiling import scope_name
+
+# One float op per output element
+ELEMENTWISE_OPS = {'Add', 'Sub', 'Mul', 'Div', 'RealDiv', 'Maximum', 'Minimum', 'SquaredDifference', 'BiasAdd',
+                   'Relu', 'Elu', 'Sigmoid', 'Tanh', 'Softplus', 'Exp', 'Log', 'Log1p', 'Square', 'Sqrt', 'Rsqrt',
+                   'Neg', 'Abs', 'Reciprocal', 'Softmax', 'LogSoftmax'}
+# One float op per input element
+REDUCTION_OPS = {'Sum', 'Mean', 'Max', 'Min', 'Prod'}
+
+
+def num_elements(tensor):
+    shape = tensor.get_shape()
+    return shape.num_elements() if shape.is_fully_defined() else None
+
+
+def op_flops(op):
+    # Float ops of one op from its static shapes, None when a shape is unknown
+    if op.type in ('MatMul', 'BatchMatMul'):
+        a_shape, out = op.inputs[0].get_shape(), num_elements(op.outputs[0])
+        if out is None or not a_shape.is_fully_defined():
+            return None
+        transpose_a = op.get_attr('transpose_a' if op.type == 'MatMul' else 'adj_x')
+        k = a_shape.as_list()[-2 if transpose_a else -1]
+        return 2 * out * k
+    if op.type == 'Conv2D':
+        kernel, out = op.inputs[1].get_shape(), num_elements(op.outputs[0])
+        if out is None or not kernel.is_fully_defined():
+            return None
+        k_h, k_w, in_channels, _ = kernel.as_list()
+        return 2 * out * k_h * k_w * in_channels
+    if op.type in ('Conv2DBackpropInput', 'Conv2DBackpropFilter'):
+        # Both multiply every element of the out_backprop input with a k_h x k_w x channels window
+        kernel = op.inputs[1].get_shape() if op.type == 'Conv2DBackpropInput' else op.outputs[0].get_shape()
+        grad = num_elements(op.inputs[2])
+        if grad is None or not kernel.is_fully_defined():
+            return None
+        k_h, k_w, in_channels, _ = kernel.as_list()
+        return 2 * grad * k_h * k_w * in_channels
+    if op.type == 'AddN':
+        out = num_elements(op.outputs[0])
+        return None if out is None else out * (len(op.inputs) - 1)
+    if op.type in ELEMENTWISE_OPS:
+        return num_elements(op.outputs[0])
+    if op.type in REDUCTION_OPS:
+        return num_elements(op.inputs[0])
+    return 0
+
+
+def with_batch_size(graph, batch_size, placeholder_sizes=None):
+    # Copy of the graph whose placeholders have a fixed batch dimension, so that static shapes are fully defined.
+    # Placeholders are fixed at batch_size, the batch size the model was built for, or at placeholder_sizes[name] by
+    # name without scope, so that they agree with constants built for that batch such as one_label_tensor
+    placeholder_sizes = placeholder_sizes or {}
+    graph_def = graph.as_graph_def()
+    for node in graph_def.node:
+        if node.op in ('Placeholder', 'PlaceholderWithDefault') and 'shape' in node.attr:
+            dims = node.attr['shape'].shape.dim
+            if len(dims) > 0 and dims[0].size == -1:
+                dims[0].size = placeholder_sizes.get(node.name.split('/')[-1], batch_size)
+    fixed = tf.Graph()
+    with fixed.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return fixed
+
+
+def graph_cost(graph, batch_size, placeholder_sizes=None):
+    """Static cost of a model graph per top level scope (see profiling.scope_name).
+
+    params counts the trainable variables, ops the graph ops and flops_per_example the float ops of MatMul, Conv2D,
+    elementwise and reduction ops of one training step at batch_size (see with_batch_size), divided by batch_size;
+    ops whose shapes cannot be inferred are counted in unresolved_ops. forward_flops_per_example excludes the
+    optimizer scope (backward pass + Adam).
+    """
+    scopes = defaultdict(lambda: {'params': 0, 'ops': 0, 'flops_per_example': 0, 'unresolved_ops': 0})
+    with graph.as_default():
+        for variable in tf.trainable_variables():
+            scopes[scope_name(variable.op.name)]['params'] += variable.get_shape().num_elements()
+
+    for op in with_batch_size(graph, batch_size, placeholder_sizes).get_operations():
+        scope = scopes[scope_name(op.name, op.type)]
+        scope['ops'] += 1
+        flops = op_flops(op)
+        if flops is None:
+            scope['unresolved_ops'] += 1
+        else:
+            scope['flops_per_example'] += int(flops)
+
+    scopes = {name: dict(cost, flops_per_example=int(cost['flops_per_example'] // batch_size))
+              for name, cost in scopes.items()}
+    total = {key: int(np.sum([cost[key] for cost in scopes.values()])) for key in
+             ('params', 'ops', 'flops_per_example', 'unresolved_ops')}
+    total['forward_flops_per_example'] = total['flops_per_example'] - scopes.get('optimizer', {}).get(
+        'flops_per_example', 0)
+    return {'total': total, 'scopes': scopes}
@@ -0,0 +1,117 @@
+'''
+Offline reader for the MNIST IDX files with the train/validation/test interface of
+tensorflow.examples.tutorials.mnist.input_data.read_data_sets.
+
+The .gz files are decompressed once into a cache directory and the raw ubyte files are memory-mapped.
+As with input_data the images are float32 in [0, 1], but they are views on the uint8 file that scale only the rows
+taken from them instead of float copies decompressed on every run.
+'''
+import gzip
+import os
+import shutil
+
+import numpy as np
+
+TRAIN_IMAGES = 'train-images-idx3-ubyte'
+TRAIN_LABELS = 'train-labels-idx1-ubyte'
+TEST_IMAGES = 't10k-images-idx3-ubyte'
+TEST_LABELS = 't10k-labels-idx1-ubyte'
+
+# IDX magic number: two zero bytes, the element type (0x08 = ubyte) and the number of dimensions
+IDX_UBYTE = 0x08
+
+
+class ScaledImages(object):
+    """float32 images in [0, 1] over uint8 rows.
+
+    Like a numpy array, slicing rows returns another view; any other key, e.g. an index array or a single row,
+    returns the scaled float32 copy of the selected pixels. np.asarray scales the whole array.
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return ScaledImages(self.raw[key])
+        return self.raw[key].astype(np.float32) * np.float32(1.0 / 255)
+
+    def __array__(self, dtype=None):
+        images = self.raw.astype(np.float32) * np.float32(1.0 / 255)
+        return images if dtype is None else images.astype(dtype, copy=False)
+
+
+class DataSet(object):
+    def __init__(self, images, labels, one_hot, num_classes=10):
+        assert images.shape[0] == labels.shape[0], 'images.shape: {} labels.shape: {}'.format(images.shape,
+                                                                                               labels.shape)
+        self.num_examples = images.shape[0]
+        # [num_examples, rows * cols] uint8 view on the memory-mapped file
+        self.raw_images = images.reshape(self.num_examples, -1)
+        # The same images scaled to float32 in [0, 1], as returned by input_data
+        self.images = ScaledImages(self.raw_images)
+        self.labels = np.eye(num_classes, dtype=np.float32)[labels] if one_hot else labels
+
+    def float_images(self, start=0, stop=None):
+        # Scaled copy of a range of images
+        return np.asarray(self.images[start:stop])
+
+
+class DataSets(object):
+    def __init__(self, train, validation, test):
+        self.train = train
+        self.validation = validation
+        self.test = test
+
+
+def maybe_decompress(data_dir, name, cache_dir):
+    path = os.path.join(cache_dir, name)
+    if os.path.exists(path):
+        return path
+    raw_path = os.path.join(data_dir, name)
+    if os.path.exists(raw_path):
+        return raw_path
+    gz_path = raw_path + '.gz'
+    if not os.path.exists(gz_path):
+        raise IOError('{} not found: copy the MNIST IDX files into {}'.format(gz_path, data_dir))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    print("Decompressing {} into {}".format(gz_path, cache_dir))
+    tmp_path = path + '.tmp'
+    with gzip.open(gz_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.rename(tmp_path, path)
+    return path
+
+
+def read_idx(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+        if magic[0] != 0 or magic[1] != 0 or magic[2] != IDX_UBYTE:
+            raise ValueError('Invalid IDX ubyte file: {}'.format(path))
+        num_dims = magic[3]
+        shape = tuple(np.frombuffer(f.read(4 * num_dims), dtype='>i4'))
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=4 + 4 * num_dims, shape=shape)
+
+
+def read_data_sets(data_dir, one_hot=False, validation_size=5000, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(data_dir, 'ubyte')
+    train_images, train_labels, test_images, test_labels = [
+        read_idx(maybe_decompress(data_dir, name, cache_dir)) for name in
+        (TRAIN_IMAGES, TRAIN_LABELS, TEST_IMAGES, TEST_LABELS)]
+
+    # Same split as input_data: the first validation_size training examples are held out
+    validation = DataSet(train_images[:validation_size], train_labels[:validation_size], one_hot)
+    train = DataSet(train_images[validation_size:], train_labels[validation_size:], one_hot)
+    test = DataSet(test_images, test_labels, one_hot)
+    return DataSets(train=train, validation=validation, test=test)
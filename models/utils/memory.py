@@ -0,0 +1,82 @@
+import logging
+import os
+import resource
+
+import tensorflow as tf
+
+COLUMNS = ['rss_mb', 'peak_rss_mb', 'delta_rss_mb', 'tf_in_use_mb', 'tf_peak_mb']
+
+
+def process_memory_mb():
+    # (current, peak) resident set size of this process; /proc is Linux only, elsewhere only the peak is known
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) / 1024.0, int(status['VmHWM'].split()[0]) / 1024.0
+    except (IOError, KeyError):
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class MemoryProfiler(object):
+    """Process RSS and TensorFlow allocator bytes at phase boundaries (data load, graph build, epoch, validation,
+    encode, test).
+
+    record(phase) appends a row and, once attach(session, run_dir) has been called, rewrites memory_by_phase.txt in
+    the run directory, so the table is on disk up to the last phase even when the process is killed for running out of
+    memory. Allocator stats come from tf.contrib.memory_stats; they are left empty when the ops are not available in
+    the installed TensorFlow or not supported on the device.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.run_dir = None
+        self.session = None
+        self.allocator_ops = None
+
+    def attach(self, session, run_dir):
+        self.run_dir = run_dir
+        try:
+            from tensorflow.contrib.memory_stats import BytesInUse, MaxBytesInUse
+        except ImportError:
+            logging.debug("tf.contrib.memory_stats not available, recording RSS only")
+            return
+        with session.graph.as_default(), tf.name_scope('memory_stats'):
+            self.allocator_ops = [BytesInUse(), MaxBytesInUse()]
+        self.session = session
+
+    def allocator_mb(self):
+        if self.allocator_ops is None:
+            return None, None
+        try:
+            in_use, peak = self.session.run(self.allocator_ops)
+        except tf.errors.OpError as e:
+            logging.debug("allocator stats unavailable ({}), recording RSS only".format(e.message))
+            self.allocator_ops = None
+            return None, None
+        return in_use / 1024.0 ** 2, peak / 1024.0 ** 2
+
+    def record(self, phase, step=None):
+        rss, peak_rss = process_memory_mb()
+        in_use, peak = self.allocator_mb()
+        previous = self.rows[-1]['rss_mb'] if self.rows else None
+        self.rows.append({'phase': phase, 'step': step, 'rss_mb': rss, 'peak_rss_mb': peak_rss,
+                          'delta_rss_mb': rss - previous if rss is not None and previous is not None else None,
+                          'tf_in_use_mb': in_use, 'tf_peak_mb': peak})
+        logging.debug("memory " + self.format_row(self.rows[-1]))
+        if self.run_dir is not None:
+            self.write()
+
+    @staticmethod
+    def format_row(row):
+        values = ["{:>14}".format('-') if row[c] is None else "{:>14.1f}".format(row[c]) for c in COLUMNS]
+        return "{:<14}{:>8}".format(row['phase'], '-' if row['step'] is None else row['step']) + "".join(values)
+
+    def table(self):
+        header = "{:<14}{:>8}".format('phase', 'step') + "".join("{:>14}".format(c) for c in COLUMNS)
+        return "\n".join([header] + [self.format_row(row) for row in self.rows])
+
+    def write(self):
+        if not os.path.exists(self.run_dir):
+            os.makedirs(self.run_dir)
+        with open(os.path.join(self.run_dir, 'memory_by_phase.txt'), 'w') as f:
+            f.write(self.table() + "\n")
@@ -1,11 +1,22 @@
-import matplotlib
-
-matplotlib.use('Agg')
-print("matplotlib: %s, %s" % (matplotlib.__version__, matplotlib.__file__))
-import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import confusion_matrix
-from  sklearn.metrics import roc_curve, auc
+
+from models.utils.reports import report_renderer, tile_images
+
+# matplotlib.pyplot once pyplot() has loaded it
+_plt = None
+
+
+def pyplot():
+    # matplotlib and sklearn are imported by the functions that plot, so that importing a model for training or
+    # inference does not pay for them
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        print("matplotlib: %s, %s" % (matplotlib.__version__, matplotlib.__file__))
+        import matplotlib.pyplot as plt
+        _plt = plt
+    return _plt
 
 
 def convert_labels_to_cls(labels):
@@ -18,13 +29,25 @@ def cls_accuracy(correct):
     return acc, correct_sum
 
 
+def confusion_matrix(cls_true, cls_pred, num_classes):
+    # counts[true class, predicted class]
+    return np.bincount(cls_true * num_classes + cls_pred, minlength=num_classes ** 2).reshape(num_classes, num_classes)
+
+
 def plot_confusion_matrix(cls_pred, labels, logging):
     cls_true = convert_labels_to_cls(labels)
-    cm = confusion_matrix(y_true=cls_true,
-                          y_pred=cls_pred)
+    cm = confusion_matrix(cls_true=cls_true, cls_pred=np.asarray(cls_pred, dtype=cls_true.dtype),
+                          num_classes=labels.shape[1])
     print(cm)
     logging.debug(cm)
+    report_renderer.add('confusion_matrix', cm=cm, name='confusion_matrix')
+
+
+def _render_confusion_matrix(cm, name):
+    plt = pyplot()
     plt.matshow(cm)
+    plt.savefig(name)
+    plt.close()
 
 
 def print_test_accuracy(correct, cls_pred, labels, logging):
@@ -42,6 +65,12 @@ def print_test_accuracy(correct, cls_pred, labels, logging):
 
 
 def plot_roc(logits, y_true, n_classes, name):
+    report_renderer.add('roc', logits=logits, y_true=y_true, n_classes=n_classes, name=name)
+
+
+def _render_roc(logits, y_true, n_classes, name):
+    from sklearn.metrics import roc_curve, auc
+    plt = pyplot()
     # Compute ROC curve and ROC area for each class
     fpr = dict()
     tpr = dict()
@@ -68,34 +97,30 @@ def plot_roc(logits, y_true, n_classes, name):
     plt.legend(loc="lower right")
     save_path = name + "ROC"
     plt.savefig(save_path)
+    plt.close()
 
 
 def plot_images(x_test, x_reconstruct, n_images, name):
     assert len(x_test) == n_images
     print("x_reconstruct:{}, x_test:{}".format(x_reconstruct.shape, x_test.shape))
+    report_renderer.add('images', x_test=x_test, x_reconstruct=x_reconstruct, name=name)
 
-    plt.figure(figsize=(8, 12))
-    for i in range(n_images):
-        # Plot image.
-        plt.subplot(n_images, 2, 2 * i + 1)
-        s1 = plt.imshow(x_test[i].reshape(28, 28), vmin=0, vmax=1, cmap="gray")
-        plt.title("Test input")
-        plt.subplot(n_images, 2, 2 * i + 2)
-        s2 = plt.imshow(x_reconstruct[i].reshape(28, 28), vmin=0, vmax=1, cmap="gray")
-        plt.title("Reconstruction")
-        s1.axes.get_xaxis().set_visible(False)
-        s1.axes.get_yaxis().set_visible(False)
-        s2.axes.get_xaxis().set_visible(False)
-        s2.axes.get_yaxis().set_visible(False)
-
-    # plt.title("Left: Test input and Right: Reconstruction")
-    plt.tight_layout()
-    save_path = name + "_reconstructed_digit"
-    plt.savefig(save_path)
-    # plt.axis('off')
+
+def _render_images(x_test, x_reconstruct, name):
+    # One row per image: test input on the left, reconstruction on the right
+    pairs = np.stack([np.reshape(x_test, (len(x_test), -1)), np.reshape(x_reconstruct, (len(x_test), -1))], axis=1)
+    montage = tile_images(pairs.reshape(-1, 28 * 28), num_cols=2)
+    save_path = name + "_reconstructed_digit.png"
+    pyplot().imsave(save_path, montage, vmin=0, vmax=1, cmap="gray")
 
 
 def plot_cost(training, validation, name, epochs, best_epoch):
+    report_renderer.add('cost', training=training, validation=validation, name=name, epochs=epochs,
+                        best_epoch=best_epoch)
+
+
+def _render_cost(training, validation, name, epochs, best_epoch):
+    plt = pyplot()
     x = np.arange(start=0, stop=len(training), step=1).tolist()
     plt.figure()
     plt.xlim(min(x), max(x))
@@ -108,9 +133,15 @@ def plot_cost(training, validation, name, epochs, best_epoch):
     plt.xlabel('Iteration')
     plt.legend(loc='best')
     plt.savefig(name)
+    plt.close()
 
 
 def plot_line(input_func, name, epochs, best_epoch):
+    report_renderer.add('line', input_func=input_func, name=name, epochs=epochs, best_epoch=best_epoch)
+
+
+def _render_line(input_func, name, epochs, best_epoch):
+    plt = pyplot()
     x = np.arange(start=0, stop=len(input_func), step=1).tolist()
     plt.figure()
     plt.xlim(min(x), max(x))
@@ -121,3 +152,4 @@ def plot_line(input_func, name, epochs, best_epoch):
     plt.xlabel('Iteration')
     plt.legend(loc='best')
     plt.savefig(name)
+    plt.close()
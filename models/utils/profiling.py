@@ -0,0 +1,112 @@
+import logging
+import os
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from models.utils.tf_helpers import session_callable
+
+OPTIMIZER_SCOPES = ('gradients', 'Adam')
+FEED_PREFIXES = ('_recv_', '_send_', '_retval_', '_arg_')
+
+
+def op_type(node_stats):
+    # timeline_label looks like "name = OpType(input, ...)"
+    label = node_stats.timeline_label
+    if ' = ' not in label:
+        return ''
+    return label.split(' = ', 1)[1].split('(', 1)[0]
+
+
+def scope_name(name, type_name=''):
+    # Top level name scope of an op, with the backward pass and Adam updates grouped as optimizer
+    if name.startswith(FEED_PREFIXES):
+        return 'feeding'
+    if type_name.endswith('Summary'):
+        return 'summaries'
+    scope = name.split('/', 1)[0]
+    if scope.startswith(OPTIMIZER_SCOPES) or scope.startswith('beta1_power') or scope.startswith('beta2_power'):
+        return 'optimizer'
+    if '/' not in name:
+        return 'top_level'
+    return scope
+
+
+def scope_of(node_stats):
+    return scope_name(node_stats.node_name, op_type(node_stats))
+
+
+class StepTracer(object):
+    """Full-trace profiling of a window of training steps.
+
+    Steps in [start, start + num_steps) run with FULL_TRACE; each writes a Chrome trace (open in chrome://tracing)
+    to the run directory. close(), called by the training loop when it ends, writes the op time of the traced steps
+    summed per top level name scope (encoder_M2, decoder_M2, y_classifier, ..., with gradients/Adam as optimizer and
+    *Summary ops as summaries) to step_time_breakdown.txt, also when training stopped inside the window. With
+    trace_steps=None run() is a plain session.run. make_step() builds the training step with
+    tf_helpers.session_callable and only goes through run() for the traced steps.
+    """
+
+    def __init__(self, run_dir, trace_steps=None):
+        self.run_dir = run_dir
+        self.start_step, self.num_steps = trace_steps if trace_steps else (0, 0)
+        self.scope_micros = defaultdict(int)
+        self.traced_steps = 0
+
+    def tracing(self, step):
+        return self.start_step <= step < self.start_step + self.num_steps
+
+    def make_step(self, session, fetches, feed_list):
+        # step_fn(step, *feed_values) with the values in feed_list order
+        run_callable = session_callable(session, fetches, feed_list)
+
+        def step_fn(step, *feed_values):
+            if self.tracing(step):
+                return self.run(session, fetches, dict(zip(feed_list, feed_values)), step)
+            return run_callable(*feed_values)
+
+        return step_fn
+
+    def run(self, session, fetches, feed_dict, step):
+        if not self.tracing(step):
+            return session.run(fetches, feed_dict=feed_dict)
+        run_metadata = tf.RunMetadata()
+        results = session.run(fetches, feed_dict=feed_dict,
+                              options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                              run_metadata=run_metadata)
+        self.record(run_metadata.step_stats, step)
+        return results
+
+    def record(self, step_stats, step):
+        if not os.path.exists(self.run_dir):
+            os.makedirs(self.run_dir)
+        trace = timeline.Timeline(step_stats).generate_chrome_trace_format()
+        with open(os.path.join(self.run_dir, 'timeline_step_{}.json'.format(step)), 'w') as f:
+            f.write(trace)
+        for dev_stats in step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                self.scope_micros[scope_of(node_stats)] += node_stats.all_end_rel_micros
+        self.traced_steps += 1
+
+    def breakdown(self):
+        # [(scope, ms per step, share of the summed op time)] sorted by time
+        total = float(sum(self.scope_micros.values())) or 1.0
+        steps = max(self.traced_steps, 1)
+        return [(scope, micros / 1000.0 / steps, micros / total) for scope, micros in
+                sorted(self.scope_micros.items(), key=lambda item: -item[1])]
+
+    def close(self):
+        if self.traced_steps > 0:
+            self.write_breakdown()
+
+    def write_breakdown(self):
+        lines = ["{:<30}{:>14}{:>10}".format('scope', 'ms/step', 'share')]
+        lines += ["{:<30}{:>14.3f}{:>10.1%}".format(scope, ms, share) for scope, ms, share in self.breakdown()]
+        table = "\n".join(lines)
+        path = os.path.join(self.run_dir, 'step_time_breakdown.txt')
+        with open(path, 'w') as f:
+            f.write("traced steps: {} (from step {})\n".format(self.traced_steps, self.start_step))
+            f.write(table + "\n")
+        print(table)
+        logging.debug("step time breakdown written to {}\n{}".format(path, table))
@@ -0,0 +1,104 @@
+import atexit
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def tile_images(images, num_cols, image_shape=(28, 28), pad=1, pad_value=1.0):
+    # Montage of flattened images, row by row in a grid with num_cols columns, as a single 2D array
+    images = np.asarray(images, dtype=np.float32).reshape((-1,) + tuple(image_shape))
+    num_rows = -(-len(images) // num_cols)
+    height, width = image_shape
+    grid = np.full((num_rows * num_cols, height + pad, width + pad), pad_value, dtype=np.float32)
+    grid[:len(images), :height, :width] = images
+    grid = grid.reshape(num_rows, num_cols, height + pad, width + pad).transpose(0, 2, 1, 3)
+    return grid.reshape(num_rows * (height + pad), num_cols * (width + pad))[:-pad or None, :-pad or None]
+
+
+class ReportRenderer(object):
+    """Renders plots off the training process.
+
+    add(kind, **kwargs) queues a call of metrics._render_<kind>(**kwargs); submit() writes the queued arrays to a
+    temporary directory and starts a detached python process that renders them in the current working directory, so
+    the training process can carry on or exit straight away. Pending jobs are submitted at exit. With
+    background=False the jobs are rendered in this process instead.
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        self.jobs = []
+        atexit.register(self.submit)
+
+    def add(self, kind, **kwargs):
+        self.jobs.append((kind, kwargs))
+
+    def submit(self):
+        if not self.jobs:
+            return
+        jobs, self.jobs = self.jobs, []
+        if not self.background:
+            render_jobs(jobs)
+            return
+        job_dir = tempfile.mkdtemp(prefix='reports-')
+        save_jobs(jobs, job_dir)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        with open(os.path.join(job_dir, 'render.log'), 'w') as log:
+            subprocess.Popen([sys.executable, '-m', 'models.utils.reports', job_dir], cwd=os.getcwd(), env=env,
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        print("Rendering {} report(s) in the background, log in {}".format(len(jobs), job_dir))
+        logging.debug("report jobs {} submitted to {}".format([kind for kind, _ in jobs], job_dir))
+
+
+def save_jobs(jobs, job_dir):
+    # Arrays go to an npz file, everything else to the JSON job list
+    arrays, specs = {}, []
+    for i, (kind, kwargs) in enumerate(jobs):
+        spec = {'kind': kind, 'kwargs': {}, 'arrays': []}
+        for key, value in kwargs.items():
+            if isinstance(value, (np.ndarray, list, tuple)):
+                arrays['{}_{}'.format(i, key)] = np.asarray(value)
+                spec['arrays'].append(key)
+            else:
+                spec['kwargs'][key] = value.item() if isinstance(value, np.generic) else value
+        specs.append(spec)
+    np.savez(os.path.join(job_dir, 'arrays.npz'), **arrays)
+    with open(os.path.join(job_dir, 'jobs.json'), 'w') as f:
+        json.dump(specs, f)
+
+
+def load_jobs(job_dir):
+    with open(os.path.join(job_dir, 'jobs.json')) as f:
+        specs = json.load(f)
+    arrays = np.load(os.path.join(job_dir, 'arrays.npz'))
+    jobs = []
+    for i, spec in enumerate(specs):
+        kwargs = dict(spec['kwargs'])
+        for key in spec['arrays']:
+            kwargs[key] = arrays['{}_{}'.format(i, key)]
+        jobs.append((spec['kind'], kwargs))
+    return jobs
+
+
+def render_jobs(jobs):
+    from models.utils import metrics
+    for kind, kwargs in jobs:
+        getattr(metrics, '_render_' + kind)(**kwargs)
+        print("rendered {} {}".format(kind, kwargs.get('name', '')))
+
+
+report_renderer = ReportRenderer()
+
+if __name__ == '__main__':
+    # Worker started by ReportRenderer.submit(); the job directory is kept when rendering fails, for its log
+    job_dir = sys.argv[1]
+    render_jobs(load_jobs(job_dir))
+    shutil.rmtree(job_dir)
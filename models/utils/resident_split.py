@@ -0,0 +1,44 @@
+import numpy as np
+import tensorflow as tf
+
+
+class ResidentSplit(object):
+    """A small training split held in the session for the whole run, with its minibatches drawn in the graph.
+
+    load(session, *arrays) copies the arrays once into non-trainable variables of the given dtypes (float32 by
+    default, uint8 keeps compact images encoded); sample(batch_size) returns one tensor per array of batch_size rows
+    gathered at the same random indices, drawn uniformly over the examples or, with balance_classes, uniformly over
+    the classes of the one-hot labels at label_index. The variables are kept out of the variable collections, so the
+    global and local initializers and the Saver leave them alone.
+    """
+
+    def __init__(self, shapes, name='resident_split', label_index=-1, dtypes=None):
+        self.shapes = shapes
+        self.dtypes = dtypes or [tf.float32] * len(shapes)
+        self.name = name
+        self.label_index = label_index
+        with tf.name_scope(name):
+            self.inputs = [tf.placeholder(dtype, shape=shape) for dtype, shape in zip(self.dtypes, shapes)]
+            self.variables = [tf.Variable(value, trainable=False, collections=[], validate_shape=False)
+                              for value in self.inputs]
+
+    def sample(self, batch_size, balance_classes=False):
+        with tf.name_scope(self.name):
+            num_rows = tf.shape(self.variables[0])[0]
+            if balance_classes:
+                # Every example weighted by one over the size of its class
+                labels = self.variables[self.label_index]
+                class_sizes = tf.reduce_sum(labels * tf.reduce_sum(labels, 0), 1)
+                idx = tf.cast(tf.multinomial(tf.expand_dims(-tf.log(class_sizes), 0), batch_size)[0], tf.int32)
+            else:
+                idx = tf.random_uniform([batch_size], maxval=num_rows, dtype=tf.int32)
+            batch = []
+            for variable, shape in zip(self.variables, self.shapes):
+                rows = tf.gather(variable, idx)
+                rows.set_shape([batch_size] + list(shape[1:]))
+                batch.append(rows)
+        return batch
+
+    def load(self, session, *arrays):
+        session.run([variable.initializer for variable in self.variables],
+                    feed_dict={p: np.asarray(a, dtype=p.dtype.as_numpy_dtype) for p, a in zip(self.inputs, arrays)})
@@ -0,0 +1,117 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+class IndexedRows(object):
+    """Rows of a shared base array selected by an integer index array.
+
+    Only the index is stored per split; slicing gathers the selected rows from the base, so batching code
+    such as get_next_batch works unchanged and only ever copies one batch. The base may itself be a
+    CompactImages, in which case the gathered rows stay encoded.
+    """
+
+    def __init__(self, base, index):
+        self.base = base
+        self.index = np.asarray(index, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return (len(self.index),) + tuple(self.base.shape[1:])
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, (int, np.integer)):
+            return self.base[self.index[rows]][cols]
+        return self.base[self.index[rows]][:, cols]
+
+    def __array__(self, dtype=None):
+        rows = np.asarray(self.base[self.index])
+        return rows if dtype is None else rows.astype(dtype, copy=False)
+
+
+def concatenate_rows(arrays):
+    # Views on the same base concatenate their indices; returns None when a copy is unavoidable
+    if all(isinstance(a, IndexedRows) for a in arrays) and len(set(id(a.base) for a in arrays)) == 1:
+        return IndexedRows(base=arrays[0].base, index=np.concatenate([a.index for a in arrays]))
+    return None
+
+
+class SemiSupervisedSplit(object):
+    """Labeled/unlabeled split of a training set stored as index arrays into the training arrays.
+
+    per_class[i] holds the shuffled indices of class i, its first n_labeled / num_classes entries are labeled.
+    labeled and unlabeled are shuffled across classes; note that create_semisupervised, which this replaces,
+    returned both sides sorted by class. With a seed and a cache_dir the indices are saved to disk keyed by (seed,
+    n_labeled, number of examples, digest of the labels), so reruns with the same configuration and data reuse the
+    same split and a changed dataset never picks up a stale one.
+    """
+
+    def __init__(self, cls, n_labeled, num_classes=10, seed=None, cache_dir=None):
+        if n_labeled % num_classes != 0:
+            raise ValueError(
+                "n_labeled (wished number of labeled samples) not divisible by n_classes (number of classes)")
+        self.n_labeled = n_labeled
+        self.num_classes = num_classes
+        self.num_examples = len(cls)
+        self.seed = seed
+        cache_path = None
+        if seed is not None and cache_dir is not None:
+            digest = hashlib.sha256(np.ascontiguousarray(cls, dtype=np.int64).tobytes()).hexdigest()[:16]
+            cache_path = os.path.join(cache_dir, 'split_seed{}_labeled{}_n{}_{}.npz'.format(seed, n_labeled,
+                                                                                            self.num_examples, digest))
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load(cache_path)
+        else:
+            rng = np.random if seed is None else np.random.RandomState(seed)
+            self.create(np.asarray(cls), rng)
+            if cache_path is not None:
+                self.save(cache_path)
+
+    def create(self, cls, rng):
+        n_labels_per_class = self.n_labeled // self.num_classes
+        print("n_labels_per_class {}".format(n_labels_per_class))
+        self.per_class = []
+        for i in range(self.num_classes):
+            idx_i = np.where(cls == i)[0]
+            rng.shuffle(idx_i)
+            print(" class {}, num_train_per_class:{}".format(i, len(idx_i)))
+            self.per_class.append(idx_i)
+        self.labeled = np.concatenate([idx_i[:n_labels_per_class] for idx_i in self.per_class])
+        self.unlabeled = np.concatenate([idx_i[n_labels_per_class:] for idx_i in self.per_class])
+        rng.shuffle(self.labeled)
+        rng.shuffle(self.unlabeled)
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # Written to a temporary file first so that an interrupted run never leaves a truncated split behind
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, labeled=self.labeled, unlabeled=self.unlabeled,
+                 per_class=np.concatenate(self.per_class),
+                 class_sizes=np.array([len(idx_i) for idx_i in self.per_class]))
+        os.rename(tmp_path, path)
+
+    def load(self, path):
+        print("Loading split indices from {}".format(path))
+        with np.load(path) as split:
+            self.labeled, self.unlabeled = split['labeled'], split['unlabeled']
+            self.per_class = np.split(split['per_class'], np.cumsum(split['class_sizes'])[:-1])
+
+    def views(self, x, y):
+        # x_l, y_l, x_u, y_u as views on x and y
+        return IndexedRows(x, self.labeled), IndexedRows(y, self.labeled), IndexedRows(x, self.unlabeled), \
+               IndexedRows(y, self.unlabeled)
+
+    def class_views(self, x, y):
+        return [IndexedRows(x, idx_i) for idx_i in self.per_class], [IndexedRows(y, idx_i) for idx_i in
+                                                                     self.per_class]
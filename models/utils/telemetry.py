@@ -0,0 +1,84 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+
+PHASES = ('data', 'compute', 'summary', 'eval', 'checkpoint', 'other')
+
+
+class PhaseTimer(object):
+    """Wall-clock time of every training step split into phases.
+
+    The training loop calls lap(phase) after each phase, the time since the previous lap is added to that phase, and
+    end_step() after the step; time not claimed by a lap (printing, logging, loop bookkeeping) is counted as other.
+    Rows of ms per phase, total ms and examples/sec are buffered and appended every buffer_steps steps to
+    {name}.jsonl (or {name}.csv with fmt='csv') in the run directory. With summary_every set, the mean of the
+    last summary_every steps is printed every summary_every steps.
+    """
+
+    def __init__(self, run_dir, summary_every=None, fmt='jsonl', buffer_steps=100, name='telemetry'):
+        self.path = os.path.join(run_dir, name + '.' + fmt)
+        self.fmt = fmt
+        self.summary_every = summary_every
+        self.buffer_steps = buffer_steps
+        self.rows = []
+        self.recent = deque(maxlen=summary_every or 1)
+        self.written = False
+        self.start()
+
+    def start(self):
+        self.step_start = self.last = time.perf_counter()
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phase_seconds[phase] += now - self.last
+        self.last = now
+
+    def end_step(self, step, num_examples):
+        self.lap('other')
+        total = self.last - self.step_start
+        row = {'step': step, 'examples': num_examples, 'total_ms': round(total * 1000.0, 3),
+               'examples_per_sec': round(num_examples / total, 1) if total > 0 else 0.0}
+        for phase in PHASES:
+            row[phase + '_ms'] = round(self.phase_seconds[phase] * 1000.0, 3)
+        self.rows.append(row)
+        self.recent.append(row)
+        if len(self.rows) >= self.buffer_steps:
+            self.flush()
+        if self.summary_every and (step + 1) % self.summary_every == 0:
+            self.print_summary(step)
+        self.start()
+
+    def print_summary(self, step):
+        steps = float(len(self.recent))
+        total_ms = sum(row['total_ms'] for row in self.recent)
+        examples = sum(row['examples'] for row in self.recent)
+        phases = ", ".join("{} {:.1f}".format(phase, sum(row[phase + '_ms'] for row in self.recent) / steps)
+                           for phase in PHASES)
+        summary = "Step {}: {:.1f} ms/step ({}), {:.1f} examples/sec".format(
+            step + 1, total_ms / steps, phases, examples / (total_ms / 1000.0) if total_ms > 0 else 0.0)
+        print(summary)
+        logging.debug(summary)
+
+    def flush(self):
+        if not self.rows:
+            return
+        # The first flush of a run replaces the file of a previous run
+        with open(self.path, 'a' if self.written else 'w') as f:
+            if self.fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=sorted(self.rows[0]))
+                if not self.written:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+            else:
+                for row in self.rows:
+                    f.write(json.dumps(row, sort_keys=True) + "\n")
+        self.written = True
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        logging.debug("step telemetry written to {}".format(self.path))
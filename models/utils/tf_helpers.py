@@ -1,5 +1,9 @@
+import logging
+
 import tensorflow as tf
 
+from models.utils.compact_images import UINT8, BITS, encoded_features
+
 
 def mlp_neuron(layer_input, weights, biases, activation=True):
     mlp = tf.add(tf.matmul(layer_input, weights), biases)
@@ -148,33 +152,78 @@ def one_label_tensor(label, num_ulab_batch, num_classes):
     return lab
 
 
-def batch_norm_wrapper(inputs, is_training):
+def session_config(jit=False, config=None):
+    # With jit, XLA auto-clusters the compilable ops of the graph; unsupported ops stay on the regular kernels and a
+    # TensorFlow built without XLA ignores the setting. On CPU, clustering also needs
+    # TF_XLA_FLAGS=--tf_xla_cpu_global_jit in the environment before the first session, set by the entry point.
+    config = config or tf.ConfigProto()
+    if jit:
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        logging.debug("XLA JIT auto-clustering enabled")
+    return config
+
+
+def decode_images(x, encoding, num_features):
+    # float32 images in [0, 1] from rows of CompactImages: uint8 is scaled, bit-packed rows are unpacked most
+    # significant bit first like np.packbits, with integer division since TensorFlow 1.0 has no bitwise ops
+    if encoding == UINT8:
+        return tf.cast(x, tf.float32) * (1.0 / 255)
+    assert encoding == BITS, 'unknown encoding {}'.format(encoding)
+    packed = tf.cast(x, tf.int32)
+    bits = tf.stack([tf.mod(tf.floordiv(packed, 2 ** shift), 2) for shift in range(7, -1, -1)], axis=2)
+    bits = tf.reshape(bits, [-1, encoded_features(num_features, BITS) * 8])
+    return tf.cast(bits[:, :num_features], tf.float32)
+
+
+def image_input(num_features, encoding=None, name='x', default=None):
+    # Placeholder fed with rows of images stored with encoding (None for float32), or defaulting to the rows of default,
+    # and the float32 images decoded from them in the graph, which is the placeholder itself without an encoding
+    shape = [None, encoded_features(num_features, encoding)]
+    if default is not None:
+        x = tf.placeholder_with_default(default, shape=shape, name=name)
+    else:
+        x = tf.placeholder(tf.float32 if encoding is None else tf.uint8, shape=shape, name=name)
+    return x, x if encoding is None else decode_images(x, encoding, num_features)
+
+
+def session_callable(session, fetches, feed_list):
+    # Fetches of a step called with the feed values in feed_list order. Session.make_callable only exists from
+    # TensorFlow 1.2; the pinned 1.0 has none, so there this is session.run with a feed_dict and saves nothing
+    if hasattr(session, 'make_callable'):
+        return session.make_callable(fetches, feed_list=feed_list)
+
+    def run(*feed_values):
+        return session.run(fetches, feed_dict=dict(zip(feed_list, feed_values)))
+
+    return run
+
+
+def batch_norm_wrapper(inputs, is_training, decay=0.999, epsilon=1e-4):
     # http://r2rt.com/implementing-batch-normalization-in-tensorflow.html
-    pop_mean = tf.Variable(tf.zeros([inputs.get_shape()[-1]]), trainable=False)
-    pop_var = tf.Variable(tf.ones([inputs.get_shape()[-1]]), trainable=False)
+    # Normalizes with the batch statistics when is_training is true and the population statistics otherwise. Instead of
+    # a tf.cond around the layer, tf.where picks one set of statistics; both are cheap per-feature vectors, the layer
+    # itself is normalized once. The population updates go to tf.GraphKeys.UPDATE_OPS and are fetched by the training
+    # step next to the optimizer, not attached to it.
+    # fused=True is not used: under the pinned TensorFlow 1.0, tf.nn.fused_batch_norm (behind batch_norm(fused=True))
+    # only takes 4-D NHWC inputs, while these are 2-D dense layers, and takes is_training as a Python bool, which would
+    # need the tf.cond back. benchmarks/batch_norm.py measures the Auxiliary step against the tf.cond version.
+    num_features = inputs.get_shape()[-1]
+    pop_mean = tf.Variable(tf.zeros([num_features]), trainable=False)
+    pop_var = tf.Variable(tf.ones([num_features]), trainable=False)
     print("batch inputs {}".format(inputs.shape))
 
-    offset = tf.Variable(tf.zeros([inputs.shape[1]]))
-    scale = tf.Variable(tf.ones([inputs.shape[1]]))
-    epsilon = 1e-4
-    alpha = 0.999  # use numbers closer to 1 if you have more data
-
-    def batch_norm():
-        batch_mean, batch_var = tf.nn.moments(inputs, [0])
-        print("batch mean {}, var {}".format(batch_mean.shape, batch_var.shape))
-        train_mean = tf.assign(pop_mean,
-                               pop_mean * alpha + batch_mean * (1 - alpha))
-        train_var = tf.assign(pop_var,
-                              pop_var * alpha + batch_var * (1 - alpha))
-        with tf.control_dependencies([train_mean, train_var]):
-            return tf.nn.batch_normalization(inputs, mean=batch_mean, variance=batch_var, offset=offset, scale=scale,
-                                             variance_epsilon=epsilon)
-
-    def pop_norm():
-        return tf.nn.batch_normalization(inputs, pop_mean, pop_var, offset=offset, scale=scale,
-                                         variance_epsilon=epsilon)
-
-    return tf.cond(is_training, batch_norm, pop_norm)
+    offset = tf.Variable(tf.zeros([num_features]))
+    scale = tf.Variable(tf.ones([num_features]))
+
+    batch_mean, batch_var = tf.nn.moments(inputs, [0])
+    tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, tf.assign_sub(pop_mean, (pop_mean - batch_mean) * (1 - decay)))
+    tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, tf.assign_sub(pop_var, (pop_var - batch_var) * (1 - decay)))
+
+    training = tf.fill(tf.shape(pop_mean), is_training)
+    mean = tf.where(training, batch_mean, pop_mean)
+    variance = tf.where(training, batch_var, pop_var)
+    return tf.nn.batch_normalization(inputs, mean=mean, variance=variance, offset=offset, scale=scale,
+                                     variance_epsilon=epsilon)
 
 
 if __name__ == '__main__':
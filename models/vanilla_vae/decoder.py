@@ -15,7 +15,8 @@ def px_given_z1(z1, hidden_dim, input_dim, latent_dim, reuse=False):
         h1 = mlp_neuron(z1, w_h1, b_h1)
         h2 = mlp_neuron(h1, w_h2, b_h2)
         # Reconstruction layer
-        # x_mu = mlp_neuron(h2, w_mu, b_mu, activation=False)
-        x_mu = tf.nn.sigmoid(mlp_neuron(h2, w_mu, b_mu, activation=False))
+        # Logits for the fused Bernoulli log likelihood, x_mu for reconstructions
+        x_logits = mlp_neuron(h2, w_mu, b_mu, activation=False)
+        x_mu = tf.nn.sigmoid(x_logits)
         tf.summary.image('x_mu', tf.reshape(x_mu[0], [1, 28, 28, 1]))
-        return x_mu
+        return x_mu, x_logits
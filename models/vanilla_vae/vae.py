@@ -8,8 +8,15 @@ import tensorflow as tf
 
 from models.utils.MNIST_pickled_preprocess import extract_data
 from models.utils.batch_processing import get_next_batch
+from models.utils.compact_images import concatenate_images, float_rows
 from models.utils.distributions import elbo_M1, prior_weights
+from models.utils.gradient_accumulation import GradientAccumulator
+from models.utils.memory import MemoryProfiler
 from models.utils.metrics import plot_images
+from models.utils.profiling import StepTracer
+from models.utils.reports import report_renderer
+from models.utils.telemetry import PhaseTimer
+from models.utils.tf_helpers import image_input, session_config, session_callable
 from models.vanilla_vae.decoder import px_given_z1
 from models.vanilla_vae.encoder import q_z1_given_x
 
@@ -25,7 +32,13 @@ class VariationalAutoencoder(object):
                  num_iterations,
                  input_dim, latent_dim,
                  hidden_dim=600,
-                 l2_weight=0.0
+                 l2_weight=0.0,
+                 compact=None,
+                 trace_steps=None,
+                 telemetry_every=None,
+                 jit=False,
+                 accumulate_steps=1,
+                 data=None
                  ):
         self.input_dim, self.latent_dim = input_dim, latent_dim
         self.hidden_dim = hidden_dim
@@ -36,35 +49,49 @@ class VariationalAutoencoder(object):
         self.learning_rate, self.beta1, self.beta2 = learning_rate, beta1, beta2
         self.log_file = 'vanilla_vae.log'
         self.l2_loss_mult = l2_weight
+        self.compact = compact
+        # (train, valid, test) used instead of the MNIST pickle, see MNIST_pickled_preprocess.load_numpy
+        self.data = data
         logging.basicConfig(filename=self.log_file, filemode='w', level=logging.DEBUG)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        self.memory = MemoryProfiler()
+        self.accumulate_steps = accumulate_steps
 
         ''' Create Graph '''
         self.G = tf.Graph()
         with self.G.as_default():
-            self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name='x')
+            # Fed with rows of the splits as stored, compact ones are decoded to float32 in the graph
+            self.x, self.x_images = image_input(self.input_dim, self.compact, name='x')
             self._objective()
             self.saver = tf.train.Saver()
-            self.session = tf.Session()
+            self.session = tf.Session(config=session_config(jit=jit))
+            self.validation_step = session_callable(self.session, [self.cost, self.loglik], feed_list=[self.x])
             self.current_dir = os.getcwd()
             self.save_path = self.current_dir + "/summaries/vae_model"
             self.train_writer = tf.summary.FileWriter(self.save_path, self.session.graph)
+            self.tracer = StepTracer(run_dir=self.save_path, trace_steps=trace_steps)
+            self.telemetry = PhaseTimer(run_dir=self.save_path, summary_every=telemetry_every)
+            self.memory.attach(self.session, run_dir=self.save_path)
+            self.memory.record('graph_build')
             self.merged = tf.summary.merge_all()
 
     def _objective(self):
         n_train_examples = 50000
         train_x_l, train_l_y, train_u_x, train_u_y, self.valid_x, self.valid_y, self.test_x, self.test_y = extract_data(
-            n_train_examples)
+            n_train_examples, compact=self.compact, seed=self.seed, data=self.data)
+        self.memory.record('data_load')
         num_batches = int(n_train_examples / self.batch_size)
         logging.debug("num batches:{}, batch_size:{}, epochs:{}".format(num_batches, self.batch_size, int(
             self.num_iterations / num_batches)))
-        self.train_x = np.concatenate((train_x_l, train_u_x), axis=0)
-        self.train_y = np.concatenate((train_l_y, train_u_y), axis=0)
+        self.train_x = concatenate_images((train_x_l, train_u_x))
+        self.train_y = concatenate_images((train_l_y, train_u_y))
         elbo, self.x_recon_mu, self.z_sample, self.z_mu, self.z_logvar, self.loglik = self.build_model()
         self.cost = (elbo * num_batches + prior_weights()) / (-self.batch_size * num_batches)
-        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=self.beta1,
-                                                beta2=self.beta2).minimize(self.cost)
+        self.accumulator = GradientAccumulator(tf.train.AdamOptimizer(learning_rate=self.learning_rate,
+                                                                      beta1=self.beta1, beta2=self.beta2),
+                                               self.accumulate_steps)
+        self.optimizer = self.accumulator.minimize(self.cost)
 
     def train(self):
         print("Training Vanilla VAE:")
@@ -76,21 +103,30 @@ class VariationalAutoencoder(object):
         start_time = time.time()
         idx = 0
 
+        train_step = self.tracer.make_step(self.session, [self.merged, self.cost, self.loglik, self.optimizer],
+                                           feed_list=[self.x])
+        self.telemetry.start()
         for i in range(self.num_iterations):
             # Batch Training
             x_batch, _, idx = get_next_batch(self.train_x, self.train_y, idx, self.batch_size)
-            summary, batch_loss, log_lik, _ = self.session.run([self.merged, self.cost, self.loglik, self.optimizer],
-                                                               feed_dict={self.x: x_batch})
+            self.telemetry.lap('data')
+            summary, batch_loss, log_lik, _ = train_step(i, x_batch)
+            self.accumulator.step(self.session, i)
+            self.telemetry.lap('compute')
             # print("Optimization Iteration: {}, Training Loss: {}".format(i, batch_loss))
             self.train_writer.add_summary(summary, i)
+            self.telemetry.lap('summary')
 
             if (i % 100 == 0) or (i == (self.num_iterations - 1)):
                 # Calculate the accuracy
 
                 validation_loss, val_log_lik = self.validation_loss(images=self.valid_x)
+                self.telemetry.lap('eval')
+                self.memory.record('validation', step=i)
                 if validation_loss < best_validation_loss:
                     # Save  Best Perfoming all variables of the TensorFlow graph to file.
                     self.saver.save(sess=self.session, save_path=self.save_path)
+                    self.telemetry.lap('checkpoint')
                     # update best validation accuracy
                     best_validation_loss = validation_loss
                     last_improvement = i
@@ -107,11 +143,16 @@ class VariationalAutoencoder(object):
                               " Validation: Loss {}, log_lik {} {}".format(i + 1, int(batch_loss), int(log_lik),
                                                                            int(validation_loss),
                                                                            int(val_log_lik), improved_str))
+            if idx == self.train_x.shape[0]:
+                self.memory.record('epoch', step=i)
+            self.telemetry.end_step(i, self.batch_size)
             if i - last_improvement > self.require_improvement:
                 print("No improvement found in a while, stopping optimization.")
                 logging.debug("No improvement found in a while, stopping optimization.")
                 # Break o    ut from the for-loop.
                 break  # Ending time.
+        self.telemetry.close()
+        self.tracer.close()
         end_time = time.time()
         time_dif = end_time - start_time
         print("Time usage: " + str(timedelta(seconds=int(round(time_dif)))))
@@ -119,39 +160,40 @@ class VariationalAutoencoder(object):
 
     def validation_loss(self, images):
         num_images = len(images)
+        num_val_batches = int(num_images / self.batch_size)
+        print("size of valid {}".format(num_images))
         total_loss = 0.0
         total_log_lik = 0.0
         i = 0
-        num_val_batches = int(num_images / self.batch_size)
-        print("size of valid {}".format(num_images))
         while i < num_images:
             # The ending index for the next batch is denoted j.
             j = min(i + self.batch_size, num_images)
             batch_images = images[i:j, :]
-            feed_dict = {self.x: batch_images}
-            batch_loss, log_lik = self.session.run([self.cost, self.loglik], feed_dict=feed_dict)
+            batch_loss, log_lik = self.validation_step(batch_images)
             total_loss += batch_loss
             total_log_lik += log_lik
             i = j
         return total_loss / num_val_batches, total_log_lik / num_val_batches
 
     def build_model(self):
-        z, z_mu, z_logvar = q_z1_given_x(self.x, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+        z, z_mu, z_logvar = q_z1_given_x(self.x_images, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
                                          latent_dim=self.latent_dim)
-        x_mu = px_given_z1(z1=z, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
-                           latent_dim=self.latent_dim)
-        loss, log_lik = elbo_M1(x_recon=x_mu, x_true=self.x, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
+        x_mu, x_logits = px_given_z1(z1=z, hidden_dim=self.hidden_dim, input_dim=self.input_dim,
+                                     latent_dim=self.latent_dim)
+        loss, log_lik = elbo_M1(x_logits=x_logits, x_true=self.x_images, z1=z, z1_lsgms=z_logvar, z1_mu=z_mu)
         return tf.reduce_sum(loss), x_mu, z, z_mu, z_logvar, log_lik / self.batch_size
 
     def train_test(self):
         self.train()
         self.saver.restore(sess=self.session, save_path=self.save_path)
         self.test_reconstruction()
+        self.memory.record('test')
+        report_renderer.submit()
 
     def test_reconstruction(self):
         num_images = 5
         x_test = self.test_x[0:num_images, ]
-        plot_images(x_test, self.decode(x_test), num_images, "vae")
+        plot_images(float_rows(self.test_x, slice(0, num_images)), self.decode(x_test), num_images, "vae")
 
     def decode(self, x_test):
         return self.session.run(self.x_recon_mu, feed_dict={self.x: x_test})
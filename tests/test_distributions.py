@@ -0,0 +1,78 @@
+import numpy as np
+import tensorflow as tf
+
+from models.utils.distributions import tf_binary_xentropy, tf_bernoulli_log_lik, tf_gaussian_ent, tf_gaussian_kl, \
+    tf_gaussian_marg, tf_normal_logpdf, tf_normal_log_lik, tf_stdnormal_logpdf, tf_uniform_categorical_log_prior, \
+    elbo_M1, elbo_M2, compute_ELBO, auxiliary_elbo
+
+
+class FusedLossesTest(tf.test.TestCase):
+    """The fused losses against the elementwise densities they replace, on random decoder and encoder outputs."""
+
+    def setUp(self):
+        rng = np.random.RandomState(31415)
+        batch_size, input_dim, latent_dim, self.num_classes = 100, 784, 50, 10
+        self.x = (rng.uniform(size=(batch_size, input_dim)) > 0.5).astype(np.float32)
+        self.logits = rng.uniform(-8, 8, size=(batch_size, input_dim)).astype(np.float32)
+        self.y = np.eye(self.num_classes, dtype=np.float32)[rng.randint(self.num_classes, size=batch_size)]
+        self.z, self.mu, self.log_var, self.pa_mu, self.pa_log_var = [
+            rng.normal(size=(batch_size, latent_dim)).astype(np.float32) for _ in range(5)]
+
+    def log_px(self):
+        return - tf.reduce_sum(tf_binary_xentropy(x_true=self.x, x_approx=tf.nn.sigmoid(self.logits)))
+
+    def log_prior_y(self):
+        y_prior = (1. / self.num_classes) * tf.ones_like(self.y)
+        return - tf.nn.softmax_cross_entropy_with_logits(logits=y_prior, labels=self.y)
+
+    def gaussian_kl(self):
+        log_prior_z = tf.reduce_sum(tf_gaussian_marg(self.mu, self.log_var), 1)
+        log_post_z = tf.reduce_sum(tf_gaussian_ent(self.log_var), 1)
+        return log_post_z - log_prior_z
+
+    def log_qz(self):
+        return tf.reduce_sum(tf_normal_logpdf(x=self.z, mu=self.mu, log_var=self.log_var), 1)
+
+    def assertClose(self, expected, fused):
+        with self.test_session() as session:
+            expected, fused = session.run([expected, fused])
+        max_error = np.max(np.abs(expected - fused) / np.maximum(np.abs(expected), 1.0))
+        self.assertLess(max_error, 1e-4)
+
+    def test_bernoulli(self):
+        self.assertClose(self.log_px(), tf_bernoulli_log_lik(x_true=self.x, logits=self.logits))
+
+    def test_gaussian_kl(self):
+        self.assertClose(self.gaussian_kl(), tf_gaussian_kl(self.mu, self.log_var))
+
+    def test_normal(self):
+        self.assertClose(self.log_qz(), tf_normal_log_lik(x=self.z, mu=self.mu, log_var=self.log_var, axis=1))
+
+    def test_categorical_prior(self):
+        self.assertClose(self.log_prior_y(), tf_uniform_categorical_log_prior(self.y, self.num_classes))
+
+    def test_elbo_M1(self):
+        self.assertClose(self.log_px() - self.gaussian_kl(),
+                         elbo_M1(self.logits, self.x, self.z, self.mu, self.log_var)[0])
+
+    def test_elbo_M2(self):
+        self.assertClose(self.log_prior_y() + self.log_qz() - self.gaussian_kl(),
+                         elbo_M2(z1_recon=[self.mu, self.log_var], z1=self.z, y=self.y,
+                                 z2=[self.z, self.mu, self.log_var]))
+
+    def test_compute_ELBO(self):
+        self.assertClose(self.log_prior_y() + self.log_px() - self.gaussian_kl(),
+                         compute_ELBO(self.logits, self.x, self.y, [self.z, self.mu, self.log_var]))
+
+    def test_auxiliary_elbo(self):
+        log_pa = tf.reduce_sum(tf_normal_logpdf(x=self.z, mu=self.pa_mu, log_var=self.pa_log_var))
+        log_qa = tf.reduce_sum(tf_normal_logpdf(x=self.z, mu=self.mu, log_var=self.log_var))
+        log_pz = tf.reduce_sum(tf_stdnormal_logpdf(x=self.z))
+        self.assertClose(self.log_px() + self.log_prior_y() + log_pz + log_pa - log_qa - self.log_qz(),
+                         auxiliary_elbo(self.logits, self.x, self.y, qz=[self.z, self.mu, self.log_var],
+                                        qa=[self.z, self.mu, self.log_var],
+                                        pa=[self.z, self.pa_mu, self.pa_log_var]))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -40,7 +40,7 @@ if __name__ == '__main__':
     print("gpu_memory_fraction:{}".format(vm))
 
     train_x_lab, train_l_y, train_x_unlab, train_u_y, valid_x, valid_y, test_x, test_y = extract_data(
-        FLAGS['n_labeled'])
+        FLAGS['n_labeled'], seed=FLAGS['seed'])
     train_x_l_mu, train_x_l_logvar, train_x_u_mu, train_x_u_logvar, valid_x_mu, \
     valid_x_logvar, test_x_mu, test_x_logvar = encode_dataset(FLAGS=FLAGS, train_lab=train_x_lab,
                                                               train_unlab=train_x_unlab, valid=valid_x,
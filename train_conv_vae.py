@@ -25,6 +25,7 @@ def encode_dataset(FLAGS, train_lab, train_unlab, valid, test, gpu_memory_fracti
         enc_x_ulab_mean, enc_x_ulab_var = conv_vae.encode(train_unlab)
         enc_x_valid_mean, enc_x_valid_var = conv_vae.encode(valid)
         enc_x_test_mean, enc_x_test_var = conv_vae.encode(test)
+        conv_vae.memory.record('encode')
 
     return enc_x_lab_mean, enc_x_lab_var, enc_x_ulab_mean, enc_x_ulab_var, enc_x_valid_mean, \
            enc_x_valid_var, enc_x_test_mean, enc_x_test_var
@@ -59,7 +60,7 @@ if __name__ == '__main__':
         vm = 1.0
     print("gpu_memory_fraction:{}".format(vm))
     train_x_lab, train_l_y, train_x_unlab, train_u_y, valid_x, valid_y, test_x, test_y = extract_data(
-        FLAGS_['n_labeled'])
+        FLAGS_['n_labeled'], seed=FLAGS_['seed'])
 
     train_x_l_mu, train_x_l_logvar, train_x_u_mu, train_x_u_logvar, valid_x_mu, \
  \
@@ -46,7 +46,7 @@ if __name__ == '__main__':
     }
 
     train_x_l, train_l_y, train_u_x, train_u_y, valid_x, valid_y, test_x, test_y = extract_data(
-        FLAGS['n_train'])
+        FLAGS['n_train'], seed=FLAGS['seed'])
     train_x = np.concatenate((train_x_l, train_u_x), axis=0)
     train_y = np.concatenate((train_l_y, train_u_y), axis=0)
 
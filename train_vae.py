@@ -20,6 +20,7 @@ def encode_dataset(FLAGS, train_lab, train_unlab, valid, test, min_std=0.0, trai
         enc_x_ulab_mean, enc_x_ulab_var = vae.encode(train_unlab)
         enc_x_valid_mean, enc_x_valid_var = vae.encode(valid)
         enc_x_test_mean, enc_x_test_var = vae.encode(test)
+        vae.memory.record('encode')
 
         # TODO enable dim reduction
         # num_images = 20
@@ -66,7 +67,7 @@ if __name__ == '__main__':
     }
 
     train_x_lab, train_l_y, train_x_unlab, train_u_y, valid_x, valid_y, test_x, test_y = extract_data(
-        FLAGS_['n_labeled'])
+        FLAGS_['n_labeled'], seed=FLAGS_['seed'])
 
     train_x_l_mu, train_x_l_logvar, train_x_u_mu, train_x_u_logvar, valid_x_mu, \
  \